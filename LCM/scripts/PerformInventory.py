@@ -6,7 +6,13 @@ import os
 import fcntl
 import shutil
 import stat
-from xml.dom.minidom import parse
+import time
+import tempfile
+import xml.parsers.expat
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
 
 def usage():
    print("""Usage: PerformInventory.py [OPTIONS]
@@ -16,6 +22,135 @@ OPTIONS (case insensitive):
  --help
 """)
 
+# Report files are merged with expat instead of minidom so that memory
+# use doesn't grow with the size of the reports.  Every VALUE element is
+# written as minidom's toxml() would write it.
+def escape_xml(data):
+    return data.replace("&", "&amp;").replace("<", "&lt;").replace("\"", "&quot;").replace(">", "&gt;")
+
+class ValueWriter:
+    def __init__(self, out):
+        self.out = out
+        self.depth = 0
+        self.pending = None
+        self.count = 0
+
+    def write(self, data):
+        self.out.write(data.encode('utf-8'))
+
+    def flush_pending(self):
+        if self.pending is not None:
+            self.write(self.pending + '>')
+            self.pending = None
+
+    def start(self, name, attrs):
+        if self.depth == 0 and name != 'VALUE':
+            return
+        self.flush_pending()
+        self.depth += 1
+        tag = '<' + name
+        for i in range(0, len(attrs), 2):
+            tag += ' ' + attrs[i] + '="' + escape_xml(attrs[i + 1]) + '"'
+        self.pending = tag
+
+    def end(self, name):
+        if self.depth == 0:
+            return
+        self.depth -= 1
+        if self.pending is not None:
+            self.write(self.pending + '/>')
+            self.pending = None
+        else:
+            self.write('</' + name + '>')
+        if self.depth == 0:
+            self.count += 1
+
+    def data(self, data):
+        if self.depth > 0:
+            self.flush_pending()
+            self.write(escape_xml(data))
+
+def merge_report(report_file, part_file):
+    """
+    Writes the VALUE elements of report_file to part_file.  Returns the
+    number of values, the seconds it took and an error message or None.
+    """
+    start_time = time.time()
+    fin = open(report_file, 'rb')
+    fout = open(part_file, 'wb')
+    writer = ValueWriter(fout)
+    parser = xml.parsers.expat.ParserCreate()
+    parser.ordered_attributes = 1
+    parser.StartElementHandler = writer.start
+    parser.EndElementHandler = writer.end
+    parser.CharacterDataHandler = writer.data
+    error = None
+    try:
+        try:
+            while True:
+                chunk = fin.read(65536)
+                if not chunk:
+                    break
+                parser.Parse(chunk, 0)
+            parser.Parse(b'', 1)
+        except xml.parsers.expat.ExpatError:
+            error = str(sys.exc_info()[1])
+    finally:
+        fin.close()
+        fout.close()
+    return writer.count, time.time() - start_time, error
+
+def merge_report_args(args):
+    return merge_report(args[0], args[1])
+
+def merge_reports(report_files, out):
+    """
+    Merges report_files into out, in order.  The reports are parsed in
+    parallel into part files next to out, which are then copied into it.
+    Returns False if a report could not be parsed.
+    """
+    jobs = []
+    for f in report_files:
+        fd, part_file = tempfile.mkstemp(prefix=os.path.basename(f) + '.', dir=os.path.dirname(temp_report_path))
+        os.close(fd)
+        jobs.append((f, part_file))
+    try:
+        processes = 1
+        if multiprocessing is not None and len(jobs) > 1:
+            try:
+                processes = min(len(jobs), multiprocessing.cpu_count())
+            except NotImplementedError:
+                pass
+        if processes > 1:
+            # Workers must not import this script again.
+            if hasattr(multiprocessing, 'get_context'):
+                pool = multiprocessing.get_context('fork').Pool(processes)
+            else:
+                pool = multiprocessing.Pool(processes)
+            try:
+                results = pool.map(merge_report_args, jobs)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [merge_report_args(job) for job in jobs]
+        ok = True
+        for (f, part_file), (count, seconds, error) in zip(jobs, results):
+            if error is not None:
+                print("Error: unable to parse %s: %s" % (f, error))
+                ok = False
+                continue
+            print("Merged %d values from %s in %.3f seconds" % (count, f, seconds))
+            part = open(part_file, 'rb')
+            try:
+                shutil.copyfileobj(part, out)
+            finally:
+                part.close()
+        return ok
+    finally:
+        for f, part_file in jobs:
+            os.remove(part_file)
+
 Variables = dict()
 
 # Parse command line arguments
@@ -121,21 +256,23 @@ print(stdout)
 print(stderr)
 
 # combine reports together
-reportFiles = os.listdir(dsc_reportdir)
-
-final_xml_report = '<INSTANCE CLASSNAME="Inventory"><PROPERTY.ARRAY NAME="Instances" TYPE="string" EmbeddedObject="object"><VALUE.ARRAY>'
-values = []
-for f in reportFiles:
-    if not os.path.isfile(dsc_reportdir + "/" + f):
-        continue
-    d = parse(dsc_reportdir + "/" + f)
-    for valueNode in d.getElementsByTagName('VALUE'):
-        values.append(valueNode.toxml())
+reportFiles = []
+for f in os.listdir(dsc_reportdir):
+    if os.path.isfile(dsc_reportdir + "/" + f):
+        reportFiles.append(dsc_reportdir + "/" + f)
 
-final_xml_report = final_xml_report + "".join(values) + "</VALUE.ARRAY></PROPERTY.ARRAY></INSTANCE>"
+start_time = time.time()
+with os.fdopen(os.open(temp_report_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644), 'wb') as filehandle:
+  filehandle.write(b'<INSTANCE CLASSNAME="Inventory"><PROPERTY.ARRAY NAME="Instances" TYPE="string" EmbeddedObject="object"><VALUE.ARRAY>')
+  merged = merge_reports(reportFiles, filehandle)
+  filehandle.write(b'</VALUE.ARRAY></PROPERTY.ARRAY></INSTANCE>')
+print("Merged %d reports in %.3f seconds" % (len(reportFiles), time.time() - start_time))
 
-with os.fdopen(os.open(temp_report_path, os.O_WRONLY | os.O_CREAT, 0o644), 'w') as filehandle:
-  filehandle.write(final_xml_report)
+if not merged:
+    os.remove(temp_report_path)
+    fcntl.flock(inventory_lock, fcntl.LOCK_UN)
+    inventory_lock.close()
+    sys.exit(1)
 
 os.system("rm -f " + dsc_reportdir + "/*")
 shutil.move(temp_report_path, report_path)
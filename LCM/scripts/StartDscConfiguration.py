@@ -2,7 +2,7 @@
 
 # Standard library imports
 from subprocess import Popen, PIPE
-from sys import argv
+from sys import argv, exc_info
 
 try:
     # Used by Python 2.7+
@@ -13,6 +13,46 @@ except:
     from optparse import OptionParser
     useArgParse = False
 
+# omicli takes ConfigurationData, a uint8 array, as one argument per byte.
+ByteTokens = [str(i) for i in range(256)]
+
+def configuration_data_tokens(data):
+    """Returns the omicli array tokens for the bytes of a configuration mof"""
+    return [ByteTokens[b] for b in bytearray(data)]
+
+def omicli_parameters(configurationData, force):
+    """Returns the omicli command line that sends configurationData"""
+
+    # OMI CLI location
+    omiBinDir = "<CONFIG_BINDIR>"
+    omiCliPath = omiBinDir + "/omicli"
+
+    # Assemble parameters to pass to OMI CLI
+    omiCliParameters = []
+    omiCliParameters.append(omiCliPath)
+    omiCliParameters.append("iv")
+    omiCliParameters.append("<DSC_NAMESPACE>")
+    omiCliParameters.append("{")
+    omiCliParameters.append("MSFT_DSCLocalConfigurationManager")
+    omiCliParameters.append("}")
+    omiCliParameters.append("SendConfigurationApply")
+    omiCliParameters.append("{")
+    omiCliParameters.append("ConfigurationData")
+    omiCliParameters.append("[")
+
+    # Insert configurationmof data here
+    omiCliParameters.extend(configurationData)
+
+    omiCliParameters.append("]")
+
+    # Insert force if specified
+    if force:
+        omiCliParameters.append("force")
+        omiCliParameters.append("true")
+
+    omiCliParameters.append("}")
+    return omiCliParameters
+
 def main(argv):
     """StartDscConfiguration"""
 
@@ -42,7 +82,7 @@ def main(argv):
         try:
             configmofArgument = argv[configmofIndex + 1]
         except:
-            print 'StartDscConfiguration.py: error: Please provide a valid path argument for -configurationmof'
+            print('StartDscConfiguration.py: error: Please provide a valid path argument for -configurationmof')
             exit(1)
 
         # Set the configuration mof parameter to no longer be required so it doesn't error in the arugment parser
@@ -75,65 +115,36 @@ def main(argv):
         for parameter in parameters.keys():
             if parameters[parameter]['required']:
                 if not getattr(parsedArguments, parameter):
-                    print 'StartDscConfiguration.py: error: argument -' + parameters[parameter]['shortForm'] + '/--' + parameter + ' is required.'
+                    print('StartDscConfiguration.py: error: argument -' + parameters[parameter]['shortForm'] + '/--' + parameter + ' is required.')
                     exit(1)
 
     # Check that we don't have two configuration mofs defined
     if configmofArgument and parsedArguments.configurationmof:
-        print 'StartDscConfiguration.py: error: Two configuration mof arguments were found. Please provide only one.'
+        print('StartDscConfiguration.py: error: Two configuration mof arguments were found. Please provide only one.')
         exit(1)
     
     if configmofArgument:
         parsedArguments.configurationmof = configmofArgument
 
-    # Read the configuration mof
-    try:
-        configurationFile = open(parsedArguments.configurationmof, 'r')
-    except:
-        configurationFile = open(parsedArguments.configurationmof, 'r', encoding = 'utf-16')
+    # Read the configuration mof.  The LCM gets the bytes of the file as
+    # they are, including the byte order mark of a UTF-16 mof.
+    configurationFile = open(parsedArguments.configurationmof, 'rb')
 
     try:
         configurationFileContent = configurationFile.read()
     finally:
         configurationFile.close()
 
-    # Convert the file content to strings of integers representing unicode
-    configurationData = []
-    for char in configurationFileContent:
-        configurationData.append(str(ord(char)))
-
-    # OMI CLI location
-    omiBinDir = "<CONFIG_BINDIR>"
-    omiCliPath = omiBinDir + "/omicli"
-
-    # Assemble parameters to pass to OMI CLI
-    omiCliParameters = []
-    omiCliParameters.append(omiCliPath)
-    omiCliParameters.append("iv")
-    omiCliParameters.append("<DSC_NAMESPACE>")
-    omiCliParameters.append("{")
-    omiCliParameters.append("MSFT_DSCLocalConfigurationManager")
-    omiCliParameters.append("}")
-    omiCliParameters.append("SendConfigurationApply")
-    omiCliParameters.append("{")
-    omiCliParameters.append("ConfigurationData")
-    omiCliParameters.append("[")
-
-    # Insert configurationmof data here
-    for token in configurationData:
-        omiCliParameters.append(token)
-    
-    omiCliParameters.append("]")
+    configurationData = configuration_data_tokens(configurationFileContent)
+    omiCliParameters = omicli_parameters(configurationData, parsedArguments.force)
 
-    # Insert force if specified
-    if parsedArguments.force:
-        omiCliParameters.append("force")
-        omiCliParameters.append("true")
-
-    omiCliParameters.append("}")
-
-    # Call OMI CLI in subprocess
-    omiCliProcess = Popen(omiCliParameters, stdout = PIPE, stderr = PIPE)
+    # Call OMI CLI in subprocess.  A mof of more than about a quarter of
+    # ARG_MAX doesn't fit on its command line.
+    try:
+        omiCliProcess = Popen(omiCliParameters, stdout = PIPE, stderr = PIPE)
+    except OSError:
+        print('StartDscConfiguration.py: error: Unable to run omicli for a configuration mof of ' + str(len(configurationFileContent)) + ' bytes: ' + str(exc_info()[1]))
+        exit(1)
 
     # Retrieve stdout and stderr from OMI CLI call
     stdout, stderr = omiCliProcess.communicate()
@@ -142,4 +153,5 @@ def main(argv):
     print(stdout)
     print(stderr)
 
-main(argv[1:])
+if __name__ == '__main__':
+    main(argv[1:])
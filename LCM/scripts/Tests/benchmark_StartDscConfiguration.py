@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+#============================================================================
+# Copyright (c) Microsoft Corporation. All rights reserved. See license.txt for license information.
+#============================================================================
+# Measures how StartDscConfiguration.py hands a configuration mof to omicli:
+# building the ConfigurationData arguments the old way (str(ord(char)) for
+# every character) and the current way, and starting a process with them.
+# /bin/true stands in for omicli, so the push time is what exec costs;
+# omicli parsing the arguments comes on top of it.
+#
+#   python benchmark_StartDscConfiguration.py [path to StartDscConfiguration.py] [runs]
+
+import imp
+import os
+import subprocess
+import sys
+import time
+
+path = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../StartDscConfiguration.py')
+if len(sys.argv) > 1:
+    path = sys.argv[1]
+runs = 3
+if len(sys.argv) > 2:
+    runs = int(sys.argv[2])
+
+start = imp.load_source('StartDscConfiguration', path)
+
+sizes = ((10240, '10 KB'), (1048576, '1 MB'), (10485760, '10 MB'))
+
+instance = '''instance of MSFT_nxFileResource as $MSFT_nxFileResource1ref
+{
+ResourceID = "[nxFile]File%d";
+DestinationPath = "/tmp/dsc/file%d";
+Contents = "hello world";
+ModuleName = "nx";
+ModuleVersion = "1.0";
+};
+
+'''
+
+
+def mof(size):
+    lines = []
+    length = 0
+    i = 0
+    while length < size:
+        lines.append(instance % (i, i))
+        length += len(lines[-1])
+        i += 1
+    return ''.join(lines)[:size].encode('ascii')
+
+
+def old_tokens(data):
+    configurationData = []
+    for char in data.decode('ascii'):
+        configurationData.append(str(ord(char)))
+    return configurationData
+
+
+def push(parameters):
+    parameters = ['/bin/true'] + parameters[1:]
+    subprocess.call(parameters)
+
+
+def best(func, arg):
+    times = []
+    for i in range(runs):
+        t = time.time()
+        func(arg)
+        times.append(time.time() - t)
+    return min(times)
+
+
+for size, name in sizes:
+    data = mof(size)
+    if old_tokens(data) != start.configuration_data_tokens(data):
+        print('%s: the arguments differ' % name)
+        sys.exit(1)
+    old_time = best(old_tokens, data)
+    new_time = best(start.configuration_data_tokens, data)
+    parameters = start.omicli_parameters(start.configuration_data_tokens(data), False)
+    argument_bytes = 0
+    for parameter in parameters:
+        argument_bytes += len(parameter) + 1
+    try:
+        push_time = '%.1f ms' % (best(push, parameters) * 1000)
+    except OSError:
+        push_time = 'failed (%s)' % sys.exc_info()[1]
+    print('%s mof: %d argument bytes, old marshalling %.1f ms, marshalling %.1f ms, push %s' %
+          (name, argument_bytes, old_time * 1000, new_time * 1000, push_time))
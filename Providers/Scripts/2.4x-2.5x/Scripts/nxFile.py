@@ -5,15 +5,15 @@
 # ====================================
 import os
 import sys
-import pwd
 import shutil
-import grp
 import urllib2
 import time
 import imp
 protocol = imp.load_source('protocol', '../protocol.py')
 nxDSCLog = imp.load_source('nxDSCLog', '../nxDSCLog.py')
 helperlib = imp.load_source('helperlib', '../helperlib.py')
+nxHashCache = imp.load_source('nxHashCache', '../nxHashCache.py')
+nxIdentityCache = imp.load_source('nxIdentityCache', '../nxIdentityCache.py')
 
 LG = nxDSCLog.DSCLog
 try:
@@ -24,6 +24,7 @@ except ImportError:
     md5const = md5.md5
 
 BLOCK_SIZE = 8192
+COMPARE_BLOCK_SIZE = 1048576
 
 global show_mof
 show_mof = False
@@ -68,6 +69,7 @@ def Set_Marshall(DestinationPath, SourcePath, Ensure, Type, Force, Contents, Che
     DestinationPath, SourcePath, Ensure, Type, Force, Contents, Checksum, Recurse, Links, Owner, Group, Mode \
                      = init_locals(DestinationPath, SourcePath, Ensure, Type, Force, Contents, Checksum, Recurse, Links, Owner, Group, Mode)
     retval = Set(DestinationPath, SourcePath, Ensure, Type, Force, Contents, Checksum, Recurse, Links, Owner, Group, Mode)
+    nxHashCache.Save()
     return retval
 
 
@@ -75,6 +77,7 @@ def Test_Marshall(DestinationPath, SourcePath, Ensure, Type, Force, Contents, Ch
     DestinationPath, SourcePath, Ensure, Type, Force, Contents, Checksum, Recurse, Links, Owner, Group, Mode \
                      = init_locals(DestinationPath, SourcePath, Ensure, Type, Force, Contents, Checksum, Recurse, Links, Owner, Group, Mode)
     retval = Test(DestinationPath, SourcePath, Ensure, Type, Force, Contents, Checksum, Recurse, Links, Owner, Group, Mode)
+    nxHashCache.Save()
     return retval
 
 
@@ -372,8 +375,9 @@ def CopyFile(spath, dpath):
 def CompareFiles(DestinationPath, SourcePath, Checksum):
     """
     If the files differ in size, return -1.
-    Reading and computing the hash here is done in a block-by-block manner,
-    in case the file is quite large.
+    With md5 both files are local, so their contents are compared
+    directly, see CompareFileContents.  The md5 of files found equal is
+    kept in nxHashCache, so unchanged files are not read again.
     """
     if SourcePath == DestinationPath:  # Files are the same!
         return 0
@@ -382,36 +386,18 @@ def CompareFiles(DestinationPath, SourcePath, Checksum):
     if stat_src.st_size != stat_dest.st_size:
         return -1
     if Checksum == "md5":
-        src_error = None
-        dest_error = None
+        src_digest = nxHashCache.Lookup('md5', stat_src)
+        dest_digest = nxHashCache.Lookup('md5', stat_dest)
+        if src_digest is not None and dest_digest is not None:
+            if src_digest != dest_digest:
+                return -1
+            return 0
         src_hash = md5const()
-        dest_hash = md5const()
-        src_block = 'loopme'
-        dest_block = 'loopme'
-        src_file,src_error = opened_bin_w_error(SourcePath, 'rb')
-        if src_error:
-            Print("Exception opening source file " + SourcePath + " Error : " + str(src_error), file=sys.stderr)
-            LG().Log('ERROR', "Exception opening source file " + SourcePath + " Error : " + str(src_error))
-            return -1
-        dest_file, dest_error = opened_bin_w_error(DestinationPath, 'rb')
-        if dest_error:
-            Print("Exception opening destination file " + DestinationPath + " Error : " + str(dest_error), file=sys.stderr)
-            LG().Log('ERROR', "Exception opening destination file " + DestinationPath + " Error : " + str(dest_error))
-            src_file.close()
+        if CompareFileContents(SourcePath, DestinationPath, src_hash) == -1:
             return -1
-        while src_block != '' or dest_block != '':
-            src_block = src_file.read(BLOCK_SIZE)
-            dest_block = dest_file.read(BLOCK_SIZE)
-            src_hash.update(src_block)
-            dest_hash.update(dest_block)
-            if src_hash.hexdigest() != dest_hash.hexdigest():
-                src_file.close()
-                dest_file.close()
-                return -1  
-        if src_hash.hexdigest() == dest_hash.hexdigest():
-            src_file.close()
-            dest_file.close()
-            return 0  
+        nxHashCache.Store('md5', stat_src, src_hash.hexdigest())
+        nxHashCache.Store('md5', stat_dest, src_hash.hexdigest())
+        return 0
     elif Checksum == "ctime":
         if stat_src.st_ctime != stat_dest.st_ctime:
             return -1
@@ -424,6 +410,39 @@ def CompareFiles(DestinationPath, SourcePath, Checksum):
             return 0
 
 
+def CompareFileContents(SourcePath, DestinationPath, src_hash=None):
+    """
+    Compare two files of the same size, return 0 if they hold the
+    same bytes and -1 at the first block that differs.  The blocks
+    compared are added to src_hash, if given.
+    """
+    src_file, src_error = opened_bin_w_error(SourcePath, 'rb')
+    if src_error:
+        Print("Exception opening source file " + SourcePath + " Error : " + str(src_error), file=sys.stderr)
+        LG().Log('ERROR', "Exception opening source file " + SourcePath + " Error : " + str(src_error))
+        return -1
+    dest_file, dest_error = opened_bin_w_error(DestinationPath, 'rb')
+    if dest_error:
+        Print("Exception opening destination file " + DestinationPath + " Error : " + str(dest_error), file=sys.stderr)
+        LG().Log('ERROR', "Exception opening destination file " + DestinationPath + " Error : " + str(dest_error))
+        src_file.close()
+        return -1
+    rval = 0
+    try:
+        src_block = 'loopme'
+        while src_block != '':
+            src_block = src_file.read(COMPARE_BLOCK_SIZE)
+            if dest_file.read(COMPARE_BLOCK_SIZE) != src_block:
+                rval = -1
+                break
+            if src_hash is not None:
+                src_hash.update(src_block)
+    finally:
+        src_file.close()
+        dest_file.close()
+    return rval
+
+
 def RemoveTree(path):
     error = None
     try:
@@ -461,30 +480,30 @@ def TestOwnerGroupMode(DestinationPath, SourcePath, fc):
 
     if fc.Owner:
         try:
-            Specified_Owner_ID = pwd.getpwnam(fc.Owner)[2]
+            Specified_Owner_ID = nxIdentityCache.getpwnam(fc.Owner)[2]
         except KeyError, error:
             Print("Exception obtaining gid from group name " + fc.Group  + " Error: " + str(error), file=sys.stderr)
             LG().Log('ERROR', "Exception obtaining gid from group name " + fc.Group  + " Error: " + str(error))
             return False
-        if Specified_Owner_ID != pwd.getpwuid(stat_info.st_uid)[2]:
+        if Specified_Owner_ID != nxIdentityCache.getpwuid(stat_info.st_uid)[2]:
             return False
     elif SourcePath:
         # Owner wasn't specified, if SourcePath is specified then check that the Owners match
-        if pwd.getpwuid(stat_info.st_uid)[2] != pwd.getpwuid(stat_info_src.st_uid)[2]:
+        if nxIdentityCache.getpwuid(stat_info.st_uid)[2] != nxIdentityCache.getpwuid(stat_info_src.st_uid)[2]:
             return False
 
     if fc.Group:
         try:
-            Specified_Group_ID = grp.getgrnam(fc.Group)[2]
+            Specified_Group_ID = nxIdentityCache.getgrnam(fc.Group)[2]
         except KeyError, error:
             Print("Exception obtaining gid from group name " + fc.Group  + " Error: " + str(error), file=sys.stderr)
             LG().Log('ERROR', "Exception obtaining gid from group name " + fc.Group  + " Error: " + str(error))
             return False
-        if Specified_Group_ID != grp.getgrgid(stat_info.st_gid)[2]:
+        if Specified_Group_ID != nxIdentityCache.getgrgid(stat_info.st_gid)[2]:
             return False
     elif SourcePath:
         # Group wasn't specified, if SourcePath is specified then check that the Groups match
-        if grp.getgrgid(stat_info.st_gid)[2] != grp.getgrgid(stat_info_src.st_gid)[2]:
+        if nxIdentityCache.getgrgid(stat_info.st_gid)[2] != nxIdentityCache.getgrgid(stat_info_src.st_gid)[2]:
             return False
     # Mode is irrelevant to symlinks
     if not os.path.islink(DestinationPath):
@@ -588,32 +607,32 @@ def SetOwnerGroupMode(DestinationPath, SourcePath, fc):
             return False
 
     if fc.Owner:
-        Specified_Owner_ID = pwd.getpwnam(fc.Owner)[2]
-        if Specified_Owner_ID != pwd.getpwuid(stat_info.st_uid)[2]:
+        Specified_Owner_ID = nxIdentityCache.getpwnam(fc.Owner)[2]
+        if Specified_Owner_ID != nxIdentityCache.getpwuid(stat_info.st_uid)[2]:
             Print("Changing owner of " + DestinationPath + " to " + str(Specified_Owner_ID))
             LG().Log('INFO', "Changing owner of " + DestinationPath + " to " + str(Specified_Owner_ID))
             if LChown(DestinationPath, Specified_Owner_ID, -1) is not None :
                 return False
 
     elif SourcePath:
-        src_uid = pwd.getpwuid(stat_info_src.st_uid)[2]
-        if pwd.getpwuid(stat_info.st_uid)[2] != src_uid:
+        src_uid = nxIdentityCache.getpwuid(stat_info_src.st_uid)[2]
+        if nxIdentityCache.getpwuid(stat_info.st_uid)[2] != src_uid:
             Print("Changing owner of " + DestinationPath + " to " + str(src_uid))
             LG().Log('INFO', "Changing owner of " + DestinationPath + " to " + str(src_uid))
             if LChown(DestinationPath, src_uid, -1) is not None :
                 return False
 
     if fc.Group:
-        Specified_Group_ID = grp.getgrnam(fc.Group)[2]
-        if Specified_Group_ID != grp.getgrgid(stat_info.st_gid)[2]:
+        Specified_Group_ID = nxIdentityCache.getgrnam(fc.Group)[2]
+        if Specified_Group_ID != nxIdentityCache.getgrgid(stat_info.st_gid)[2]:
             Print("Changing group of " + DestinationPath + " to " + str(Specified_Group_ID))
             LG().Log('INFO', "Changing group of " + DestinationPath + " to " + str(Specified_Group_ID))
             if LChown(DestinationPath, -1, Specified_Group_ID) is not None :
                 return False
 
     elif SourcePath:
-        src_gid = grp.getgrgid(stat_info_src.st_gid)[2]
-        if grp.getgrgid(stat_info.st_gid)[2] != src_gid:
+        src_gid = nxIdentityCache.getgrgid(stat_info_src.st_gid)[2]
+        if nxIdentityCache.getgrgid(stat_info.st_gid)[2] != src_gid:
             Print("Changing group of " + DestinationPath + " to " + str(src_gid))
             LG().Log('INFO', "Changing group of " + DestinationPath + " to " + str(src_gid))
             if LChown(DestinationPath, src_gid , -1) is not None :
@@ -995,8 +1014,8 @@ def Get(DestinationPath, SourcePath, Ensure, Type, Force, Contents, Checksum, Re
     Ensure = "present"
     stat_info = os.lstat(DestinationPath)
 
-    Owner = pwd.getpwuid(stat_info.st_uid)[0]
-    Group = grp.getgrgid(stat_info.st_gid)[0]
+    Owner = nxIdentityCache.getpwuid(stat_info.st_uid)[0]
+    Group = nxIdentityCache.getgrgid(stat_info.st_gid)[0]
     Mode = str(oct(stat_info.st_mode))[-3:]
     if os.path.islink(DestinationPath):
         Type = "link"
@@ -1120,24 +1139,26 @@ def TestRemoteFile(fc):
     #md5
     if not os.path.exists(fc.DestinationPath):
         return False
-    src_data='keep going'
-    dest_data='keep going'
-    src_hash = md5const()
-    dest_hash = md5const()
+    # Compare what arrives with the same number of bytes of the local file.
+    length = h.getheader('content-length')
+    if length is not None and length.isdigit() and int(length) != os.path.getsize(fc.DestinationPath):
+        return False
+    rval = False
     try:
         F = open(fc.DestinationPath, 'rb')
-        while src_data or dest_data:
-            src_data = resp.read(1048576)
-            src_hash.update(src_data)
-            dest_data = F.read(1048576)
-            dest_hash.update(dest_data)
-            if src_hash.hexdigest() != dest_hash.hexdigest():
-                return False
+        try:
+            while True:
+                src_data = resp.read(COMPARE_BLOCK_SIZE)
+                if not src_data:
+                    rval = not F.read(1)
+                    break
+                if F.read(len(src_data)) != src_data:
+                    break
+        finally:
+            F.close()
     except Exception, e:
-        F.close()
         return False
-    F.close()
-    return True
+    return rval
 
 
 class FileContext:
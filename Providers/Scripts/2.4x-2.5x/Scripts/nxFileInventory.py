@@ -7,24 +7,26 @@
 
 import os
 import sys
-import pwd
-import grp
 import codecs
 import fnmatch
-import copy
 import imp
+import stat as statmod
 protocol = imp.load_source('protocol', '../protocol.py')
 nxDSCLog = imp.load_source('nxDSCLog', '../nxDSCLog.py')
+nxHashCache = imp.load_source('nxHashCache', '../nxHashCache.py')
+nxIdentityCache = imp.load_source('nxIdentityCache', '../nxIdentityCache.py')
 LG = nxDSCLog.DSCLog
 try:
     import hashlib
     md5const = hashlib.md5
     shaconst = hashlib.sha256
+    shaname = 'sha-256'
 except ImportError: # Only sha-1 is available for python2.4.
     import md5
     md5const = md5.md5
     import sha
     shaconst = sha.sha
+    shaname = 'sha-1'
 
 # [ClassVersion("1.0.0"), Description("The configuration provider for files and directories."), FriendlyName("nxFileInventory")]
 # class MSFT_nxFileInventoryResource:OMI_BaseResource
@@ -134,6 +136,8 @@ def Inventory_Marshall(DestinationPath, Recurse, Links, Checksum, Type, MaxConte
         d['Owner'] = protocol.MI_String(d['Owner'])
         d['FileSize'] = protocol.MI_Uint64(d['FileSize'])
         _Inventory.append(d)
+    Inventory = None # stops the walk
+    nxHashCache.Save()
     _Inventory = protocol.MI_InstanceA(_Inventory)
     retd = {}
     retd["__Inventory"] = _Inventory
@@ -141,7 +145,26 @@ def Inventory_Marshall(DestinationPath, Recurse, Links, Checksum, Type, MaxConte
 
 
 def DoInventory(DestinationPath, Recurse, Links, Checksum, Type, MaxContentsReturnable, MaxOutputSize, UseSudo):
-    Inventory = []
+    """
+    Yield the inventory of DestinationPath, one dict per file or
+    directory, while walking the tree; the caller stops the walk by
+    not asking for more.
+    """
+    for d in RunOrdered(GetInfo, InventoryEntries(DestinationPath, Recurse, Links, Checksum, Type, MaxContentsReturnable)):
+        if 'DestinationPath' in d:
+            yield d
+
+
+def GetInfo(entry, Links, MaxContentsReturnable, Checksum, dir_stat=None):
+    if dir_stat is not None:
+        return GetDirInfo(entry.path, dir_stat, Checksum, Links)
+    return GetFileInfo(entry, Links, MaxContentsReturnable, Checksum)
+
+
+def InventoryEntries(DestinationPath, Recurse, Links, Checksum, Type, MaxContentsReturnable):
+    """
+    Yield the GetInfo arguments of every file and directory to inventory.
+    """
     full_path = DestinationPath.split('/')
     if full_path[-1] == '':
         full_path[-1] = '*'
@@ -158,20 +181,18 @@ def DoInventory(DestinationPath, Recurse, Links, Checksum, Type, MaxContentsRetu
     if not os.path.exists(top):
         print("Error: Unable to read 'DestinationPath': " + DestinationPath)
         LG().Log("ERROR","Unable to read 'DestinationPath': " + DestinationPath)
-        return Inventory
+        return
     if not wildcard_path:
         if Links == 'ignore' and os.path.islink(top):
-            return Inventory
+            return
         if Type != 'directory' and os.path.isfile(top): # This is s single file.
-            d = GetFileInfo(top, Links, MaxContentsReturnable, Checksum)
-            if 'DestinationPath' in d.keys():
-                Inventory.append(copy.deepcopy(d))
-            return Inventory
+            yield (PathEntry(top), Links, MaxContentsReturnable, Checksum)
+            return
         if '*' not in full_path[-1] and '?' not in full_path[-1]:
             full_path.append('*') # It is a directory without the trailing '/', so add it.
     dirs = set()
     full_path_len =  len(full_path)
-    for dirpath, dirnames, filenames in walk(top, followlinks=(Links == 'follow'), topdown=True):
+    for dirpath, dir_entries, file_entries in WalkTree(top, Links == 'follow'):
         dlen = len(dirpath.split('/'))
         if dirpath.split('/')[-1] == '':
             dlen -= 1
@@ -179,69 +200,59 @@ def DoInventory(DestinationPath, Recurse, Links, Checksum, Type, MaxContentsRetu
             do_wildcard = True
         else :
             do_wildcard = False
-        st = os.stat(dirpath)
         scandirs = []
         if dlen+1 == full_path_len  or ( Recurse and dlen >= full_path_len ):
-            for filename in filenames:
-                if (dlen+1 == full_path_len  or ( Recurse and dlen >= full_path_len )) \
-                       and not fnmatch.fnmatch(filename, full_path[-1]):
+            for entry in file_entries:
+                if not fnmatch.fnmatch(entry.name, full_path[-1]):
                     continue
                 if Type != 'directory':
-                    d = GetFileInfo(os.path.join(dirpath, filename),\
-                                    Links, MaxContentsReturnable, Checksum)
-                    if 'DestinationPath' in d.keys():
-                        Inventory.append(copy.deepcopy(d))
-        for dirname in dirnames:
+                    yield (entry, Links, MaxContentsReturnable, Checksum)
+        for entry in dir_entries:
             if not ( Recurse and dlen+1 >= full_path_len ):
-                if ( do_wildcard and not fnmatch.fnmatch(dirname, full_path[dlen]) ) or \
+                if ( do_wildcard and not fnmatch.fnmatch(entry.name, full_path[dlen]) ) or \
                        ( not Recurse and dlen > full_path_len ):
                     continue
-            st = os.stat(os.path.join(dirpath, dirname)) # use Lstat if follow?
+            try:
+                st = entry.stat() # use Lstat if follow?
+            except OSError:
+                continue
             dirkey = st.st_dev, st.st_ino
             if dirkey not in dirs:
                 if Recurse or (not Recurse and dlen+1 < full_path_len)  :
                     dirs.add(dirkey)
-                    scandirs.append(dirname)
+                    scandirs.append(entry)
             if Type != 'file' and ( dlen+1 == full_path_len  or  ( Recurse and dlen >= full_path_len ) ) :
-                d = GetDirInfo(os.path.join(dirpath, dirname), st, Checksum, Links)
-                if 'DestinationPath' in d.keys():
-                    Inventory.append(copy.deepcopy(d))
-        dirnames[:] = scandirs
-    return Inventory
+                yield (entry, Links, MaxContentsReturnable, Checksum, st)
+        dir_entries[:] = scandirs
 
 
-def GetFileInfo(fname, Links, MaxContentsReturnable, Checksum):
+def GetFileInfo(entry, Links, MaxContentsReturnable, Checksum):
     """
-    Return a dictionary of info for file.
+    Return a dictionary of info for the file of DirEntry entry.
     If 'Links' == 'follow', no link files will appear here,
     those links will be sent to GetDirInfo() as direcroties.
-    Therefore only LStatFile is used.
+    Therefore only the lstat result is used.
     If file is link and 'Links' == 'ignore' {} is returned.
     """
     d = {}
+    fname = entry.path
 
     if fname.endswith("omsadmin.conf"):
-        return d
+       return d
 
-    if os.path.islink(fname):
+    try:
+        stat_info = entry.stat(follow_symlinks=False)
+    except OSError:
+        return {}
+    if statmod.S_ISLNK(stat_info.st_mode):
         d['Type'] = 'link'
     else :
         d['Type'] = 'file'
     if d['Type'] == 'link' and Links == 'ignore':
         return {}
-    stat_info = None
-    stat_info = LStatFile(fname)
-    if stat_info == None:
-        return {}
     d['DestinationPath'] = fname
-    try:
-        d['Owner'] = pwd.getpwuid(stat_info.st_uid).pw_name
-    except:
-        d['Owner'] = str(stat_info.st_uid)
-    try:
-        d['Group'] = grp.getgrgid(stat_info.st_gid).gr_name
-    except:
-        d['Group'] = str(stat_info.st_gid)
+    d['Owner'] = nxIdentityCache.UserName(stat_info.st_uid)
+    d['Group'] = nxIdentityCache.GroupName(stat_info.st_gid)
     d['Mode'] = str(oct(stat_info.st_mode))[-3:]
     d['ModifiedDate'] = int(stat_info.st_mtime)
     d['CreatedDate'] = int(stat_info.st_ctime)
@@ -283,14 +294,8 @@ def GetDirInfo(dname, stat_info, Checksum, Links):
         return d
     d['Type'] = 'directory'
     d['DestinationPath'] = dname
-    try:
-        d['Owner'] = pwd.getpwuid(stat_info.st_uid).pw_name
-    except:
-        d['Owner'] = str(stat_info.st_uid)
-    try:
-        d['Group'] = grp.getgrgid(stat_info.st_gid).gr_name
-    except:
-        d['Group'] = str(stat_info.st_gid)
+    d['Owner'] = nxIdentityCache.UserName(stat_info.st_uid)
+    d['Group'] = nxIdentityCache.GroupName(stat_info.st_gid)
     if Checksum == 'md5' or Checksum == 'sha-256':
         d['Checksum'] = '0'
     elif Checksum == "ctime":
@@ -364,51 +369,107 @@ def StatFile(path):
     return d
 
 def GetChecksum(fname, Checksum):
+    """
+    Return the hex digest of fname, from nxHashCache
+    if the file did not change since it was last hashed.
+    """
     src_error = None
     src_block = 'loopme'
     if Checksum == "md5":
         src_hash = md5const()
+        name = 'md5'
     else : # sha-256
         src_hash = shaconst()
+        name = shaname
     src_file, src_error = opened_bin_w_error(fname, 'rb')
     if src_error:
         return ""
-    while src_block :
-        src_block = src_file.read(8192)
-        src_hash.update(src_block)
-    return src_hash.hexdigest()
-
-# From python2.7 os.py
-def walk(top, topdown=True, onerror=None, followlinks=False):
-    islink, join, isdir = os.path.islink, os.path.join, os.path.isdir
-
-    # We may not have read permission for top, in which case we can't
-    # get a list of the files the directory contains.  os.path.walk
-    # always suppressed the exception then, rather than blow up for a
-    # minor reason when (say) a thousand readable directories are still
-    # left to visit.  That logic is copied here.
     try:
-        # Note that listdir and error are globals in this module due
-        # to earlier import-*.
-        names = os.listdir(top)
-    except os.error, err:
-        if onerror is not None:
-            onerror(err)
-        return
+        st = os.fstat(src_file.fileno())
+        digest = nxHashCache.Lookup(name, st)
+        if digest is None:
+            while src_block :
+                src_block = src_file.read(8192)
+                src_hash.update(src_block)
+            digest = src_hash.hexdigest()
+            nxHashCache.Store(name, st, digest)
+    finally:
+        src_file.close()
+    return digest
+
+
+class PathEntry(object):
+    """
+    The part of os.DirEntry used here.  Stat results are cached the
+    same way.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.st = None
+        self.lst = None
+
+    def stat(self, follow_symlinks=True):
+        if not follow_symlinks:
+            if self.lst is None:
+                self.lst = os.lstat(self.path)
+            return self.lst
+        if self.st is None:
+            self.st = os.stat(self.path)
+        return self.st
+
+    def is_symlink(self):
+        try:
+            return statmod.S_ISLNK(self.stat(follow_symlinks=False).st_mode)
+        except OSError:
+            return False
+
+    def is_dir(self):
+        try:
+            return statmod.S_ISDIR(self.stat().st_mode)
+        except OSError:
+            return False
+
 
-    dirs, nondirs = [], []
-    for name in names:
-        if isdir(join(top, name)):
-            dirs.append(name)
+def ScanDir(path):
+    """
+    Return the entries of directory path, or [] if it can't be read.
+    """
+    try:
+        names = os.listdir(path)
+    except OSError:
+        return []
+    return [PathEntry(os.path.join(path, name)) for name in names]
+
+
+def WalkTree(top, followlinks):
+    """
+    Like os.walk(top, topdown=True), but yields lists of PathEntry
+    objects, so the stat results of the walk are reused.
+    Remove entries from the directory list to skip them.
+    """
+    dirs = []
+    files = []
+    for entry in ScanDir(top):
+        try:
+            is_dir = entry.is_dir()
+        except OSError:
+            is_dir = False
+        if is_dir:
+            dirs.append(entry)
         else:
-            nondirs.append(name)
-
-    if topdown:
-        yield top, dirs, nondirs
-    for name in dirs:
-        new_path = join(top, name)
-        if followlinks or not islink(new_path):
-            for x in walk(new_path, topdown, onerror, followlinks):
+            files.append(entry)
+    yield top, dirs, files
+    for entry in dirs:
+        if followlinks or not entry.is_symlink():
+            for x in WalkTree(entry.path, followlinks):
                 yield x
-    if not topdown:
-        yield top, dirs, nondirs
+
+
+def RunOrdered(func, items):
+    """
+    Yield func(*args) for each args in items, in order.
+    """
+    for args in items:
+        yield func(*args)
@@ -6,12 +6,12 @@
 import os
 import sys
 import imp
-import grp
 import copy
 import fnmatch
 protocol = imp.load_source('protocol', '../protocol.py')
 nxDSCLog = imp.load_source('nxDSCLog', '../nxDSCLog.py')
 helperlib = imp.load_source('helperlib', '../helperlib.py')
+nxIdentityCache = imp.load_source('nxIdentityCache', '../nxIdentityCache.py')
 LG = nxDSCLog.DSCLog
 
 # [ClassVersion("1.0.0"), FriendlyName("nxGroup"),SupportsInventory()]
@@ -190,20 +190,11 @@ def SwapGroupModCommand():
 
 
 def ReadPasswd(filename):
-    f, error = opened_w_error(filename, 'rb')
+    entries, error = nxIdentityCache.ReadEntries(filename)
     if error:
         Print("Exception opening file " + filename + " Error: " + str(error), file=sys.stderr)
         LG().Log('ERROR', "Exception opening file " + filename + " Error: " + str(error))
         return None
-    else:
-        lines = f.read().split("\n")
-    f.close()
-    entries = dict()
-    for line in lines:
-        tokens = line.split(":")
-        if len(tokens) > 1:
-            entries[tokens[0]] = tokens[1:]
-
     return entries
 
 
@@ -293,7 +284,7 @@ def Set(GroupName, Ensure, Members, MembersToInclude, MembersToExclude, Preferre
             group_entries = ReadPasswd("/etc/group")
         else:
             # update the GID if needed.
-            if len(gid_option) and str(grp.getgrnam(GroupName)[2]) != PreferredGroupID:
+            if len(gid_option) and str(nxIdentityCache.getgrnam(GroupName)[2]) != PreferredGroupID:
                 Print("Group exists. Updating to PreferredGroupID <" + PreferredGroupID + ">.", file=sys.stderr)
                 LG().Log('INFO', "Group exists. Updating to PreferredGroupID <" + PreferredGroupID + ">.")
                 retval = os.system(groupmod_path + " " + gid_option + GroupName)
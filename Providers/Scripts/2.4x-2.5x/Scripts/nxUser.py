@@ -12,6 +12,7 @@ import fnmatch
 protocol = imp.load_source('protocol', '../protocol.py')
 nxDSCLog = imp.load_source('nxDSCLog', '../nxDSCLog.py')
 helperlib = imp.load_source('helperlib', '../helperlib.py')
+nxIdentityCache = imp.load_source('nxIdentityCache', '../nxIdentityCache.py')
 LG = nxDSCLog.DSCLog
 
 # [ClassVersion("1.0.0"), FriendlyName("nxUser"),SupportsInventory()]
@@ -196,20 +197,11 @@ chage_path = "/usr/bin/chage"
 
 
 def ReadPasswd(filename):
-    f, error = opened_w_error(filename, 'rb')
+    entries, error = nxIdentityCache.ReadEntries(filename)
     if error:
         Print("Exception opening file " + filename + " Error: " + str(error), file=sys.stderr)
         LG().Log('ERROR', "Exception opening file " + filename + " Error: " + str(error))
         return None
-    else:
-        lines = f.read().split("\n")
-        f.close()
-    entries = dict()
-    for line in lines:
-        tokens = line.split(":")
-        if len(tokens) > 1:
-            entries[tokens[0]] = tokens[1:]
-
     return entries
 
 
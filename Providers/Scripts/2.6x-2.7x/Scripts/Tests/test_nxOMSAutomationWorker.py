@@ -15,6 +15,10 @@ import subprocess
 import pwd
 import shutil
 import ConfigParser
+import logging
+import Queue
+import StringIO
+import threading
 import time
 
 try:
@@ -29,6 +33,12 @@ sys.path.append(os.path.realpath('./Scripts'))
 os.chdir('../..')
 nxOMSAutomationWorker=imp.load_source('nxOMSAutomationWorker', './Scripts/nxOMSAutomationWorker.py')
 
+# the worker modules run by the resource
+sys.path.append(os.path.realpath('../../nxOMSAutomationWorker/automationworker/worker'))
+import configuration
+import streamhandler
+import tracer
+
 class nxOMSAutomationWorkerTestCases(unittest2.TestCase):
     """
     Test Case for nxOMSAutomationWorker.py
@@ -315,7 +325,142 @@ class nxOMSAutomationWorkerTestCases(unittest2.TestCase):
         self.assertTrue(ret_code == 0)
 
 
+class BlockedJrdsClient:
+    """
+    Records the traces sent to JRDS, blocking until released.
+    """
+    def __init__(self):
+        self.released = threading.Event()
+        self.logs = []
+
+    def set_log(self, event_id, activity_id, log_type, args):
+        self.released.wait()
+        self.logs.append(args[-1])
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class TracerTestCases(unittest2.TestCase):
+    """
+    Test cases for the worker tracer
+    """
+    def setUp(self):
+        self.saved = (tracer.jrds_client, tracer.default_logger, tracer.trace_queue, tracer.TRACE_QUEUE_SIZE)
+        configuration.set_config({configuration.COMPONENT: "worker", configuration.DEBUG_TRACES: False})
+        tracer.jrds_client = BlockedJrdsClient()
+        self.handler = RecordingHandler()
+        tracer.default_logger = logging.getLogger("tracer_test_logger")
+        tracer.default_logger.setLevel(logging.INFO)
+        tracer.default_logger.addHandler(self.handler)
+        # a queue of its own, started with the sender thread
+        tracer.trace_queue = None
+        tracer.TRACE_QUEUE_SIZE = 5
+
+    def tearDown(self):
+        tracer.jrds_client.released.set()
+        tracer.flush_traces()
+        tracer.default_logger.removeHandler(self.handler)
+        tracer.jrds_client, tracer.default_logger, tracer.trace_queue, tracer.TRACE_QUEUE_SIZE = self.saved
+
+    def test_blocked_jrds_client_does_not_delay_local_traces(self):
+        dropped = tracer.get_trace_stats()["dropped"]
+        for i in range(20):
+            tracer.log_informational_trace("message %d" % i)
+        expected = ["message %d" % i for i in range(20)]
+        self.assertEqual([m for m in self.handler.messages if m.startswith("message")], expected)
+        self.assertTrue(tracer.get_trace_stats()["dropped"] - dropped >= 14)
+        tracer.jrds_client.released.set()
+        tracer.flush_traces()
+        # the traces that fit in the queue are sent in order
+        sent = tracer.jrds_client.logs
+        self.assertTrue(len(sent) >= 5)
+        self.assertEqual(sent, [m for m in expected if m in sent])
+
+
+class StreamJrdsClient:
+    """
+    Records the stream records uploaded to JRDS and how many were uploaded at once.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.records = []
+        self.uploading = 0
+        self.max_uploading = 0
+
+    def set_stream(self, job_id, runbook_version_id, stream_text, stream_type, sequence_number):
+        self.lock.acquire()
+        self.uploading += 1
+        self.max_uploading = max(self.max_uploading, self.uploading)
+        self.lock.release()
+        time.sleep(0.01)
+        self.lock.acquire()
+        self.uploading -= 1
+        self.records.append((sequence_number, stream_type, stream_text))
+        self.lock.release()
+
+
+class RunbookProcess:
+    def __init__(self, output):
+        self.stdout = StringIO.StringIO(output)
+        self.waited = False
+
+    def wait(self):
+        self.waited = True
+        return 0
+
+
+class JobData:
+    job_id = "job"
+    runbook_version_id = "runbook"
+
+
+class StreamHandlerTestCases(unittest2.TestCase):
+    """
+    Test cases for the worker stream handler
+    """
+    def setUp(self):
+        self.test_mode = os.environ.get("test_mode")
+        os.environ["test_mode"] = "true"
+
+    def tearDown(self):
+        if self.test_mode is None:
+            del os.environ["test_mode"]
+        else:
+            os.environ["test_mode"] = self.test_mode
+
+    def test_stream_records_are_numbered_in_order(self):
+        lines = []
+        for i in range(40):
+            lines.append(["output %d", "DEBUG: debug %d", "Error: error %d", "verbose: verbose %d",
+                          "WARNING: warning %d"][i % 5] % i)
+        jrds_client = StreamJrdsClient()
+        process = RunbookProcess("\n".join(lines) + "\n")
+        msg_queue = Queue.Queue()
+        handler = streamhandler.StreamHandler(JobData(), process, jrds_client, msg_queue)
+        handler.start()
+        self.assertEqual(msg_queue.get(timeout=30), streamhandler.STREAM_PROCESSING_COMPLETE)
+        self.assertTrue(process.waited)
+        self.assertEqual(len(jrds_client.records), len(lines))
+        records = sorted(jrds_client.records)
+        self.assertEqual([record[0] for record in records], range(len(lines)))
+        self.assertEqual([record[2] for record in records], lines)
+        self.assertEqual([record[1] for record in records[:5]],
+                         [streamhandler.STREAM_TYPE_OUTPUT, streamhandler.STREAM_TYPE_DEBUG,
+                          streamhandler.STREAM_TYPE_ERROR, streamhandler.STREAM_TYPE_VERBOSE,
+                          streamhandler.STREAM_TYPE_WARNING])
+        self.assertTrue(jrds_client.max_uploading > 1)
+
+
 if __name__ == '__main__':
     s1 = unittest2.TestLoader().loadTestsFromTestCase(nxOMSAutomationWorkerTestCases)
-    all_tests = unittest2.TestSuite([s1])
+    s2 = unittest2.TestLoader().loadTestsFromTestCase(TracerTestCases)
+    s3 = unittest2.TestLoader().loadTestsFromTestCase(StreamHandlerTestCases)
+    all_tests = unittest2.TestSuite([s1, s2, s3])
     unittest2.TextTestRunner(stream=sys.stdout, verbosity=3).run(all_tests)
\ No newline at end of file
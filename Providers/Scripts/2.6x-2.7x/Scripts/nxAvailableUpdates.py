@@ -8,15 +8,22 @@ import subprocess
 import sys
 import imp
 import re
-import copy
 import fnmatch
 import time
 import os
+import glob
+import stat
 
 protocol = imp.load_source('protocol', '../protocol.py')
 nxDSCLog = imp.load_source('nxDSCLog', '../nxDSCLog.py')
 helperlib = imp.load_source('helperlib', '../helperlib.py')
 LG = nxDSCLog.DSCLog
+try:
+    import hashlib
+    md5const = hashlib.md5
+except ImportError:
+    import md5
+    md5const = md5.md5
 
 
 # [ClassVersion("1.0.0"),FriendlyName("nxAvailableUpdates"),SupportsInventory()]
@@ -68,31 +75,30 @@ def GetAptUpdates(Name):
     # Inst python3.5 (3.5.0-3 Ubuntu:15.10/wily [amd64])
     # Inst sosreport [3.2-2ubuntu1] (3.2-2ubuntu1.1 Ubuntu:15.10/wily-updates [amd64])
 
-    updates_list = []
-    d = {}
     # Refresh the repo
     if helperlib.CONFIG_SYSCONFDIR_DSC == "omsconfig":
         cmd = 'sudo /opt/microsoft/omsconfig/Scripts/OMSAptUpdates.sh'
     else:
         cmd = 'apt-get -q update'
     code, out = RunGetOutput(cmd, False, False)
-    cmd = 'LANG=en_US.UTF8 apt-get -s dist-upgrade | grep "^Inst"'
-    LG().Log('DEBUG', "Retrieving update package list using cmd:" + cmd)
-    code, out = RunGetOutput(cmd, False, False)
-    if len(out) < 2:
-        return updates_list
-    srch_txt = r'Inst[ ](.*?)[ ].*?[(](.*?)[ ](.*?)[ ]\[(.*?)\]'
-    srch = re.compile(srch_txt, re.M | re.S)
-    pkg_list = srch.findall(out)
-    for pkg in pkg_list:
-        d['BuildDate'] = ''
-        d['Name'] = pkg[0]
-        if len(Name) and not fnmatch.fnmatch(d['Name'], Name):
-            continue
-        d['Architecture'] = pkg[3]
-        d['Version'] = pkg[1]
-        d['Repository'] = pkg[2]
-        updates_list.append(copy.deepcopy(d))
+    key = Fingerprint(AptState)
+    updates_list = ReadUpdatesCache('apt', key)
+    if updates_list is None:
+        cmd = 'LANG=en_US.UTF8 apt-get -s dist-upgrade'
+        LG().Log('DEBUG', "Retrieving update package list using cmd:" + cmd)
+        code, out = RunGetOutput(cmd, False, False)
+        updates_list = []
+        for line in out.splitlines():
+            pkg = AptInst.match(line)
+            if pkg is None:
+                continue
+            updates_list.append({'BuildDate': '', 'Name': pkg.group(1),
+                                 'Architecture': pkg.group(4),
+                                 'Version': pkg.group(2),
+                                 'Repository': pkg.group(3)})
+        if code == 0:
+            WriteUpdatesCache('apt', key, updates_list)
+    updates_list = FilterUpdates(updates_list, Name)
     LG().Log('DEBUG', "Number of packages being written to the XML: " + str(len(updates_list)))
     return updates_list
 
@@ -116,9 +122,9 @@ def GetYumUpdates(Name):
     # No need to refresh the repo - 'check-update' will do this.
 
     if os.path.exists('/usr/bin/repoquery'):
-        srch_str = r'Name.*?: (.*?)\n.*?Arch.*?: (.*?)\n.*?Version.*?: (.*?)\n.*?Release.*?: (.*?)\n.*?Repo.*?: (.*?)\n.*?Buildtime.*?: (.*?)\n'
+        fields = ('Name', 'Arch', 'Version', 'Release', 'Repo', 'Buildtime')
     else:
-        srch_str = r'Name.*?: (.*?)\n.*?Arch.*?: (.*?)\n.*?Version.*?: (.*?)\n.*?Release.*?: (.*?)\n.*?Repo.*?: (.*?)\n'
+        fields = ('Name', 'Arch', 'Version', 'Release', 'Repo')
 
     if helperlib.CONFIG_SYSCONFDIR_DSC == "omsconfig":
         yum_list = 'sudo /opt/microsoft/omsconfig/Scripts/OMSYumUpdates.sh '
@@ -147,45 +153,74 @@ def GetYumUpdates(Name):
         if pkg_list.find('\n\n') > -1:
             pkg_list = pkg_list[pkg_list.find('\n\n') + 2:]
         LG().Log('DEBUG', "Number of packages to be updated: " + str(len(pkg_list.splitlines())))
-        srch = re.compile(srch_str, re.M | re.S)
 
-        param_list = ""
-        for pkg in pkg_list.splitlines():
-            param_list = param_list + " " + pkg
-
-        cmd = "LANG=en_US.UTF8 " + yum_info + param_list
-        LG().Log('DEBUG', "Retrieving individual package information from Yum using cmd: " + cmd)
-        start_time = time.time()
-        code, out = RunGetOutput(cmd, False, False)
-        LG().Log('DEBUG', "Cmd execution time: " + str((time.time() - start_time) / 60))
-        #LG().Log('DEBUG', "Cmd output is : " + out)
-        updates_list = []
-        if len(out) < 1 or ':' not in out:
-            LG().Log('DEBUG', "Failed retrieving individual package info. Output is too small : " + out)
-            return updates_list
-        yum_pkg_info_list = srch.finditer(out)
-        updates_list = get_yum_updates_list(yum_pkg_info_list, Name)
+        # The details change with the list of updates and with the
+        # repository metadata, which has the versions of the updates.
+        key = Fingerprint(YumState, yum_info + pkg_list)
+        updates_list = ReadUpdatesCache('yum', key)
+        if updates_list is None:
+            param_list = ' ' + ' '.join(pkg_list.splitlines())
+            cmd = "LANG=en_US.UTF8 " + yum_info + param_list
+            LG().Log('DEBUG', "Retrieving individual package information from Yum using cmd: " + cmd)
+            start_time = time.time()
+            code, out = RunGetOutput(cmd, False, False)
+            LG().Log('DEBUG', "Cmd execution time: " + str((time.time() - start_time) / 60))
+            #LG().Log('DEBUG', "Cmd output is : " + out)
+            updates_list = []
+            if len(out) < 1 or ':' not in out:
+                LG().Log('DEBUG', "Failed retrieving individual package info. Output is too small : " + out)
+                return updates_list
+            yum_pkg_info_list = ParseYumInfo(out.splitlines(), fields)
+            updates_list = get_yum_updates_list(yum_pkg_info_list, '')
+            if code == 0:
+                WriteUpdatesCache('yum', key, updates_list)
+        updates_list = FilterUpdates(updates_list, Name)
     LG().Log('DEBUG', "Number of packages being written to the XML: " + str(len(updates_list)))
     return updates_list
 
 
+def ParseYumInfo(lines, fields):
+    """
+    Returns the values of fields for each package in lines of
+    'Field : value' yum info or repoquery output.  A package starts at
+    the fields[0] line and ends at the last field; other lines are
+    skipped.
+    """
+    packages = []
+    values = []
+    for line in lines:
+        i = line.find(': ')
+        if i < 0:
+            continue
+        if fields[0] in line[:i]:
+            values = [line[i + 2:]]
+        elif len(values) > 0 and fields[len(values)] in line[:i]:
+            values.append(line[i + 2:])
+        else:
+            continue
+        if len(values) == len(fields):
+            packages.append(values)
+            values = []
+    return packages
+
+
 def get_yum_updates_list(yum_pkg_info_list, Name):
-    d = {}
     updates_list = []
     for yum_pkg_info in yum_pkg_info_list:
-        d['Name'] = yum_pkg_info.group(1)
+        d = {}
+        d['Name'] = yum_pkg_info[0]
         if len(Name) and not fnmatch.fnmatch(d['Name'], Name):
             continue
-        d['Architecture'] = yum_pkg_info.group(2)
-        d['Version'] = yum_pkg_info.group(3) + '-' + yum_pkg_info.group(4)
+        d['Architecture'] = yum_pkg_info[1]
+        d['Version'] = yum_pkg_info[2] + '-' + yum_pkg_info[3]
         if ':' not in d['Version']:  # Add a '0:' for epoch.
             d['Version'] = '0:' + d['Version']
         d['Version'] = d['Version'].replace('(none)', '0')  # Handle the Epoch '(none)'.
-        d['Repository'] = yum_pkg_info.group(5)
+        d['Repository'] = yum_pkg_info[4]
         d['BuildDate'] = ''
-        if len(yum_pkg_info.groups()) == 6:  # Buildtime
-            d['BuildDate'] = time.asctime(time.gmtime(int(yum_pkg_info.group(6))))
-        updates_list.append(copy.deepcopy(d))
+        if len(yum_pkg_info) == 6:  # Buildtime
+            d['BuildDate'] = time.asctime(time.gmtime(int(yum_pkg_info[5])))
+        updates_list.append(d)
     return updates_list
 
 
@@ -219,38 +254,140 @@ def GetZypperUpdates(Name):
     # SLES11-SP3-Updates | slessp3-WALinuxAgent       | 10531   | recommended | needed
     # SLES11-SP3-Updates | slessp3-WALinuxAgent-12085 | 1       | recommended | needed
 
-    updates_list = []
-    d = {}
-    pkg_list = ''
-    # For omsagent the repo is refreshed in OMSZypperUpdates.sh.
+    # For omsagent the repo is refreshed by OMSZypperUpdates.sh.
     if helperlib.CONFIG_SYSCONFDIR_DSC == "omsconfig":
-        zypper = 'sudo /opt/microsoft/omsconfig/Scripts/OMSZypperUpdates.sh'
+        refresh = 'sudo /opt/microsoft/omsconfig/Scripts/OMSZypperUpdates.sh refresh'
+        zypper = 'sudo /opt/microsoft/omsconfig/Scripts/OMSZypperUpdates.sh list'
     else:
+        refresh = 'zypper -qn refresh'
         zypper = 'zypper -q lu'
-        # Refresh the repo.
-        cmd = 'zypper -qn refresh'
-        LG().Log('DEBUG', "Executing cmd: " + cmd)
+    # Refresh the repo before taking the fingerprint of the solv files.
+    LG().Log('DEBUG', "Executing cmd: " + refresh)
+    code, out = RunGetOutput(refresh, False, False)
+    key = Fingerprint(ZypperState)
+    updates_list = ReadUpdatesCache('zypper', key)
+    if updates_list is None:
+        cmd = 'LANG=en_US.UTF8 ' + zypper
+        LG().Log('DEBUG', "Retrieving update package list using cmd:" + cmd)
         code, out = RunGetOutput(cmd, False, False)
-    cmd = 'LANG=en_US.UTF8 ' + zypper + ' | grep "|" | grep -vE "Status|Current Version"'
-    LG().Log('DEBUG', "Retrieving update package list using cmd:" + cmd)
-    code, out = RunGetOutput(cmd, False, False)
-    pkg_list = out
-    if len(pkg_list) < 2:
-        return updates_list
-    for pkg in pkg_list.splitlines():
-        pkg = pkg.split('|')
-        d['BuildDate'] = ''
-        d['Name'] = pkg[2].strip()
-        if len(Name) and not fnmatch.fnmatch(d['Name'], Name):
-            continue
-        d['Architecture'] = pkg[5].strip()
-        d['Version'] = "0:" + pkg[4].strip()
-        d['Repository'] = pkg[1].strip()
-        updates_list.append(copy.deepcopy(d))
+        updates_list = []
+        for pkg in out.splitlines():
+            if '|' not in pkg or 'Status' in pkg or 'Current Version' in pkg:
+                continue
+            pkg = pkg.split('|')
+            if len(pkg) < 6:
+                continue
+            updates_list.append({'BuildDate': '', 'Name': pkg[2].strip(),
+                                 'Architecture': pkg[5].strip(),
+                                 'Version': "0:" + pkg[4].strip(),
+                                 'Repository': pkg[1].strip()})
+        if code == 0:
+            WriteUpdatesCache('zypper', key, updates_list)
+    updates_list = FilterUpdates(updates_list, Name)
     LG().Log('DEBUG', "Number of packages being written to the XML: " + str(len(updates_list)))
     return updates_list
 
 
+# The last update list of each package manager is kept in
+# UpdatesCacheDir with a fingerprint of what it was computed from: the
+# repository metadata, package database and configuration files below
+# (names, sizes and mtimes), and for yum the check-update output.  It is
+# computed again when the fingerprint changes or when it is older than
+# UpdatesCacheMaxAge seconds; the repositories are still refreshed every
+# time, before the fingerprint is taken.
+UpdatesCacheDir = '/var/opt/microsoft/dsc/cache/nxAvailableUpdates'
+if helperlib.CONFIG_SYSCONFDIR_DSC == "omsconfig":
+    UpdatesCacheDir = '/var/opt/microsoft/omsconfig/cache/nxAvailableUpdates'
+UpdatesCacheMaxAge = 86400
+UpdatesFields = ('Name', 'Version', 'Architecture', 'Repository', 'BuildDate')
+AptState = ['/var/lib/apt/lists/*', '/var/lib/dpkg/status',
+            '/etc/apt/sources.list', '/etc/apt/sources.list.d/*',
+            '/etc/apt/preferences', '/etc/apt/preferences.d/*',
+            '/etc/apt/apt.conf.d/*']
+RpmDatabase = ['/var/lib/rpm/Packages', '/var/lib/rpm/Packages.db',
+               '/var/lib/rpm/rpmdb.sqlite', '/var/lib/rpm/rpmdb.sqlite-wal']
+YumState = ['/var/cache/yum/*/repomd.xml', '/var/cache/yum/*/*/repomd.xml',
+            '/var/cache/yum/*/*/*/repomd.xml',
+            '/var/cache/dnf/*/repodata/repomd.xml'] + RpmDatabase
+ZypperState = ['/var/cache/zypp/solv/*/solv', '/etc/zypp/locks'] + RpmDatabase
+AptInst = re.compile(r'Inst (.*?) .*?[(](.*?) (.*?) \[(.*?)\]')
+
+
+def Fingerprint(patterns, text=''):
+    """
+    Returns a digest of text and of the files matching patterns.
+    """
+    h = md5const()
+    h.update(text)
+    for pattern in patterns:
+        names = glob.glob(pattern)
+        names.sort()
+        for name in names:
+            try:
+                st = os.stat(name)
+            except OSError:
+                continue
+            if stat.S_ISREG(st.st_mode):
+                h.update('%s %d %r\n' % (name, st.st_size, st.st_mtime))
+    return h.hexdigest()
+
+
+def FilterUpdates(updates_list, Name):
+    if len(Name) == 0:
+        return updates_list
+    return [d for d in updates_list if fnmatch.fnmatch(d['Name'], Name)]
+
+
+def ReadUpdatesCache(mgr, key):
+    """
+    Returns the update list saved for mgr if it was saved with key
+    within UpdatesCacheMaxAge seconds, otherwise None.
+    """
+    try:
+        F = open(UpdatesCacheDir + '/' + mgr, 'r')
+        try:
+            age = time.time() - os.fstat(F.fileno()).st_mtime
+            lines = F.read().splitlines()
+        finally:
+            F.close()
+    except (IOError, OSError):
+        return None
+    if age < 0 or UpdatesCacheMaxAge < age:
+        return None
+    if len(lines) == 0 or lines[0] != key:
+        return None
+    updates_list = []
+    for line in lines[1:]:
+        values = line.split('\t')
+        if len(values) != len(UpdatesFields):
+            return None
+        updates_list.append(dict(zip(UpdatesFields, values)))
+    LG().Log('DEBUG', "Using the saved update list, nothing changed since it was computed")
+    return updates_list
+
+
+def WriteUpdatesCache(mgr, key, updates_list):
+    lines = [key + '\n']
+    for d in updates_list:
+        values = []
+        for field in UpdatesFields:
+            values.append(d[field].replace('\t', ' ').replace('\n', ' '))
+        lines.append('\t'.join(values) + '\n')
+    path = UpdatesCacheDir + '/' + mgr
+    try:
+        if not os.path.isdir(UpdatesCacheDir):
+            os.makedirs(UpdatesCacheDir)
+        F = open(path + '.tmp', 'w')
+        try:
+            F.write(''.join(lines))
+        finally:
+            F.close()
+        os.rename(path + '.tmp', path)
+    except (IOError, OSError):
+        LG().Log('WARNING', 'Unable to write ' + path + ': ' +
+                 str(sys.exc_info()[1]))
+
+
 def RunGetOutput(cmd, no_output, chk_err=True):
     """
     Wrapper for subprocess.check_output.
@@ -10,9 +10,7 @@ from contextlib import contextmanager
 
 import os
 import sys
-import pwd
 import shutil
-import grp
 import codecs
 import urllib2
 import time
@@ -20,6 +18,8 @@ import imp
 protocol = imp.load_source('protocol', '../protocol.py')
 nxDSCLog = imp.load_source('nxDSCLog', '../nxDSCLog.py')
 helperlib = imp.load_source('helperlib', '../helperlib.py')
+nxHashCache = imp.load_source('nxHashCache', '../nxHashCache.py')
+nxIdentityCache = imp.load_source('nxIdentityCache', '../nxIdentityCache.py')
 
 LG = nxDSCLog.DSCLog
 try:
@@ -30,6 +30,7 @@ except ImportError:
     md5const = md5.md5
 
 BLOCK_SIZE = 8192
+COMPARE_BLOCK_SIZE = 1048576
 
 global show_mof
 show_mof = False
@@ -72,6 +73,7 @@ def Set_Marshall(DestinationPath, SourcePath, Ensure, Type, Force, Contents, Che
     DestinationPath, SourcePath, Ensure, Type, Force, Contents, Checksum, Recurse, Links, Owner, Group, Mode \
                      = init_locals(DestinationPath, SourcePath, Ensure, Type, Force, Contents, Checksum, Recurse, Links, Owner, Group, Mode)
     retval = Set(DestinationPath, SourcePath, Ensure, Type, Force, Contents, Checksum, Recurse, Links, Owner, Group, Mode)
+    nxHashCache.Save()
     return retval
 
 
@@ -79,6 +81,7 @@ def Test_Marshall(DestinationPath, SourcePath, Ensure, Type, Force, Contents, Ch
     DestinationPath, SourcePath, Ensure, Type, Force, Contents, Checksum, Recurse, Links, Owner, Group, Mode \
                      = init_locals(DestinationPath, SourcePath, Ensure, Type, Force, Contents, Checksum, Recurse, Links, Owner, Group, Mode)
     retval = Test(DestinationPath, SourcePath, Ensure, Type, Force, Contents, Checksum, Recurse, Links, Owner, Group, Mode)
+    nxHashCache.Save()
     return retval
 
 
@@ -380,8 +383,9 @@ def CopyFile(spath, dpath):
 def CompareFiles(DestinationPath, SourcePath, Checksum):
     """
     If the files differ in size, return -1.
-    Reading and computing the hash here is done in a block-by-block manner,
-    in case the file is quite large.
+    With md5 both files are local, so their contents are compared
+    directly, see CompareFileContents.  The md5 of files found equal is
+    kept in nxHashCache, so unchanged files are not read again.
     """
     if SourcePath == DestinationPath:  # Files are the same!
         return 0
@@ -390,35 +394,18 @@ def CompareFiles(DestinationPath, SourcePath, Checksum):
     if stat_src.st_size != stat_dest.st_size:
         return -1
     if Checksum == "md5":
-        src_error = None
-        dest_error = None
-        src_hash = md5const()
-        dest_hash = md5const()
-        src_block = b'loopme'
-        dest_block = b'loopme'
-        with opened_bin_w_error(SourcePath, 'rb') as (src_file, src_error):
-            if src_error:
-                print("Exception opening source file " + SourcePath + " Error Code: " + str(src_error.errno) +
-                      " Error: " + src_error.message + src_error.strerror, file=sys.stderr)
-                LG().Log('ERROR', "Exception opening source file " + SourcePath + " Error Code: " + str(src_error.errno) +
-                        " Error: " + src_error.message + src_error.strerror)
+        src_digest = nxHashCache.Lookup('md5', stat_src)
+        dest_digest = nxHashCache.Lookup('md5', stat_dest)
+        if src_digest is not None and dest_digest is not None:
+            if src_digest != dest_digest:
                 return -1
-            with opened_bin_w_error(DestinationPath, 'rb') as (dest_file, dest_error):
-                if dest_error:
-                    print("Exception opening destination file " + DestinationPath + " Error Code: " + str(dest_error.errno) +
-                          " Error: " + dest_error.message + dest_error.strerror, file=sys.stderr)
-                    LG().Log('ERROR', "Exception opening destination file " + DestinationPath + " Error Code: " + str(dest_error.errno) +
-                          " Error: " + dest_error.message + dest_error.strerror)
-                    return -1
-                while src_block or dest_block :
-                    src_block = src_file.read(BLOCK_SIZE)
-                    dest_block = dest_file.read(BLOCK_SIZE)
-                    src_hash.update(src_block)
-                    dest_hash.update(dest_block)
-                    if src_hash.hexdigest() != dest_hash.hexdigest():
-                        return -1
-        if src_hash.hexdigest() == dest_hash.hexdigest():
             return 0
+        src_hash = md5const()
+        if CompareFileContents(SourcePath, DestinationPath, src_hash) == -1:
+            return -1
+        nxHashCache.Store('md5', stat_src, src_hash.hexdigest())
+        nxHashCache.Store('md5', stat_dest, src_hash.hexdigest())
+        return 0
     elif Checksum == "ctime":
         if stat_src.st_ctime != stat_dest.st_ctime:
             return -1
@@ -431,6 +418,47 @@ def CompareFiles(DestinationPath, SourcePath, Checksum):
             return 0
 
 
+def CompareFileContents(SourcePath, DestinationPath, src_hash=None):
+    """
+    Compare two files of the same size, return 0 if they hold the
+    same bytes and -1 at the first block that differs.  The blocks
+    compared are added to src_hash, if given.  Both files are
+    read into preallocated buffers of COMPARE_BLOCK_SIZE bytes.
+    """
+    with opened_bin_w_error(SourcePath, 'rb') as (src_file, src_error):
+        if src_error:
+            print("Exception opening source file " + SourcePath  + " Error Code: " + str(src_error.errno) +
+                  " Error: " + src_error.strerror, file=sys.stderr)
+            LG().Log('ERROR', "Exception opening source file " + SourcePath + " Error Code: " + str(src_error.errno) +
+                    " Error: " + src_error.strerror)
+            return -1
+        with opened_bin_w_error(DestinationPath, 'rb') as (dest_file, dest_error):
+            if dest_error:
+                print("Exception opening destination file " + DestinationPath + " Error Code: " + str(dest_error.errno) +
+                      " Error: " + dest_error.strerror, file=sys.stderr)
+                LG().Log('ERROR', "Exception opening destination file " + DestinationPath + " Error Code: " + str(dest_error.errno) +
+                      " Error: " + dest_error.strerror)
+                return -1
+            src_block = bytearray(COMPARE_BLOCK_SIZE)
+            dest_block = bytearray(COMPARE_BLOCK_SIZE)
+            while True:
+                src_len = src_file.readinto(src_block)
+                dest_len = dest_file.readinto(dest_block)
+                if src_len != dest_len:
+                    return -1
+                if src_len == 0:
+                    return 0
+                if src_len < COMPARE_BLOCK_SIZE:
+                    if src_block[:src_len] != dest_block[:dest_len]:
+                        return -1
+                    if src_hash is not None:
+                        src_hash.update(src_block[:src_len])
+                elif src_block != dest_block:
+                    return -1
+                elif src_hash is not None:
+                    src_hash.update(src_block)
+
+
 def RemoveTree(path):
     error = None
     try:
@@ -468,30 +496,30 @@ def TestOwnerGroupMode(DestinationPath, SourcePath, fc):
 
     if fc.Owner:
         try:
-            Specified_Owner_ID = pwd.getpwnam(fc.Owner)[2]
+            Specified_Owner_ID = nxIdentityCache.getpwnam(fc.Owner)[2]
         except KeyError, error:
             print("Exception obtaining gid from group name " + fc.Group + " Error: " + error.message, file=sys.stderr)
             LG().Log('ERROR', "Exception obtaining gid from group name " + fc.Group + " Error: " + error.message)
             return False
-        if Specified_Owner_ID != pwd.getpwuid(stat_info.st_uid)[2]:
+        if Specified_Owner_ID != nxIdentityCache.getpwuid(stat_info.st_uid)[2]:
             return False
     elif SourcePath:
         # Owner wasn't specified, if SourcePath is specified then check that the Owners match
-        if pwd.getpwuid(stat_info.st_uid)[2] != pwd.getpwuid(stat_info_src.st_uid)[2]:
+        if nxIdentityCache.getpwuid(stat_info.st_uid)[2] != nxIdentityCache.getpwuid(stat_info_src.st_uid)[2]:
             return False
 
     if fc.Group:
         try:
-            Specified_Group_ID = grp.getgrnam(fc.Group)[2]
+            Specified_Group_ID = nxIdentityCache.getgrnam(fc.Group)[2]
         except KeyError, error:
             print("Exception obtaining gid from group name " + fc.Group + " Error: " + error.message, file=sys.stderr)
             LG().Log('ERROR', "Exception obtaining gid from group name " + fc.Group + " Error: " + error.message)
             return False
-        if Specified_Group_ID != grp.getgrgid(stat_info.st_gid)[2]:
+        if Specified_Group_ID != nxIdentityCache.getgrgid(stat_info.st_gid)[2]:
             return False
     elif SourcePath:
         # Group wasn't specified, if SourcePath is specified then check that the Groups match
-        if grp.getgrgid(stat_info.st_gid)[2] != grp.getgrgid(stat_info_src.st_gid)[2]:
+        if nxIdentityCache.getgrgid(stat_info.st_gid)[2] != nxIdentityCache.getgrgid(stat_info_src.st_gid)[2]:
             return False
     # Mode is irrelevant to symlinks
     if not os.path.islink(DestinationPath):
@@ -595,32 +623,32 @@ def SetOwnerGroupMode(DestinationPath, SourcePath, fc):
             return False
 
     if fc.Owner:
-        Specified_Owner_ID = pwd.getpwnam(fc.Owner)[2]
-        if Specified_Owner_ID != pwd.getpwuid(stat_info.st_uid)[2]:
+        Specified_Owner_ID = nxIdentityCache.getpwnam(fc.Owner)[2]
+        if Specified_Owner_ID != nxIdentityCache.getpwuid(stat_info.st_uid)[2]:
             print("Changing owner of " + DestinationPath + " to " + str(Specified_Owner_ID))
             LG().Log('INFO', "Changing owner of " + DestinationPath + " to " + str(Specified_Owner_ID))
             if LChown(DestinationPath, Specified_Owner_ID, -1) is not None :
                 return False
 
     elif SourcePath:
-        src_uid = pwd.getpwuid(stat_info_src.st_uid)[2]
-        if pwd.getpwuid(stat_info.st_uid)[2] != src_uid:
+        src_uid = nxIdentityCache.getpwuid(stat_info_src.st_uid)[2]
+        if nxIdentityCache.getpwuid(stat_info.st_uid)[2] != src_uid:
             print("Changing owner of " + DestinationPath + " to " + str(src_uid))
             LG().Log('INFO', "Changing owner of " + DestinationPath + " to " + str(src_uid))
             if LChown(DestinationPath, src_uid, -1) is not None :
                 return False
 
     if fc.Group:
-        Specified_Group_ID = grp.getgrnam(fc.Group)[2]
-        if Specified_Group_ID != grp.getgrgid(stat_info.st_gid)[2]:
+        Specified_Group_ID = nxIdentityCache.getgrnam(fc.Group)[2]
+        if Specified_Group_ID != nxIdentityCache.getgrgid(stat_info.st_gid)[2]:
             print("Changing group of " + DestinationPath + " to " + str(Specified_Group_ID))
             LG().Log('INFO', "Changing group of " + DestinationPath + " to " + str(Specified_Group_ID))
             if LChown(DestinationPath, -1, Specified_Group_ID) is not None :
                 return False
 
     elif SourcePath:
-        src_gid = grp.getgrgid(stat_info_src.st_gid)[2]
-        if grp.getgrgid(stat_info.st_gid)[2] != src_gid:
+        src_gid = nxIdentityCache.getgrgid(stat_info_src.st_gid)[2]
+        if nxIdentityCache.getgrgid(stat_info.st_gid)[2] != src_gid:
             print("Changing group of " + DestinationPath + " to " + str(src_gid))
             LG().Log('INFO', "Changing group of " + DestinationPath + " to " + str(src_gid))
             if LChown(DestinationPath, src_gid , -1) is not None :
@@ -1002,8 +1030,8 @@ def Get(DestinationPath, SourcePath, Ensure, Type, Force, Contents, Checksum, Re
     Ensure = "present"
     stat_info = os.lstat(DestinationPath)
 
-    Owner = pwd.getpwuid(stat_info.st_uid)[0]
-    Group = grp.getgrgid(stat_info.st_gid)[0]
+    Owner = nxIdentityCache.getpwuid(stat_info.st_uid)[0]
+    Group = nxIdentityCache.getgrgid(stat_info.st_gid)[0]
     Mode = str(oct(stat_info.st_mode))[-3:]
     if os.path.islink(DestinationPath):
         Type = "link"
@@ -1127,23 +1155,20 @@ def TestRemoteFile(fc):
     #md5
     if not os.path.exists(fc.DestinationPath):
         return False
-    src_data=b'keep going'
-    dest_data=b'keep going'
-    src_hash = md5const()
-    dest_hash = md5const()
+    # Compare what arrives with the same number of bytes of the local file.
+    length = h.getheader('content-length')
+    if length is not None and length.isdigit() and int(length) != os.path.getsize(fc.DestinationPath):
+        return False
     with (open(fc.DestinationPath, 'rb')) as F:
         try:
-            while src_data or dest_data:
-                src_data = resp.read(1048576)
-                src_hash.update(src_data)
-                dest_data = F.read(1048576)
-                dest_hash.update(dest_data)
-                if src_hash.hexdigest() != dest_hash.hexdigest():
+            while True:
+                src_data = resp.read(COMPARE_BLOCK_SIZE)
+                if not src_data:
+                    return not F.read(1)
+                if F.read(len(src_data)) != src_data:
                     return False
         except Exception, e:
-            F.close()
             return False
-    return True
 
 
 class FileContext:
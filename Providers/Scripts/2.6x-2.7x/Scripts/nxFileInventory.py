@@ -10,24 +10,47 @@ from __future__ import with_statement
 from contextlib import contextmanager
 
 import os
-import pwd
-import grp
+import sys
 import codecs
 import fnmatch
-import copy
+import collections
 import imp
+import stat as statmod
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 protocol = imp.load_source('protocol', '../protocol.py')
 nxDSCLog = imp.load_source('nxDSCLog', '../nxDSCLog.py')
+nxHashCache = imp.load_source('nxHashCache', '../nxHashCache.py')
+nxIdentityCache = imp.load_source('nxIdentityCache', '../nxIdentityCache.py')
 LG = nxDSCLog.DSCLog
 try:
     import hashlib
     md5const = hashlib.md5
     shaconst = hashlib.sha256
+    shaname = 'sha-256'
 except ImportError: # Only sha-1 is available for python2.4.
     import md5
     md5const = md5.md5
     import sha
     shaconst = sha.sha
+    shaname = 'sha-1'
+
+# Files are read and hashed by this many threads, in batches of
+# InventoryBatch files and at most InventoryPending batches ahead of the
+# inventory being returned.
+InventoryThreads = 4
+InventoryBatch = 32
+InventoryPending = 8
 
 # [ClassVersion("1.0.0"), Description("The configuration provider for files and directories."), FriendlyName("nxFileInventory")]
 # class MSFT_nxFileInventoryResource:OMI_BaseResource
@@ -137,6 +160,8 @@ def Inventory_Marshall(DestinationPath, Recurse, Links, Checksum, Type, MaxConte
         d['Owner'] = protocol.MI_String(d['Owner'])
         d['FileSize'] = protocol.MI_Uint64(d['FileSize'])
         _Inventory.append(d)
+    Inventory = None # stops the walk and its threads
+    nxHashCache.Save()
     _Inventory = protocol.MI_InstanceA(_Inventory)
     retd = {}
     retd["__Inventory"] = _Inventory
@@ -144,7 +169,26 @@ def Inventory_Marshall(DestinationPath, Recurse, Links, Checksum, Type, MaxConte
 
 
 def DoInventory(DestinationPath, Recurse, Links, Checksum, Type, MaxContentsReturnable, MaxOutputSize, UseSudo):
-    Inventory = []
+    """
+    Yield the inventory of DestinationPath, one dict per file or
+    directory, while walking the tree; the caller stops the walk by
+    not asking for more.
+    """
+    for d in RunOrdered(GetInfo, InventoryEntries(DestinationPath, Recurse, Links, Checksum, Type, MaxContentsReturnable)):
+        if 'DestinationPath' in d:
+            yield d
+
+
+def GetInfo(entry, Links, MaxContentsReturnable, Checksum, dir_stat=None):
+    if dir_stat is not None:
+        return GetDirInfo(entry.path, dir_stat, Checksum, Links)
+    return GetFileInfo(entry, Links, MaxContentsReturnable, Checksum)
+
+
+def InventoryEntries(DestinationPath, Recurse, Links, Checksum, Type, MaxContentsReturnable):
+    """
+    Yield the GetInfo arguments of every file and directory to inventory.
+    """
     full_path = DestinationPath.split('/')
     if full_path[-1] == '':
         full_path[-1] = '*'
@@ -161,20 +205,18 @@ def DoInventory(DestinationPath, Recurse, Links, Checksum, Type, MaxContentsRetu
     if not os.path.exists(top):
         print("Error: Unable to read 'DestinationPath': " + DestinationPath)
         LG().Log("ERROR","Unable to read 'DestinationPath': " + DestinationPath)
-        return Inventory
+        return
     if not wildcard_path:
         if Links == 'ignore' and os.path.islink(top):
-            return Inventory
+            return
         if Type != 'directory' and os.path.isfile(top): # This is s single file.
-            d = GetFileInfo(top, Links, MaxContentsReturnable, Checksum)
-            if 'DestinationPath' in d.keys():
-                Inventory.append(copy.deepcopy(d))
-            return Inventory
+            yield (PathEntry(top), Links, MaxContentsReturnable, Checksum)
+            return
         if '*' not in full_path[-1] and '?' not in full_path[-1]:
             full_path.append('*') # It is a directory without the trailing '/', so add it.
     dirs = set()
     full_path_len =  len(full_path)
-    for dirpath, dirnames, filenames in os.walk(top, followlinks=(Links == 'follow'), topdown=True):
+    for dirpath, dir_entries, file_entries in WalkTree(top, Links == 'follow'):
         dlen = len(dirpath.split('/'))
         if dirpath.split('/')[-1] == '':
             dlen -= 1
@@ -182,68 +224,59 @@ def DoInventory(DestinationPath, Recurse, Links, Checksum, Type, MaxContentsRetu
             do_wildcard = True
         else :
             do_wildcard = False
-        st = os.stat(dirpath)
         scandirs = []
         if dlen+1 == full_path_len  or ( Recurse and dlen >= full_path_len ):
-            for filename in filenames:
-                if (dlen+1 == full_path_len  or ( Recurse and dlen >= full_path_len )) \
-                       and not fnmatch.fnmatch(filename, full_path[-1]):
+            for entry in file_entries:
+                if not fnmatch.fnmatch(entry.name, full_path[-1]):
                     continue
                 if Type != 'directory':
-                    d = GetFileInfo(os.path.join(dirpath, filename),\
-                                    Links, MaxContentsReturnable, Checksum)
-                    if 'DestinationPath' in d.keys():
-                        Inventory.append(copy.deepcopy(d))
-        for dirname in dirnames:
+                    yield (entry, Links, MaxContentsReturnable, Checksum)
+        for entry in dir_entries:
             if not ( Recurse and dlen+1 >= full_path_len ):
-                if ( do_wildcard and not fnmatch.fnmatch(dirname, full_path[dlen]) ) or \
+                if ( do_wildcard and not fnmatch.fnmatch(entry.name, full_path[dlen]) ) or \
                        ( not Recurse and dlen > full_path_len ):
                     continue
-            st = os.stat(os.path.join(dirpath, dirname)) # use Lstat if follow?
+            try:
+                st = entry.stat() # use Lstat if follow?
+            except OSError:
+                continue
             dirkey = st.st_dev, st.st_ino
             if dirkey not in dirs:
                 if Recurse or (not Recurse and dlen+1 < full_path_len)  :
                     dirs.add(dirkey)
-                    scandirs.append(dirname)
+                    scandirs.append(entry)
             if Type != 'file' and ( dlen+1 == full_path_len  or  ( Recurse and dlen >= full_path_len ) ) :
-                d = GetDirInfo(os.path.join(dirpath, dirname), st, Checksum, Links)
-                if 'DestinationPath' in d.keys():
-                    Inventory.append(copy.deepcopy(d))
-        dirnames[:] = scandirs
-    return Inventory
+                yield (entry, Links, MaxContentsReturnable, Checksum, st)
+        dir_entries[:] = scandirs
 
 
-def GetFileInfo(fname, Links, MaxContentsReturnable, Checksum):
+def GetFileInfo(entry, Links, MaxContentsReturnable, Checksum):
     """
-    Return a dictionary of info for file.
+    Return a dictionary of info for the file of DirEntry entry.
     If 'Links' == 'follow', no link files will appear here,
     those links will be sent to GetDirInfo() as direcroties.
-    Therefore only LStatFile is used.
+    Therefore only the lstat result is used.
     If file is link and 'Links' == 'ignore' {} is returned.
     """
     d = {}
+    fname = entry.path
+
     if fname.endswith("omsadmin.conf"):
        return d
 
-    if os.path.islink(fname):
+    try:
+        stat_info = entry.stat(follow_symlinks=False)
+    except OSError:
+        return {}
+    if statmod.S_ISLNK(stat_info.st_mode):
         d['Type'] = 'link'
     else :
         d['Type'] = 'file'
     if d['Type'] == 'link' and Links == 'ignore':
         return {}
-    stat_info = None
-    stat_info = LStatFile(fname)
-    if stat_info == None:
-        return {}
     d['DestinationPath'] = fname
-    try:
-        d['Owner'] = pwd.getpwuid(stat_info.st_uid).pw_name
-    except:
-        d['Owner'] = str(stat_info.st_uid)
-    try:
-        d['Group'] = grp.getgrgid(stat_info.st_gid).gr_name
-    except:
-        d['Group'] = str(stat_info.st_gid)
+    d['Owner'] = nxIdentityCache.UserName(stat_info.st_uid)
+    d['Group'] = nxIdentityCache.GroupName(stat_info.st_gid)
     d['Mode'] = str(oct(stat_info.st_mode))[-3:]
     d['ModifiedDate'] = int(stat_info.st_mtime)
     d['CreatedDate'] = int(stat_info.st_ctime)
@@ -285,14 +318,8 @@ def GetDirInfo(dname, stat_info, Checksum, Links):
         return d
     d['Type'] = 'directory'
     d['DestinationPath'] = dname
-    try:
-        d['Owner'] = pwd.getpwuid(stat_info.st_uid).pw_name
-    except:
-        d['Owner'] = str(stat_info.st_uid)
-    try:
-        d['Group'] = grp.getgrgid(stat_info.st_gid).gr_name
-    except:
-        d['Group'] = str(stat_info.st_gid)
+    d['Owner'] = nxIdentityCache.UserName(stat_info.st_uid)
+    d['Group'] = nxIdentityCache.GroupName(stat_info.st_gid)
     if Checksum == 'md5' or Checksum == 'sha-256':
         d['Checksum'] = '0'
     elif Checksum == "ctime":
@@ -376,17 +403,172 @@ def StatFile(path):
     return d
 
 def GetChecksum(fname, Checksum):
+    """
+    Return the hex digest of fname, from nxHashCache
+    if the file did not change since it was last hashed.
+    """
     src_error = None
     src_block = b'loopme'
     if Checksum == "md5":
         src_hash = md5const()
+        name = 'md5'
     else : # sha-256
         src_hash = shaconst()
+        name = shaname
     with opened_bin_w_error(fname, 'rb') as (src_file, src_error):
         if src_error:
             return ""
-        while src_block :
-            src_block = src_file.read(8192)
-            src_hash.update(src_block)
-        return src_hash.hexdigest()
+        st = os.fstat(src_file.fileno())
+        digest = nxHashCache.Lookup(name, st)
+        if digest is None:
+            while src_block :
+                src_block = src_file.read(8192)
+                src_hash.update(src_block)
+            digest = src_hash.hexdigest()
+            nxHashCache.Store(name, st, digest)
+        return digest
+
+
+class PathEntry(object):
+    """
+    The part of os.DirEntry used here, for paths not returned by scandir.
+    Stat results are cached the same way.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.st = None
+        self.lst = None
+
+    def stat(self, follow_symlinks=True):
+        if not follow_symlinks:
+            if self.lst is None:
+                self.lst = os.lstat(self.path)
+            return self.lst
+        if self.st is None:
+            self.st = os.stat(self.path)
+        return self.st
+
+    def is_symlink(self):
+        try:
+            return statmod.S_ISLNK(self.stat(follow_symlinks=False).st_mode)
+        except OSError:
+            return False
+
+    def is_dir(self):
+        try:
+            return statmod.S_ISDIR(self.stat().st_mode)
+        except OSError:
+            return False
+
+
+def ScanDir(path):
+    """
+    Return the entries of directory path, or [] if it can't be read.
+    """
+    if scandir is not None:
+        try:
+            return list(scandir(path))
+        except OSError:
+            return []
+    try:
+        names = os.listdir(path)
+    except OSError:
+        return []
+    return [PathEntry(os.path.join(path, name)) for name in names]
+
+
+def WalkTree(top, followlinks):
+    """
+    Like os.walk(top, topdown=True), but yields lists of DirEntry
+    (or PathEntry) objects, so the stat results of the walk are reused.
+    Remove entries from the directory list to skip them.
+    """
+    dirs = []
+    files = []
+    for entry in ScanDir(top):
+        try:
+            is_dir = entry.is_dir()
+        except OSError:
+            is_dir = False
+        if is_dir:
+            dirs.append(entry)
+        else:
+            files.append(entry)
+    yield top, dirs, files
+    for entry in dirs:
+        if followlinks or not entry.is_symlink():
+            for x in WalkTree(entry.path, followlinks):
+                yield x
+
+
+def RunOrdered(func, items):
+    """
+    Yield func(*args) for each args in items, in order.  The calls are
+    made in batches of InventoryBatch on InventoryThreads threads, up to
+    InventoryPending batches ahead of the caller, so files are read and
+    hashed in parallel.  Closing the generator drops the batches not
+    started yet.
+    """
+    if InventoryThreads < 2:
+        for args in items:
+            yield func(*args)
+        return
+    tasks = queue.Queue()
+
+    def worker():
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            try:
+                task[1] = [func(*args) for args in task[0]]
+            except Exception:
+                task[2] = sys.exc_info()[1]
+            task[3].set()
+
+    workers = []
+    for i in range(InventoryThreads):
+        t = threading.Thread(target=worker)
+        t.daemon = True
+        t.start()
+        workers.append(t)
+    window = collections.deque()
+    batch = []
+    try:
+        for args in items:
+            batch.append(args)
+            if len(batch) < InventoryBatch:
+                continue
+            window.append(PutTask(tasks, batch))
+            batch = []
+            if len(window) >= InventoryPending:
+                for result in TaskResults(window.popleft()):
+                    yield result
+        if batch:
+            window.append(PutTask(tasks, batch))
+        while window:
+            for result in TaskResults(window.popleft()):
+                yield result
+    finally:
+        try:
+            while True:
+                tasks.get_nowait()
+        except queue.Empty:
+            pass
+        for t in workers:
+            tasks.put(None)
+
+
+def PutTask(tasks, batch):
+    task = [batch, None, None, threading.Event()]
+    tasks.put(task)
+    return task
+
 
+def TaskResults(task):
+    task[3].wait()
+    if task[2] is not None:
+        raise task[2]
+    return task[1]
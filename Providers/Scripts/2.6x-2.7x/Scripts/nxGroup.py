@@ -10,12 +10,12 @@ import os
 import sys
 import codecs
 import imp
-import grp
 import copy
 import fnmatch
 protocol = imp.load_source('protocol', '../protocol.py')
 nxDSCLog = imp.load_source('nxDSCLog', '../nxDSCLog.py')
 helperlib = imp.load_source('helperlib', '../helperlib.py')
+nxIdentityCache = imp.load_source('nxIdentityCache', '../nxIdentityCache.py')
 LG = nxDSCLog.DSCLog
 
 # [ClassVersion("1.0.0"), FriendlyName("nxGroup"),SupportsInventory()]
@@ -200,22 +200,13 @@ def SwapGroupModCommand():
 
 
 def ReadPasswd(filename):
-    with opened_w_error(filename, 'rb') as (f, error):
-        if error:
-            Print("Exception opening file " + filename + " Error Code: " +
-                  str(error.errno) + " Error: " + error.message + error.strerror, file=sys.stderr)
-            LG().Log('ERROR', "Exception opening file " + filename + " Error Code: " +
-                     str(error.errno) + " Error: " + error.message + error.strerror)
-            return None
-        else:
-            lines = f.read().split("\n")
-
-    entries = dict()
-    for line in lines:
-        tokens = line.split(":")
-        if len(tokens) > 1:
-            entries[tokens[0]] = tokens[1:]
-
+    entries, error = nxIdentityCache.ReadEntries(filename)
+    if error:
+        Print("Exception opening file " + filename + " Error Code: " +
+              str(error.errno) + " Error: " + error.message + error.strerror, file=sys.stderr)
+        LG().Log('ERROR', "Exception opening file " + filename + " Error Code: " +
+                 str(error.errno) + " Error: " + error.message + error.strerror)
+        return None
     return entries
 
 
@@ -305,7 +296,7 @@ def Set(GroupName, Ensure, Members, MembersToInclude, MembersToExclude, Preferre
             group_entries = ReadPasswd("/etc/group")
         else:
             # update the GID if needed.
-            if len(gid_option) and str(grp.getgrnam(GroupName)[2]) != PreferredGroupID:
+            if len(gid_option) and str(nxIdentityCache.getgrnam(GroupName)[2]) != PreferredGroupID:
                 Print("Group exists. Updating to PreferredGroupID <" + PreferredGroupID + ">.", file=sys.stderr)
                 LG().Log('INFO', "Group exists. Updating to PreferredGroupID <" + PreferredGroupID + ">.")
                 retval = os.system(groupmod_path + " " + gid_option + GroupName)
@@ -15,6 +15,7 @@ import fnmatch
 protocol = imp.load_source('protocol', '../protocol.py')
 nxDSCLog = imp.load_source('nxDSCLog', '../nxDSCLog.py')
 helperlib = imp.load_source('helperlib', '../helperlib.py')
+nxIdentityCache = imp.load_source('nxIdentityCache', '../nxIdentityCache.py')
 LG = nxDSCLog.DSCLog
 
 # [ClassVersion("1.0.0"), FriendlyName("nxUser"),SupportsInventory()]
@@ -204,22 +205,13 @@ chage_path = "/usr/bin/chage"
 
 
 def ReadPasswd(filename):
-    with opened_w_error(filename, 'rb') as (f, error):
-        if error:
-            Print("Exception opening file " + filename + " Error Code: " +
-                  str(error.errno) + " Error: " + error.message + error.strerror, file=sys.stderr)
-            LG().Log('ERROR', "Exception opening file " + filename + " Error Code: " +
-                     str(error.errno) + " Error: " + error.message + error.strerror)
-            return None
-        else:
-            lines = f.read().split("\n")
-
-    entries = dict()
-    for line in lines:
-        tokens = line.split(":")
-        if len(tokens) > 1:
-            entries[tokens[0]] = tokens[1:]
-
+    entries, error = nxIdentityCache.ReadEntries(filename)
+    if error:
+        Print("Exception opening file " + filename + " Error Code: " +
+              str(error.errno) + " Error: " + error.message + error.strerror, file=sys.stderr)
+        LG().Log('ERROR', "Exception opening file " + filename + " Error Code: " +
+                 str(error.errno) + " Error: " + error.message + error.strerror)
+        return None
     return entries
 
 
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+#============================================================================
+# Copyright (c) Microsoft Corporation. All rights reserved. See license.txt for license information.
+#============================================================================
+# Measures what protocol.py spends on one request: decoding a request and
+# encoding a file inventory result of the size nxFileInventory returns.
+#
+#   python3 benchmark_protocol.py [path to protocol.py] [instances] [runs]
+
+import imp
+import os
+import socket
+import sys
+import time
+
+path = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../../protocol.py')
+if len(sys.argv) > 1:
+    path = sys.argv[1]
+instances = 2000
+if len(sys.argv) > 2:
+    instances = int(sys.argv[2])
+runs = 5
+if len(sys.argv) > 3:
+    runs = int(sys.argv[3])
+
+protocol = imp.load_source('protocol', path)
+
+
+class NullSocket:
+    def sendall(self, buf):
+        pass
+
+    send = sendall
+
+
+class ReplaySocket:
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def recv(self, n):
+        buf = self.data[self.pos:self.pos + n]
+        self.pos += len(buf)
+        return buf
+
+    def recv_into(self, view):
+        buf = self.recv(len(view))
+        view[0:len(buf)] = buf
+        return len(buf)
+
+
+def inventory():
+    result = []
+    for i in range(instances):
+        result.append({
+            'DestinationPath': protocol.MI_String('/etc/file%d.conf' % i),
+            'Checksum': protocol.MI_String('md5'),
+            'Type': protocol.MI_String('file'),
+            'Contents': protocol.MI_String('x' * 1024),
+            'ModifiedDate': protocol.MI_Timestamp.from_time(i),
+            'CreatedDate': protocol.MI_Timestamp.from_time(i),
+            'Mode': protocol.MI_String('644'),
+            'Group': protocol.MI_String('root'),
+            'Owner': protocol.MI_String('root'),
+            'FileSize': protocol.MI_Uint64(1024)})
+    return {'__Inventory': protocol.MI_InstanceA(result)}
+
+
+def request():
+    args = {'DestinationPath': protocol.MI_String('/etc'),
+            'Recurse': protocol.MI_Boolean(True),
+            'Links': protocol.MI_String('follow'),
+            'Checksum': protocol.MI_String('md5'),
+            'Type': protocol.MI_String('*'),
+            'MaxContentsReturnable': protocol.MI_Uint32(1024),
+            'MaxOutputSize': protocol.MI_Uint64(10485760),
+            'UseSudo': protocol.MI_Boolean(False),
+            'Contents': protocol.MI_String('y' * 262144)}
+    out = []
+
+    class Capture:
+        def sendall(self, buf):
+            out.append(buf)
+
+        send = sendall
+    protocol.write_values(Capture(), args)
+    return bytes().join(out)
+
+
+def encode(values):
+    if hasattr(protocol, 'WriteBuffer'):
+        buf = protocol.WriteBuffer()
+        protocol.write_values(buf, values)
+        buf.flush(NullSocket())
+    else:
+        protocol.write_values(NullSocket(), values)
+
+
+def decode(data):
+    fd = ReplaySocket(data)
+    if hasattr(protocol, 'RecvBuffer'):
+        fd = protocol.RecvBuffer(fd)
+    protocol.read_values(fd)
+
+
+def best(func, arg):
+    times = []
+    for i in range(runs):
+        start = time.time()
+        func(arg)
+        times.append(time.time() - start)
+    return min(times)
+
+
+stdout = sys.stdout
+sys.stdout = open(os.devnull, 'w')
+try:
+    values = inventory()
+    data = request()
+    encode_time = best(encode, values)
+    decode_time = best(decode, data)
+finally:
+    sys.stdout.close()
+    sys.stdout = stdout
+print('%s: encode %d instances %.1f ms, decode request %.1f ms' %
+      (path, instances, encode_time * 1000, decode_time * 1000))
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+#============================================================================
+# Copyright (c) Microsoft Corporation. All rights reserved. See license.txt for license information.
+#============================================================================
+# Drives client.serve_concurrent over a socketpair with a stand-in for the
+# providers and checks which requests it lets overlap.
+#
+#   python3 test_client.py
+
+import imp
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+import unittest
+
+scripts = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../..')
+sys.path.insert(0, scripts)
+protocol = imp.load_source('protocol', os.path.join(scripts, 'protocol.py'))
+
+
+def load_client():
+    # client.py serves the socket fd in argv[1] when it is imported
+    # and closes a duplicate of it when it is done.
+    pair = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+    argv = sys.argv
+    cwd = os.getcwd()
+    stderr = sys.stderr
+    sys.argv = ['client.py', str(pair[0].fileno())]
+    sys.stderr = open(os.devnull, 'w')
+    try:
+        client = imp.load_source('client', os.path.join(scripts, 'client.py'))
+    finally:
+        sys.stderr.close()
+        sys.stderr = stderr
+        sys.argv = argv
+        os.chdir(cwd)
+        pair[0].close()
+        pair[1].close()
+    return client
+
+client = load_client()
+
+TEST, SET, GET = 0, 1, 2
+
+
+class Recorder:
+    """ Stands in for callMOF and records which calls overlapped. """
+    def __init__(self, delay):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.running = []
+        self.overlaps = []
+
+    def __call__(self, req):
+        self.lock.acquire()
+        try:
+            for other in self.running:
+                self.overlaps.append((req, other))
+            self.running.append(req)
+        finally:
+            self.lock.release()
+        time.sleep(self.delay)
+        self.lock.acquire()
+        try:
+            self.running.remove(req)
+        finally:
+            self.lock.release()
+        return [0]
+
+    def overlapped(self, match):
+        for a, b in self.overlaps:
+            if match(a, b) or match(b, a):
+                return True
+        return False
+
+
+class ServeConcurrentTestCases(unittest.TestCase):
+    def setUp(self):
+        self.callMOF = client.callMOF
+        self.recorder = Recorder(0.05)
+        client.callMOF = self.recorder
+        self.host, self.server = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.thread = threading.Thread(target=client.serve_concurrent,
+                                       args=(self.server, protocol.RecvBuffer(self.server), 4))
+        self.thread.start()
+
+    def tearDown(self):
+        client.callMOF = self.callMOF
+        self.host.close()
+        self.thread.join()
+        self.server.close()
+
+    def serve(self, requests):
+        buf = protocol.WriteBuffer()
+        for request_id, (op, name) in enumerate(requests):
+            buf.sendall(struct.pack('@I', request_id))
+            buf.sendall(struct.pack('@B', op))
+            protocol.write_string(buf, name)
+            protocol.write_values(buf, {})
+        buf.flush(self.host)
+        self.host.shutdown(socket.SHUT_WR)
+        answered = []
+        for i in range(len(requests)):
+            request_id, status = struct.unpack('@Ii', protocol.recv_exact(self.host, 8))
+            self.assertEqual(status, 0)
+            answered.append(request_id)
+        self.thread.join()
+        self.assertEqual(sorted(answered), list(range(len(requests))))
+
+    def testTestAndGetOverlap(self):
+        self.serve([(TEST, 'nxFile'), (GET, 'nxUser'), (TEST, 'nxGroup'), (GET, 'nxFile')])
+        self.assertTrue(self.recorder.overlapped(lambda a, b: a[0] == TEST and b[0] == GET))
+
+    def testSetRunsAlone(self):
+        self.serve([(TEST, 'nxFile'), (SET, 'nxGroup'), (GET, 'nxUser'),
+                    (SET, 'nxUser'), (TEST, 'nxGroup'), (GET, 'nxFile')])
+        self.assertFalse(self.recorder.overlapped(lambda a, b: a[0] == SET))
+
+    def testProviderConcurrencyLimit(self):
+        self.serve([(TEST, 'nxPackage'), (GET, 'nxPackage'), (TEST, 'nxPackage'),
+                    (TEST, 'nxFile')])
+        self.assertFalse(self.recorder.overlapped(
+            lambda a, b: a[1] == 'nxPackage' and b[1] == 'nxPackage'))
+        self.assertTrue(self.recorder.overlapped(lambda a, b: a[1] == 'nxPackage'))
+
+
+if __name__ == '__main__':
+    unittest.main()
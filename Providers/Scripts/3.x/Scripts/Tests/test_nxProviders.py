@@ -178,6 +178,8 @@ nxMySqlUser=imp.load_source('nxMySqlUser', './Scripts/nxMySqlUser.py')
 nxMySqlGrant=imp.load_source('nxMySqlGrant', './Scripts/nxMySqlGrant.py')
 nxMySqlDatabase=imp.load_source('nxMySqlDatabase', './Scripts/nxMySqlDatabase.py')
 nxFileInventory=imp.load_source('nxFileInventory', './Scripts/nxFileInventory.py')
+nxHashCache=imp.load_source('nxHashCache', '../nxHashCache.py')
+nxAvailableUpdates=imp.load_source('nxAvailableUpdates', './Scripts/nxAvailableUpdates.py')
 
 class nxUserTestCases(unittest2.TestCase):
     """
@@ -3863,6 +3865,384 @@ class nxFileInventoryTestCases(unittest2.TestCase):
 
 
 
+class FakeStat(object):
+    """
+    The os.stat fields nxHashCache keys its entries on, for a file
+    last changed age seconds ago.
+    """
+    def __init__(self, ino, age=3600):
+        self.st_dev = 1
+        self.st_ino = ino
+        self.st_size = 100
+        self.st_mtime = time.time() - age
+        self.st_ctime = self.st_mtime
+
+
+class nxHashCacheTestCases(unittest2.TestCase):
+    """
+    Test cases for nxHashCache.py
+    """
+    def setUp(self):
+        """
+        Setup test resources
+        """
+        self.cache_file = '/tmp/nxHashCacheTest/checksums'
+        os.system('rm -rf /tmp/nxHashCacheTest 2> /dev/null')
+        print(self.id() + '\n')
+
+    def tearDown(self):
+        """
+        Remove test resources.
+        """
+        os.system('rm -rf /tmp/nxHashCacheTest 2> /dev/null')
+
+    def testHashCacheLookupStored(self):
+        c = nxHashCache.HashCache(self.cache_file, 10)
+        st = FakeStat(1)
+        c.Store('md5', st, 'aaaa')
+        self.assertTrue(c.Lookup('md5', st) == 'aaaa', 'Lookup should return the stored digest')
+        self.assertTrue(c.Lookup('sha-256', st) is None, 'Lookup of another algorithm should return None')
+        self.assertTrue(c.Lookup('md5', FakeStat(2)) is None, 'Lookup of another file should return None')
+
+    def testHashCacheSkipsRacyFiles(self):
+        c = nxHashCache.HashCache(self.cache_file, 10)
+        st = FakeStat(1, nxHashCache.RacyInterval - 1)
+        c.Store('md5', st, 'aaaa')
+        self.assertTrue(c.Lookup('md5', st) is None,
+                        'A file changed within RacyInterval should not be cached')
+        c.Save()
+        self.assertTrue(not os.path.exists(self.cache_file), 'Save without new entries should not write')
+
+    def testHashCacheMaxEntriesZero(self):
+        c = nxHashCache.HashCache(self.cache_file, 0)
+        st = FakeStat(1)
+        c.Store('md5', st, 'aaaa')
+        self.assertTrue(c.Lookup('md5', st) is None, 'HashCacheMaxEntries=0 should disable the cache')
+
+    def testHashCacheEvictsLeastRecentlyUsed(self):
+        c = nxHashCache.HashCache(self.cache_file, 2)
+        stats = [FakeStat(1), FakeStat(2), FakeStat(3)]
+        c.Store('md5', stats[0], 'aaaa')
+        c.Store('md5', stats[1], 'bbbb')
+        self.assertTrue(c.Lookup('md5', stats[0]) == 'aaaa', 'Lookup should return the stored digest')
+        c.Store('md5', stats[2], 'cccc')
+        c.Save()
+        self.assertTrue(len(c.entries) == 2, 'Save should keep max_entries entries')
+        c = nxHashCache.HashCache(self.cache_file, 2)
+        self.assertTrue(c.Lookup('md5', stats[0]) == 'aaaa', 'The recently used entry should be kept')
+        self.assertTrue(c.Lookup('md5', stats[1]) is None, 'The least recently used entry should be dropped')
+        self.assertTrue(c.Lookup('md5', stats[2]) == 'cccc', 'The newest entry should be kept')
+
+    def testHashCacheLoadWriteRoundTrip(self):
+        c = nxHashCache.HashCache(self.cache_file, 10)
+        stats = [FakeStat(1), FakeStat(2), FakeStat(3)]
+        c.Store('md5', stats[0], 'aaaa')
+        c.Store('sha-256', stats[1], 'bbbb')
+        c.Store('md5', stats[2], 'cccc')
+        c.Save()
+        open(self.cache_file, 'a').write('not a cache entry\n')
+        d = nxHashCache.HashCache(self.cache_file, 10)
+        self.assertTrue(d.entries == c.entries, repr(d.entries) + ' should be == to ' + repr(c.entries))
+        self.assertTrue(d.clock == c.clock, 'The loaded clock should continue from the saved entries')
+        self.assertTrue(d.Lookup('sha-256', stats[1]) == 'bbbb', 'Lookup should return the saved digest')
+
+
+class FakePackageParams(object):
+    """
+    The nxPackage.Params fields the package listing and batch
+    transactions read.
+    """
+    def __init__(self, PackageManager, Name):
+        self.Ensure = 'present'
+        self.PackageManager = PackageManager
+        self.Name = Name
+        self.FilePath = ''
+        self.PackageGroup = False
+        self.Arguments = ''
+        self.CommandArguments = ''
+        self.ReturnCode = 0
+        self.record_delimiter = '@@'
+        self.field_delimiter = '#@#'
+        self.cmds = {'apt': {'stat': 'dpkg-query -W ', 'stat_all': 'dpkg-query -W all',
+                             'present': 'apt-get % install ^ --yes ', 'absent': 'apt-get % remove ^ --yes '},
+                     'yum': {'stat': 'rpm -q ', 'stat_all': 'rpm -qa',
+                             'present': 'yum -y % install ^ ', 'absent': 'yum -y % remove ^ '}}
+
+
+class nxPackageListingTestCases(unittest2.TestCase):
+    """
+    Test cases for the nxPackage listing of all packages
+    """
+    def setUp(self):
+        """
+        Setup test resources
+        """
+        self.RunGetOutput = nxPackage.RunGetOutput
+        self.PackageDatabaseKey = nxPackage.PackageDatabaseKey
+        self.generation = nxPackage.helperlib.StateGeneration
+        self.listings = 0
+        nxPackage.RunGetOutput = self.FakeRunGetOutput
+        nxPackage.PackageDatabaseKey = lambda PackageManager: (('/var/lib/dpkg/status', 1, 2, 3, 4, 5),)
+        nxPackage.DropPackageListings()
+        print(self.id() + '\n')
+
+    def tearDown(self):
+        """
+        Remove test resources.
+        """
+        nxPackage.RunGetOutput = self.RunGetOutput
+        nxPackage.PackageDatabaseKey = self.PackageDatabaseKey
+        nxPackage.helperlib.StateGeneration = self.generation
+        nxPackage.DropPackageListings()
+
+    def FakeRunGetOutput(self, cmd, no_output, chk_err=True):
+        self.listings += 1
+        records = []
+        for name in ('nano', 'libc6'):
+            records.append(name + '#@#' + name + ' package#@#1.0#@#installed\n')
+        return 0, '@@'.join(records)
+
+    def testStatFromListingPresent(self):
+        code, out = nxPackage.StatFromListing(FakePackageParams('apt', 'nano'))
+        self.assertTrue(code == 0, 'nano should be installed')
+        self.assertTrue(out == 'nano package#@#1.0#@#installed\n', repr(out))
+        code, out = nxPackage.StatFromListing(FakePackageParams('yum', 'libc6'))
+        self.assertTrue(code == 0, 'libc6 should be installed')
+        self.assertTrue(self.listings == 2, 'Each package manager should be listed once')
+
+    def testStatFromListingAbsent(self):
+        code, out = nxPackage.StatFromListing(FakePackageParams('apt', 'vim'))
+        self.assertTrue(code == 1 and 'no packages found matching vim' in out, repr(out))
+        code, out = nxPackage.StatFromListing(FakePackageParams('yum', 'vim'))
+        self.assertTrue(code == 1 and 'package vim is not installed' in out, repr(out))
+        self.assertTrue(nxPackage.StatFromListing(FakePackageParams('yum', 'vim-8.0-1.x86_64')) is not None,
+                        'A name-version form of a package that is not listed should be answered')
+        self.assertTrue(self.listings == 2, 'Each package manager should be listed once')
+
+    def testStatFromListingFallbacks(self):
+        for manager, name in (('apt', 'nano:amd64'), ('yum', 'nano-1.0-1'), ('yum', 'nano.x86_64'),
+                              ('apt', 'nan*'), ('yum', 'nan?'), ('apt', 'nan[o]')):
+            self.assertTrue(nxPackage.StatFromListing(FakePackageParams(manager, name)) is None,
+                            manager + ' ' + name + ' should be queried directly')
+
+    def testStatFromListingStateChanged(self):
+        nxPackage.StatFromListing(FakePackageParams('apt', 'nano'))
+        nxPackage.StatFromListing(FakePackageParams('apt', 'libc6'))
+        self.assertTrue(self.listings == 1, 'The listing should be reused')
+        nxPackage.helperlib.StateChanged()
+        nxPackage.StatFromListing(FakePackageParams('apt', 'nano'))
+        self.assertTrue(self.listings == 2, 'The listing should be taken again after a Set')
+
+
+def PackageInstance(name, properties=''):
+    """
+    A configuration MOF instance of nxPackage for name.
+    """
+    return 'instance of MSFT_nxPackageResource as $MSFT_nxPackageResource' + str(len(name)) + 'ref\n{\n' + \
+        'ResourceID = "[nxPackage]' + name + '";\n Ensure = "Present";\n Name = "' + name + '";\n' + \
+        properties + ' ModuleName = "nx";\n ModuleVersion = "1.0";\n};\n\n'
+
+
+FileInstance = 'instance of MSFT_nxFileResource as $MSFT_nxFileResource1ref\n{\n' + \
+    'ResourceID = "[nxFile]motd";\n DestinationPath = "/etc/motd";\n Contents = "hello";\n' + \
+    ' ModuleName = "nx";\n ModuleVersion = "1.0";\n};\n\n'
+
+ConfigurationDocument = 'instance of OMI_ConfigurationDocument\n{\n Version="2.0.0";\n Author="test";\n};\n'
+
+
+class nxPackageBatchTestCases(unittest2.TestCase):
+    """
+    Test cases for the nxPackage batch transactions
+    """
+    def setUp(self):
+        """
+        Setup test resources
+        """
+        self.dir = '/tmp/nxPackageBatchTest'
+        os.system('rm -rf ' + self.dir + ' 2> /dev/null')
+        os.makedirs(self.dir)
+        self.saved = (nxPackage.ConfigurationDir, nxPackage.GetPackageManager, nxPackage.RunGetOutput,
+                      nxPackage.PackageDatabaseKey, nxPackage.BatchTransactions)
+        nxPackage.ConfigurationDir = self.dir
+        nxPackage.GetPackageManager = lambda: 'apt'
+        nxPackage.RunGetOutput = self.FakeRunGetOutput
+        nxPackage.PackageDatabaseKey = lambda PackageManager: (('/var/lib/dpkg/status', 1, 2, 3, 4, 5),)
+        nxPackage.BatchTransactions = True
+        nxPackage.configuration = None
+        nxPackage.batched.clear()
+        nxPackage.DropPackageListings()
+        self.cmds = []
+        print(self.id() + '\n')
+
+    def tearDown(self):
+        """
+        Remove test resources.
+        """
+        (nxPackage.ConfigurationDir, nxPackage.GetPackageManager, nxPackage.RunGetOutput,
+         nxPackage.PackageDatabaseKey, nxPackage.BatchTransactions) = self.saved
+        nxPackage.configuration = None
+        nxPackage.batched.clear()
+        nxPackage.DropPackageListings()
+        os.system('rm -rf ' + self.dir + ' 2> /dev/null')
+
+    def FakeRunGetOutput(self, cmd, no_output, chk_err=True):
+        if cmd.endswith('all'):
+            return 0, 'git#@#git package#@#1.0#@#install ok installed\n'
+        self.cmds.append(cmd)
+        return 0, ''
+
+    def WriteMof(self, text, encoding='utf-8'):
+        F = open(self.dir + '/Pending.mof', 'wb')
+        F.write(text.encode(encoding))
+        F.close()
+        nxPackage.configuration = None
+
+    def BatchNames(self, text, **kwargs):
+        self.WriteMof(text)
+        p = FakePackageParams('apt', 'nano')
+        for name in kwargs:
+            setattr(p, name, kwargs[name])
+        return nxPackage.BatchNames(p)
+
+    def testParseConfigurationValues(self):
+        text = PackageInstance('nano', ' SourceInfo = "say \\"hi\\" {x}; \\\\done";\n') + \
+            PackageInstance('vim', ' DependsOn = {\n    "[nxPackage]nano",\n    "[nxFile]motd"\n};\n') + \
+            ConfigurationDocument
+        resources = nxPackage.ParseConfiguration(text)
+        self.assertTrue([r[0] for r in resources] == ['MSFT_nxPackageResource'] * 2, repr(resources))
+        self.assertTrue(resources[0][1]['SourceInfo'] == 'say "hi" {x}; \\done', repr(resources[0][1]))
+        self.assertTrue(resources[0][1]['ModuleVersion'] == '1.0', repr(resources[0][1]))
+        self.assertTrue(resources[1][1]['DependsOn'].startswith('{') and
+                        '"[nxFile]motd"' in resources[1][1]['DependsOn'], repr(resources[1][1]))
+        self.assertTrue(resources[1][1]['ModuleName'] == 'nx', 'The properties after an array should be read')
+
+    def testReadConfigurationUtf16(self):
+        text = PackageInstance('nano') + PackageInstance('vim') + ConfigurationDocument
+        self.WriteMof(text, 'utf-16')
+        resources = nxPackage.ReadConfiguration()
+        self.assertTrue([r[1]['Name'] for r in resources] == ['nano', 'vim'], repr(resources))
+
+    def testBatchNamesDependsOn(self):
+        text = PackageInstance('vim') + PackageInstance('nano') + PackageInstance('git') + \
+            PackageInstance('curl', ' DependsOn = {"[nxPackage]git"};\n') + PackageInstance('wget')
+        names = self.BatchNames(text)
+        self.assertTrue(names == ['git'], 'The batch should start after nano and end at DependsOn: ' + repr(names))
+
+    def testBatchNamesOtherResourceEndsBatch(self):
+        names = self.BatchNames(PackageInstance('nano') + PackageInstance('vim') + FileInstance + PackageInstance('git'))
+        self.assertTrue(names == ['vim'], 'A resource of another class should end the batch: ' + repr(names))
+
+    def testBatchNamesMismatched(self):
+        for properties in (' Ensure = "Absent";\n', ' Arguments = "--force";\n', ' PackageManager = "Yum";\n',
+                           ' FilePath = "/tmp/curl.deb";\n', ' ReturnCode = 1;\n'):
+            names = self.BatchNames(PackageInstance('nano') + PackageInstance('vim') +
+                                    PackageInstance('curl', properties) + PackageInstance('git'))
+            self.assertTrue(names == ['vim'], repr(properties) + ' should end the batch: ' + repr(names))
+        names = self.BatchNames(PackageInstance('nano') + PackageInstance('vim', ' PackageManager = "*";\n'))
+        self.assertTrue(names == ['vim'], 'PackageManager * should match the default package manager')
+        names = self.BatchNames(PackageInstance('nano', ' Arguments = "--force";\n') +
+                                PackageInstance('vim', ' Arguments = "--force";\n'),
+                                Arguments='--force')
+        self.assertTrue(names == ['vim'], 'The same Arguments should be batched: ' + repr(names))
+
+    def testBatchNameRejectsShellMetacharacters(self):
+        for name in ('vim;reboot', '$(reboot)', '`reboot`', 'vim reboot', 'vim|reboot', 'vim&', '-rf', '*'):
+            self.assertTrue(nxPackage.BatchName.match(name) is None, repr(name) + ' should not be batched')
+            names = self.BatchNames(PackageInstance('nano') + PackageInstance('vim') +
+                                    PackageInstance(name) + PackageInstance('git'))
+            self.assertTrue(names == ['vim'], repr(name) + ' should end the batch: ' + repr(names))
+        self.assertTrue(nxPackage.BatchName.match('libstdc++6:amd64') is not None)
+
+    def testSetBatch(self):
+        self.WriteMof(PackageInstance('nano') + PackageInstance('git') + PackageInstance('vim'))
+        self.assertTrue(nxPackage.SetBatch(FakePackageParams('apt', 'nano')) is True)
+        self.assertTrue(len(self.cmds) == 1 and self.cmds[0].endswith('install  --yes  nano vim'), repr(self.cmds))
+        self.assertTrue(nxPackage.SetBatch(FakePackageParams('apt', 'nano')) is False,
+                        'Packages should not be batched again within BatchRetrySeconds')
+
+
+class nxAvailableUpdatesCacheTestCases(unittest2.TestCase):
+    """
+    Test cases for the nxAvailableUpdates update list cache
+    """
+    def setUp(self):
+        """
+        Setup test resources
+        """
+        self.dir = '/tmp/nxAvailableUpdatesTest'
+        os.system('rm -rf ' + self.dir + ' 2> /dev/null')
+        os.makedirs(self.dir + '/solv')
+        self.solv = self.dir + '/solv/repo'
+        self.repomd = self.dir + '/repomd.xml'
+        open(self.solv, 'w').write('1')
+        open(self.repomd, 'w').write('1')
+        self.saved = (nxAvailableUpdates.RunGetOutput, nxAvailableUpdates.UpdatesCacheDir,
+                      nxAvailableUpdates.ZypperState, nxAvailableUpdates.YumState,
+                      nxAvailableUpdates.helperlib.CONFIG_SYSCONFDIR_DSC)
+        # omsagent refreshes and lists through the OMS*Updates.sh scripts
+        nxAvailableUpdates.helperlib.CONFIG_SYSCONFDIR_DSC = 'omsconfig'
+        nxAvailableUpdates.RunGetOutput = self.FakeRunGetOutput
+        nxAvailableUpdates.UpdatesCacheDir = self.dir + '/cache'
+        nxAvailableUpdates.ZypperState = [self.dir + '/solv/*']
+        nxAvailableUpdates.YumState = [self.repomd]
+        self.cmds = []
+        self.release = '322'
+        self.refresh_changes = False
+        print(self.id() + '\n')
+
+    def tearDown(self):
+        """
+        Remove test resources.
+        """
+        (nxAvailableUpdates.RunGetOutput, nxAvailableUpdates.UpdatesCacheDir,
+         nxAvailableUpdates.ZypperState, nxAvailableUpdates.YumState,
+         nxAvailableUpdates.helperlib.CONFIG_SYSCONFDIR_DSC) = self.saved
+        os.system('rm -rf ' + self.dir + ' 2> /dev/null')
+
+    def FakeRunGetOutput(self, cmd, no_output, chk_err=True):
+        if cmd.endswith('refresh'):
+            self.cmds.append('refresh')
+            if self.refresh_changes:
+                open(self.solv, 'a').write('2')
+            return 0, ''
+        if cmd.endswith('lu') or cmd.endswith('list'):
+            self.cmds.append('list')
+            return 0, 'v | Updates | glibc | 2.17-321 | 2.17-' + self.release + ' | x86_64\n'
+        if 'glibc.x86_64' in cmd:
+            self.cmds.append('info')
+            return 0, 'Name : glibc\nArch : x86_64\nVersion : 2.17\nRelease : ' + self.release + \
+                '\nRepo : updates\nBuildtime : 1600000000\n'
+        self.cmds.append('check-update')
+        return 100, 'Loaded plugins\n\nglibc.x86_64\n'
+
+    def testZypperRefreshesBeforeFingerprint(self):
+        nxAvailableUpdates.GetZypperUpdates('')
+        nxAvailableUpdates.GetZypperUpdates('')
+        self.assertTrue(self.cmds == ['refresh', 'list', 'refresh'], repr(self.cmds))
+        self.refresh_changes = True
+        self.release = '323'
+        updates = nxAvailableUpdates.GetZypperUpdates('')
+        self.assertTrue(self.cmds[3:] == ['refresh', 'list'], 'A refreshed solv file should invalidate the cache')
+        self.assertTrue(updates[0]['Version'] == '0:2.17-323', repr(updates))
+
+    def testYumRepositoryMetadataChanged(self):
+        nxAvailableUpdates.GetYumUpdates('')
+        nxAvailableUpdates.GetYumUpdates('')
+        self.assertTrue(self.cmds.count('info') == 1, repr(self.cmds))
+        open(self.repomd, 'a').write('2')
+        self.release = '323'
+        updates = nxAvailableUpdates.GetYumUpdates('')
+        self.assertTrue(self.cmds.count('info') == 2, 'Changed repository metadata should invalidate the cache')
+        self.assertTrue(updates[0]['Version'] == '0:2.17-323', repr(updates))
+
+    def testUpdatesCacheMaxAge(self):
+        nxAvailableUpdates.GetZypperUpdates('')
+        old = time.time() - nxAvailableUpdates.UpdatesCacheMaxAge - 60
+        os.utime(nxAvailableUpdates.UpdatesCacheDir + '/zypper', (old, old))
+        nxAvailableUpdates.GetZypperUpdates('')
+        self.assertTrue(self.cmds.count('list') == 2, 'A saved list older than UpdatesCacheMaxAge should not be used')
+
+
 ######################################
 if __name__ == '__main__':
     s1=unittest2.TestLoader().loadTestsFromTestCase(nxUserTestCases)
@@ -3883,6 +4263,10 @@ if __name__ == '__main__':
     s16=unittest2.TestLoader().loadTestsFromTestCase(nxMySqlUserTestCases)
     s17=unittest2.TestLoader().loadTestsFromTestCase(nxMySqlGrantTestCases)
     s18=unittest2.TestLoader().loadTestsFromTestCase(nxFileInventoryTestCases)
-    alltests = unittest2.TestSuite([s1,s2,s3,s4,s5,s6,s7,s8,s9,s10,s11,s12,s13,s14,s15,s16,s17,s18])
+    s19=unittest2.TestLoader().loadTestsFromTestCase(nxHashCacheTestCases)
+    s20=unittest2.TestLoader().loadTestsFromTestCase(nxPackageListingTestCases)
+    s21=unittest2.TestLoader().loadTestsFromTestCase(nxAvailableUpdatesCacheTestCases)
+    s22=unittest2.TestLoader().loadTestsFromTestCase(nxPackageBatchTestCases)
+    alltests = unittest2.TestSuite([s1,s2,s3,s4,s5,s6,s7,s8,s9,s10,s11,s12,s13,s14,s15,s16,s17,s18,s19,s20,s21,s22])
     if not unittest2.TextTestRunner(stream=sys.stdout,verbosity=0).run(alltests).wasSuccessful():
         sys.exit(1)
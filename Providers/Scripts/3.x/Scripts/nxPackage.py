@@ -14,6 +14,7 @@ import urllib.request
 import copy
 import fnmatch
 import re
+import threading
 apt = None
 rpm = None
 try:
@@ -355,6 +356,123 @@ def ShowMof(op, Ensure, PackageManager, Name, FilePath, PackageGroup, Arguments,
     f.close()
 
 
+# Test and Get of a package are answered from one listing of all
+# packages (the stat_all command, which GetAll parses as well) instead of
+# a dpkg-query or rpm query per resource.  The listing is taken again when
+# the package database changes, after a Set of this provider and once
+# client.py served any Set request (helperlib.StateGeneration).  Names it
+# can't answer, like patterns and rpm name-version forms, are queried
+# directly.
+DpkgDatabase = ('/var/lib/dpkg/status', '/var/lib/dpkg/updates')
+RpmDatabase = ('/var/lib/rpm/Packages', '/var/lib/rpm/Packages.db',
+               '/var/lib/rpm/rpmdb.sqlite', '/var/lib/rpm/rpmdb.sqlite-wal')
+PackageDatabases = {'apt': DpkgDatabase, 'yum': RpmDatabase,
+                    'zypper': RpmDatabase}
+
+# Providers are loaded with imp.load_source, which runs this file again;
+# keep the listings that were already taken.
+try:
+    package_listings
+except NameError:
+    package_listings = {}
+    package_listings_lock = threading.Lock()
+
+
+def PackageDatabaseKey(PackageManager):
+    key = []
+    for path in PackageDatabases.get(PackageManager, ()):
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        key.append((path, st.st_dev, st.st_ino, st.st_size, st.st_mtime,
+                    st.st_ctime))
+    return tuple(key)
+
+
+class PackageListing:
+
+    def __init__(self, p, database):
+        self.generation = helperlib.StateGeneration
+        self.database = database
+        # the stat_all output
+        self.text = ''
+        # what the stat command prints for each package, by name
+        self.packages = {}
+        self.loaded = self.Load(p)
+
+    def Load(self, p):
+        cmd = 'LANG=en_US.UTF8 ' + p.cmds[p.PackageManager]['stat_all']
+        code, out = RunGetOutput(cmd, False)
+        if code != 0:
+            return False
+        self.text = out
+        for record in out.split('\n' + p.record_delimiter):
+            fields = record.split(p.field_delimiter, 1)
+            if len(fields) != 2:
+                continue
+            name = fields[0].strip()
+            self.packages[name] = self.packages.get(name, '') + fields[1] + '\n'
+        return True
+
+    def Current(self, database):
+        return self.generation == helperlib.StateGeneration and \
+            self.database == database
+
+
+def GetPackageListing(p):
+    """
+    Returns the current listing of p.PackageManager's packages, or None
+    if there is none.
+    """
+    database = PackageDatabaseKey(p.PackageManager)
+    if len(database) == 0:
+        return None
+    cmd = p.cmds[p.PackageManager]['stat_all']
+    package_listings_lock.acquire()
+    try:
+        listing = package_listings.get(cmd)
+        if listing is None or not listing.Current(database):
+            listing = package_listings[cmd] = PackageListing(p, database)
+        if not listing.loaded:
+            return None
+        return listing
+    finally:
+        package_listings_lock.release()
+
+
+def DropPackageListings():
+    package_listings_lock.acquire()
+    try:
+        package_listings.clear()
+    finally:
+        package_listings_lock.release()
+
+
+def StatFromListing(p):
+    """
+    Returns the exit code and output of the stat command for p.Name, as
+    RunGetOutput would, or None if it must be run.
+    """
+    for c in '*?[\\':
+        if c in p.Name:
+            return None
+    listing = GetPackageListing(p)
+    if listing is None:
+        return None
+    if p.Name in listing.packages:
+        return 0, listing.packages[p.Name]
+    if p.cmds[p.PackageManager]['stat'].startswith('dpkg'):
+        if ':' in p.Name:  # name:architecture
+            return None
+        return 1, 'dpkg-query: no packages found matching ' + p.Name + '\n'
+    # rpm -q also matches name-version-release and name.arch
+    for i in range(len(p.Name)):
+        if p.Name[i] in '-.' and p.Name[:i] in listing.packages:
+            return None
+    return 1, 'package ' + p.Name + ' is not installed\n'
+
+
 def IsPackageInstalled(p):
     out = ''
     if p is None:
@@ -394,7 +512,12 @@ def IsPackageInstalled(p):
             return False, out
     else:
         cmd = 'LANG=en_US.UTF8 ' + p.cmds[p.PackageManager]['stat'] + p.Name
-    code, out = RunGetOutput(cmd, False)
+    result = None
+    if p.PackageGroup is not True:
+        result = StatFromListing(p)
+    if result is None:
+        result = RunGetOutput(cmd, False)
+    code, out = result
     if p.PackageGroup is True:  # implemented for YUM only.
         if 'Installed' in out:
             return True, out
@@ -442,42 +565,34 @@ def ParseInfo(p, info):
 
 def ParseAllInfo(info, p):
     pkg_list = []
-    d = {}
     if len(info) < 1 or p.record_delimiter not in info:
         return pkg_list
-    for pkg in re.split(p.record_delimiter, info):
-        d['Name'] = ''
-        d['PackageDescription'] = ''
-        d['Publisher'] = ''
-        d['InstalledOn'] = ''
+    for pkg in info.split(p.record_delimiter):
+        if len(pkg) <= 1:
+            continue
+        f = pkg.strip().split(p.field_delimiter)
+        if len(f) != 8:
+            print(
+                'ERROR in ParseAllInfo.  Output was ' + info, file=sys.stdout)
+            LG().Log(
+                'ERROR', 'ERROR in ParseAllInfo.  Output was ' + info)
+            return pkg_list
+        if len(p.Name) and not fnmatch.fnmatch(f[0], p.Name):
+            continue
+        d = {}
+        d['Name'] = f[0]
+        d['PackageDescription'] = f[1]
+        d['Publisher'] = f[2]
+        d['InstalledOn'] = f[3]
+        if not d['InstalledOn'].isalnum():
+            d['InstalledOn'] = time.gmtime(int(d['InstalledOn']))
         d['Size'] = '0'
-        d['Version'] = ''
-        d['Installed'] = False
-        d['Architecture'] = ''
-        if len(pkg) > 1:
-                pkg = pkg.strip()
-                f = re.split(p.field_delimiter, pkg)
-                if len(f) is 8:
-                    d['Name'] = f[0]
-                    if len(p.Name) and not fnmatch.fnmatch(d['Name'], p.Name):
-                        continue
-                    d['PackageDescription'] = f[1]
-                    d['Publisher'] = f[2]
-                    d['InstalledOn'] = f[3]
-                    if not d['InstalledOn'].isalnum():
-                        d['InstalledOn'] = time.gmtime(int(d['InstalledOn']))
-                    if len(f[4]) > 0:
-                        d['Size'] = f[4]
-                    d['Version'] = f[5]
-                    d['Installed'] = ('install' in f[6])
-                    d['Architecture'] = f[7]
-                if len(f) is not 8:
-                    print(
-                        'ERROR in ParseAllInfo.  Output was ' + info, file=sys.stdout)
-                    LG().Log(
-                        'ERROR', 'ERROR in ParseAllInfo.  Output was ' + info)
-                    return pkg_list         
-                pkg_list.append(copy.deepcopy(d))
+        if len(f[4]) > 0:
+            d['Size'] = f[4]
+        d['Version'] = f[5]
+        d['Installed'] = ('install' in f[6])
+        d['Architecture'] = f[7]
+        pkg_list.append(d)
     return pkg_list
 
 
@@ -518,6 +633,7 @@ def DoEnableDisable(p):
     cmd = cmd.replace('%', p.Arguments)
     cmd = cmd.replace('^', p.CommandArguments)
     code, out = RunGetOutput(cmd, False)
+    DropPackageListings()
     if len(p.LocalPath) > 1:  # create cache entry and remove the tmp file
         WriteCacheInfo(p)
         RemoveFile(p.LocalPath)
@@ -530,6 +646,180 @@ def DoEnableDisable(p):
     return True, out
 
 
+# With PackageBatchTransactions=true in dsc.conf, Set installs or removes
+# the package together with the nxPackage resources that directly follow
+# it in the configuration, when they need the same change with the same
+# PackageManager and Arguments, in one package manager transaction.  The
+# result of each package is taken from the package database afterwards:
+# packages that were changed pass their Test, and the current package is
+# changed on its own if the transaction didn't change it.  A package is
+# batched again only after BatchRetrySeconds.
+BatchTransactions = (helperlib.ReadDscConf().get(
+    'PackageBatchTransactions', 'false').lower() == 'true')
+BatchRetrySeconds = 600
+ConfigurationDir = helperlib.CONFIG_SYSCONFDIR + '/' + \
+    helperlib.CONFIG_SYSCONFDIR_DSC + '/configuration'
+BatchName = re.compile(r'^[A-Za-z0-9_][A-Za-z0-9_.+:~-]*$')
+MofInstance = re.compile(r'instance\s+of\s+(\w+)[^{]*\{')
+MofProperty = re.compile(
+    r'\s*(\w+)\s*=\s*("(?:[^"\\]|\\.)*"|\{[^}]*\}|[^;]*);')
+MofEscape = re.compile(r'\\(.)')
+
+# Providers are loaded with imp.load_source, which runs this file again;
+# keep the configuration that was already read.
+try:
+    configuration
+except NameError:
+    configuration = None
+    batched = {}
+
+
+def ParseConfiguration(text):
+    """
+    Returns the resources of a configuration MOF as a list of
+    (class name, {property: value}) in the order of the file.
+    """
+    resources = []
+    pos = 0
+    while True:
+        m = MofInstance.search(text, pos)
+        if m is None:
+            break
+        pos = m.end()
+        props = {}
+        while True:
+            pm = MofProperty.match(text, pos)
+            if pm is None:
+                break
+            pos = pm.end()
+            value = pm.group(2).strip()
+            if value.startswith('"'):
+                value = MofEscape.sub(r'\1', value[1:-1])
+            props[pm.group(1)] = value
+        if 'ResourceID' in props:
+            resources.append((m.group(1), props))
+    return resources
+
+
+def ReadConfiguration():
+    """
+    Returns the resources of the configuration being applied, or [].
+    """
+    global configuration
+    for name in ('Pending.mof', 'Current.mof'):
+        path = ConfigurationDir + '/' + name
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        key = (path, st.st_ino, st.st_size, st.st_mtime, st.st_ctime)
+        if configuration is not None and configuration[0] == key:
+            return configuration[1]
+        try:
+            F = open(path, 'rb')
+            try:
+                data = F.read()
+            finally:
+                F.close()
+        except (IOError, OSError):
+            return []
+        if data[:2] in (b'\xff\xfe', b'\xfe\xff'):
+            text = data.decode('utf-16', 'ignore')
+        else:
+            text = data.decode('utf-8', 'ignore')
+        configuration = (key, ParseConfiguration(text))
+        return configuration[1]
+    return []
+
+
+def BatchCompatible(p, props, default_manager):
+    if props.get('Ensure', 'present').lower() != p.Ensure:
+        return False
+    manager = props.get('PackageManager', '').lower()
+    if manager in ('', '*'):
+        manager = default_manager
+    if manager != p.PackageManager:
+        return False
+    if ParseArguments(props.get('Arguments', '')) != \
+            (p.Arguments, p.CommandArguments):
+        return False
+    if len(props.get('FilePath', '')) > 0 or \
+            props.get('PackageGroup', 'false').lower() == 'true' or \
+            props.get('ReturnCode', '0') != '0':
+        return False
+    return BatchName.match(props.get('Name', '')) is not None
+
+
+def BatchNames(p):
+    """
+    Returns the names of the packages of the nxPackage resources that
+    follow p's resource in the configuration and could be changed with it.
+    Resources with DependsOn may be applied in another order, so the
+    batch ends at the first one.
+    """
+    default_manager = GetPackageManager()
+    names = []
+    found = False
+    for class_name, props in ReadConfiguration():
+        if class_name != 'MSFT_nxPackageResource' or \
+                not BatchCompatible(p, props, default_manager):
+            if found:
+                break
+            continue
+        if not found:
+            found = (props['Name'] == p.Name)
+            continue
+        if 'DependsOn' in props:
+            break
+        names.append(props['Name'])
+    return names
+
+
+def SetBatch(p):
+    """
+    Changes p.Name and the packages from BatchNames that need the same
+    change in one transaction.  Returns False if there was nothing to
+    batch.
+    """
+    if not BatchTransactions or len(p.FilePath) > 0 or \
+            p.PackageGroup is True or int(p.ReturnCode) != 0 or \
+            BatchName.match(p.Name) is None:
+        return False
+    now = time.time()
+    names = []
+    for name in BatchNames(p):
+        key = (p.PackageManager, p.Ensure, name)
+        if now - batched.get(key, 0) < BatchRetrySeconds or name in names:
+            continue
+        q = copy.copy(p)
+        q.Name = name
+        result = StatFromListing(q)
+        if result is None:
+            continue
+        code, out = result
+        installed = (code == 0 and 'deinstall' not in out and
+                     'not-installed' not in out)
+        if installed != (p.Ensure == 'present'):
+            names.append(name)
+    if len(names) == 0:
+        return False
+    names.insert(0, p.Name)
+    for name in names:
+        batched[(p.PackageManager, p.Ensure, name)] = now
+    cmd = 'LANG=en_US.UTF8 ' + \
+        p.cmds[p.PackageManager][p.Ensure] + ' ' + ' '.join(names)
+    cmd = cmd.replace('%', p.Arguments)
+    cmd = cmd.replace('^', p.CommandArguments)
+    LG().Log('INFO', 'Changing ' + str(len(names)) +
+             ' packages in one transaction: ' + ' '.join(names))
+    code, out = RunGetOutput(cmd, False)
+    DropPackageListings()
+    if code != 0:
+        LG().Log('WARNING', 'Transaction for ' + ' '.join(names) +
+                 ' returned ' + str(code) + ': ' + out)
+    return True
+
+
 def WriteCacheInfo(p):
     if not os.path.isdir(cache_file_dir):
         if MakeDirs(cache_file_dir) is not None:
@@ -611,6 +901,10 @@ def Set(Ensure, PackageManager, Name, FilePath, PackageGroup, Arguments, ReturnC
     installed, out = IsPackageInstalled(p)
     if (installed and Ensure == 'present') or (not installed and Ensure == 'absent'):  # Nothing to do
         return [0]
+    if SetBatch(p):
+        installed, out = IsPackageInstalled(p)
+        if (installed and Ensure == 'present') or (not installed and Ensure == 'absent'):
+            return [0]
 
     result, out = DoEnableDisable(p)
     if result is False:
@@ -677,8 +971,12 @@ def GetAll(Ensure, PackageManager, Name,
         LG().Log(
             'ERROR', 'ERROR - Unable to initialize nxPackageProvider. ' + e.message)
         return [-1, ]
-    cmd = 'LANG=en_US.UTF8 ' + p.cmds[p.PackageManager]['stat_all']
-    code, out = RunGetOutput(cmd, False)
+    listing = GetPackageListing(p)
+    if listing is not None:
+        out = listing.text
+    else:
+        cmd = 'LANG=en_US.UTF8 ' + p.cmds[p.PackageManager]['stat_all']
+        code, out = RunGetOutput(cmd, False)
     pkgs = ParseAllInfo(out, p)
     return [0, pkgs]
 
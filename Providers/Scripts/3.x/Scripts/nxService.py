@@ -13,6 +13,9 @@ import codecs
 import imp
 import time
 import copy
+import threading
+import tempfile
+import signal
 import re
 import fnmatch
 from functools import reduce
@@ -60,6 +63,7 @@ def Set_Marshall(Name, Controller, Enabled, State):
     if Controller == '':
         return [-1]
     retval = Set(Name, Controller, Enabled, State)
+    DropServiceCache()
     return retval
 
 
@@ -399,6 +403,135 @@ def Process(params, no_output=False):
     return (out, out, code)
 
 
+# Status commands are run through Probe: they are killed after
+# ProbeTimeout seconds, RunProbes runs up to ProbeThreads of them at a
+# time, and their results are reused for ServiceCacheSeconds (dsc.conf,
+# 0 turns reuse off) so that Test, Get and Inventory in one run don't run
+# them again.  Results are dropped after a Set of this provider and once
+# client.py served any Set request (helperlib.StateGeneration).
+ProbeThreads = 8
+ProbeTimeout = 30
+ServiceCacheSeconds = 60
+try:
+    ServiceCacheSeconds = int(helperlib.ReadDscConf().get(
+        'ServiceCacheSeconds', ServiceCacheSeconds))
+except ValueError:
+    LG().Log('ERROR', 'Invalid ServiceCacheSeconds in dsc.conf')
+
+# Providers are loaded with imp.load_source, which runs this file again;
+# keep the results that were already collected.
+try:
+    probe_results
+except NameError:
+    probe_results = {}
+
+
+def KillProbe(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+def RunProbe(cmd, stderr):
+    """
+    Runs cmd like RunGetOutput (stderr=True) or RunGetOutputNoStderr
+    would, but kills it and everything it started after ProbeTimeout
+    seconds.  Returns the exit code and the output.
+    """
+    out = tempfile.TemporaryFile()
+    try:
+        if stderr:
+            err = subprocess.STDOUT
+        else:
+            err = subprocess.DEVNULL
+        try:
+            process = subprocess.Popen(cmd, shell=True, stdout=out,
+                                       stderr=err, start_new_session=True)
+        except OSError:
+            LG().Log('ERROR', 'Unable to run ' + cmd + ': ' +
+                     str(sys.exc_info()[1]))
+            return 1, ''
+        timer = threading.Timer(ProbeTimeout, KillProbe, [process])
+        timer.start()
+        try:
+            process.wait()
+        finally:
+            timer.cancel()
+        if process.returncode == -signal.SIGKILL:
+            LG().Log('WARNING', cmd + ' was killed after ' +
+                     str(ProbeTimeout) + ' seconds')
+        out.seek(0)
+        return process.returncode, out.read().decode('ascii', 'ignore')
+    finally:
+        out.close()
+
+
+def Probe(cmd, stderr=False):
+    """
+    Returns RunProbe(cmd, stderr), or its result from earlier in the run.
+    """
+    key = (cmd, stderr)
+    now = time.time()
+    cached = probe_results.get(key)
+    if cached is not None and cached[0] == helperlib.StateGeneration \
+            and now - cached[1] < ServiceCacheSeconds:
+        return cached[2]
+    result = RunProbe(cmd, stderr)
+    if ServiceCacheSeconds > 0:
+        probe_results[key] = (helperlib.StateGeneration, now, result)
+    return result
+
+
+def RunProbes(cmds, stderr=False):
+    """
+    Probes every command in cmds, ProbeThreads at a time, and returns
+    their results in the order of cmds.
+    """
+    results = [None] * len(cmds)
+    todo = list(range(len(cmds)))
+    lock = threading.Lock()
+
+    def work():
+        while True:
+            lock.acquire()
+            try:
+                if len(todo) == 0:
+                    return
+                i = todo.pop(0)
+            finally:
+                lock.release()
+            try:
+                results[i] = Probe(cmds[i], stderr)
+            except:
+                LG().Log('ERROR', 'Unable to run ' + cmds[i] + ': ' +
+                         str(sys.exc_info()[1]))
+                results[i] = (1, '')
+
+    threads = []
+    for n in range(min(ProbeThreads, len(cmds))):
+        t = threading.Thread(target=work)
+        t.start()
+        threads.append(t)
+    for t in threads:
+        t.join()
+    return results
+
+
+def ProbeProcess(params):
+    """
+    Process for status commands, through Probe.
+    """
+    code, out = Probe(' '.join(params), True)
+    return (out, out, code)
+
+
+def DropServiceCache():
+    global systemd_snapshot
+    systemd_snapshot = None
+    probe_results.clear()
+
+
 def StartService(sc):
     if sc.Controller == "systemd":
         (process_stdout, process_stderr, retval) = Process(
@@ -496,7 +629,7 @@ def StopService(sc):
 
 
 def GetRunLevel():
-    (process_stdout, process_stderr, retval) = Process([runlevel_path])
+    (process_stdout, process_stderr, retval) = ProbeProcess([runlevel_path])
 
     if retval is not 0:
         Print("Error: " + runlevel_path + " failed: " +
@@ -555,8 +688,121 @@ def DetermineInitEnabled(stdout, runlevel):
         return False
 
 
+# Test, Get and Inventory of systemd services are answered from one
+# snapshot of all service units, taken with two systemctl processes,
+# instead of a few systemctl processes per resource.  It is kept like
+# the results of Probe.  Services that are not in it are probed directly.
+SystemdProperties = 'Names,WantedBy,Description,LoadState,SubState,FragmentPath,UnitFileState'
+
+# UnitFileState values for which 'systemctl is-enabled' succeeds or fails;
+# other states are left to is-enabled.
+SystemdEnabledStates = ('enabled', 'enabled-runtime', 'static')
+SystemdDisabledStates = ('disabled', 'masked', 'masked-runtime', 'linked',
+                         'linked-runtime', 'bad')
+
+# Providers are loaded with imp.load_source, which runs this file again;
+# keep the snapshot that was already taken.
+try:
+    systemd_snapshot
+except NameError:
+    systemd_snapshot = None
+    systemd_snapshot_lock = threading.Lock()
+
+
+class SystemdSnapshot:
+
+    def __init__(self):
+        self.time = time.time()
+        self.generation = helperlib.StateGeneration
+        # unit file names in the order of list-unit-files
+        self.names = []
+        # names that list-unit-files shows as aliases of other units
+        self.aliases = []
+        # properties of the units, by unit file name
+        self.units = {}
+        self.loaded = self.Load()
+
+    def Load(self):
+        cmd = systemctl_path + ' -a --no-pager list-unit-files'
+        code, txt = RunGetOutputNoStderr(cmd, False, True)
+        if code != 0:
+            return False
+        for line in txt.splitlines():
+            fields = line.split()
+            if len(fields) and fields[0].endswith('.service') \
+                    and '@' not in fields[0]:
+                self.names.append(fields[0])
+                if len(fields) > 1 and fields[1] == 'alias':
+                    self.aliases.append(fields[0])
+        if len(self.names) == 0:
+            return True
+        cmd = systemctl_path + ' -a --no-pager --no-legend -p ' + \
+            SystemdProperties + ' show'
+        for name in self.names:
+            cmd += " '" + name.replace("'", "'\\''") + "'"
+        code, txt = RunGetOutputNoStderr(cmd, False, True)
+        if code != 0:
+            return False
+        blocks = txt.strip('\n').split('\n\n')
+        if len(blocks) != len(self.names):
+            return False
+        for name, block in zip(self.names, blocks):
+            unit = {}
+            for line in block.splitlines():
+                if '=' in line:
+                    key, value = line.split('=', 1)
+                    unit[key] = value
+            self.units[name] = unit
+        return True
+
+    def Current(self):
+        return self.generation == helperlib.StateGeneration and \
+            time.time() - self.time < ServiceCacheSeconds
+
+
+def GetSystemdSnapshot():
+    """
+    Returns the current snapshot of the systemd services, or None if
+    systemctl failed.
+    """
+    global systemd_snapshot
+    systemd_snapshot_lock.acquire()
+    try:
+        if systemd_snapshot is None or not systemd_snapshot.Current():
+            systemd_snapshot = SystemdSnapshot()
+        if not systemd_snapshot.loaded:
+            return None
+        return systemd_snapshot
+    finally:
+        systemd_snapshot_lock.release()
+
+
+def GetSystemdUnit(sc):
+    """
+    Returns the properties of service sc.Name from the snapshot, or None
+    if it isn't in the snapshot.  systemctl answers differently for
+    aliases, so they aren't taken from it.
+    """
+    if ServiceCacheSeconds <= 0:
+        return None
+    snapshot = GetSystemdSnapshot()
+    if snapshot is None:
+        return None
+    name = sc.Name
+    if not name.endswith('.service'):
+        name += '.service'
+    if name in snapshot.aliases:
+        return None
+    return snapshot.units.get(name)
+
+
 def GetSystemdState(sc):
-    (process_stdout, process_stderr, retval) = Process(
+    unit = GetSystemdUnit(sc)
+    if unit is not None:
+        if unit.get('SubState') == 'running':
+            return "running"
+        return "stopped"
+    (process_stdout, process_stderr, retval) = ProbeProcess(
         [systemctl_path, "status", sc.Name])
     if retval is 0:
         if '(running)' in process_stdout:
@@ -572,7 +818,13 @@ def TestSystemdState(sc):
 
 
 def GetSystemdEnabled(sc):
-    (process_stdout, process_stderr, retval) = Process(
+    unit = GetSystemdUnit(sc)
+    if unit is not None:
+        if unit.get('UnitFileState') in SystemdEnabledStates:
+            return True
+        if unit.get('UnitFileState') in SystemdDisabledStates:
+            return False
+    (process_stdout, process_stderr, retval) = ProbeProcess(
         [systemctl_path, "is-enabled", sc.Name])
     if retval is 0:
         return True
@@ -598,7 +850,7 @@ def TestSystemd(sc):
 
 
 def GetUpstartState(sc):
-    (process_stdout, process_stderr, retval) = Process(
+    (process_stdout, process_stderr, retval) = ProbeProcess(
         [upstart_status_path, sc.Name])
 
     if retval is not 0:
@@ -681,7 +933,7 @@ def GetUpstartEnabled(sc):
                            "../init.d/" + sc.Name:
                         return True
                 return False
-            (process_stdout, process_stderr, retval) = Process(
+            (process_stdout, process_stderr, retval) = ProbeProcess(
                 ['chkconfig', sc.Name, ''])  # try init style
             if retval is 0:
                 if 'off' not in process_stdout:
@@ -749,8 +1001,8 @@ def GetInitState(sc):
         else:  # invoke the service directly
             check_state_program = '/etc/init.d/'
     if check_state_program == '/etc/init.d/':
-        (process_stdout, process_stderr, retval) = Process(
-            [check_state_program + sc.Name, "status"], True)
+        (process_stdout, process_stderr, retval) = ProbeProcess(
+            [check_state_program + sc.Name, "status"])
         if retval is not 0:
             Print("Error: " + check_state_program +
                   sc.Name + " status failed: ", file=sys.stderr)
@@ -761,7 +1013,7 @@ def GetInitState(sc):
             else:
                 return "stopped"
     else:
-        (process_stdout, process_stderr, retval) = Process(
+        (process_stdout, process_stderr, retval) = ProbeProcess(
             [check_state_program, sc.Name, "status"])
     if retval is not 0:
         if IsServiceRunning(sc):
@@ -794,7 +1046,7 @@ def GetInitEnabled(sc):
         return False
     else:
         check_enabled_program = initd_chkconfig
-        (process_stdout, process_stderr, retval) = Process(
+        (process_stdout, process_stderr, retval) = ProbeProcess(
             [check_enabled_program, "--list", sc.Name])
 
         if retval is not 0:
@@ -827,11 +1079,22 @@ def TestInit(sc):
     return [0]
 
 
+def Which(program):
+    """
+    Returns the path of program that 'which' would print, or None.
+    """
+    for d in os.environ.get('PATH', '').split(os.pathsep):
+        path = os.path.join(d, program)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+
 def SystemdExists():
     global systemctl_path
-    code, out = RunGetOutput('which systemctl', False, False)
-    if code is 0:
-        systemctl_path = out.strip()
+    path = Which('systemctl')
+    if path is not None:
+        systemctl_path = path
         return True
     else:
         return False
@@ -858,7 +1121,10 @@ def InitExists():
 
 
 def ServiceExistsInSystemd(sc):
-    (process_stdout, process_stderr, retval) = Process(
+    unit = GetSystemdUnit(sc)
+    if unit is not None and unit.get('LoadState') == 'loaded':
+        return True
+    (process_stdout, process_stderr, retval) = ProbeProcess(
         [systemctl_path, "status", sc.Name])
     if retval is not 0:
         if "Loaded: loaded" in process_stdout:
@@ -870,7 +1136,7 @@ def ServiceExistsInSystemd(sc):
 
 
 def ServiceExistsInUpstart(sc):
-    (process_stdout, process_stderr, retval) = Process(
+    (process_stdout, process_stderr, retval) = ProbeProcess(
         [upstart_status_path, sc.Name])
 
     if retval is not 0:
@@ -884,7 +1150,7 @@ def ServiceExistsInInit(sc):
     if os.path.isfile(initd_invokerc) and os.path.isfile(initd_updaterc):
         check_state_program = initd_invokerc
 
-    (process_stdout, process_stderr, retval) = Process(
+    (process_stdout, process_stderr, retval) = ProbeProcess(
         [check_state_program, sc.Name, "status"])
 
     if "unrecognized service" in process_stderr \
@@ -1425,12 +1691,12 @@ def GetAll(sc):
 def GetRunlevels(sc, Name):
     if sc.runlevels_d == None:
         sc.runlevels_d = {}
-        cmd = "file /etc/rc*.d/* | grep link | awk '{print $5,$1}' | sort"
-        code, out = RunGetOutput(cmd, False, False)
-        for line in out.splitlines():
-            line = line.replace("'", '')
-            srv = line.split(' ')[0]
-            rl = line.split(' ')[1]
+        links = []
+        for rl in glob.glob('/etc/rc*.d/*'):
+            if os.path.islink(rl):
+                links.append((os.readlink(rl), rl))
+        links.sort()
+        for srv, rl in links:
             n = os.path.basename(srv)
             if n not in sc.runlevels_d.keys():
                 sc.runlevels_d[n] = {}
@@ -1449,68 +1715,46 @@ def GetRunlevels(sc, Name):
 
 def SystemdGetAll(sc):
     d = {}
-    if os.system('which systemctl') != 0:
+    if not SystemdExists():
         Print("Error: 'Controller' = " + sc.Controller +
               " is incorrectly specified.", file=sys.stderr)
         LG().Log('ERROR', "Error: 'Controller' = " +
            sc.Controller + " is incorrectly specified.")
         return False
+    snapshot = GetSystemdSnapshot()
+    if snapshot is None: # Serious problem, return False
+        return False
     Name = sc.Name
     if '*' not in Name and '?' not in Name and len(Name) > 0:
         Name = Name.replace('.service', '')
         Name += '.service'
-    # Do the commands work?
-    # There may be no error detected in our multi-pipe command below.
-    # To keep from returning garbage, we must test the commands.
-    # RunGetOutput(chk_err = True) will log the error message here if it
-    # occurs.
-    cmd = 'systemctl -a list-unit-files ' + Name
-    code, txt = RunGetOutputNoStderr(cmd, False, True)
-    if code != 0: # Serious problem, return False
-        return False
-    sname = ''
-    # Get the last service name from the output.
-    m = re.search(r'.*?\n(.*?)[.]service.*?\n', txt, re.M)
-    if m is None: # The result is empty, return True.
-        return True
-    sname = m.group(1)
-    cmd = 'systemctl -a --no-pager --no-legend -p "Names,WantedBy,Description,SubState,FragmentPath,UnitFileState" show ' + sname
-    code, txt = RunGetOutputNoStderr(cmd, False, True)
-    if code != 0: 
-        return False
-    # Now we know it will work.
-    cmd = 'systemctl -a list-unit-files ' + Name +  '| grep \.service | grep -v "@" | awk \'{print $1}\' | xargs systemctl -a --no-pager --no-legend -p "Names,WantedBy,Description,SubState,FragmentPath,UnitFileState" show'
-    code, txt = RunGetOutputNoStderr(cmd, False, False)
-    txt=txt.replace('\n\n','@@')
-    txt=txt.replace('\n','|')
-    services=txt.split('@@')
-    subs=re.compile(r'(.*?=)')
-    for srv in services:
-        if len(srv) == 0:
+    for name in snapshot.names:
+        if len(Name) and not fnmatch.fnmatch(name, Name):
             continue
-        s=srv.split('|')
-        d['Name'] = subs.sub('',s[0].replace('.service',''))
-        d['Controller'] =  sc.Controller
-        d['Description'] =subs.sub('',s[2])
-        d['State'] = subs.sub('',s[3])
+        unit = snapshot.units[name]
+        d['Name'] = unit.get('Names', '').replace('.service', '')
+        d['Controller'] = sc.Controller
+        d['Description'] = unit.get('Description', '')
+        d['State'] = unit.get('SubState', '')
         if len(sc.State) and sc.State != d['State'].lower():
             continue
-        d['Path'] = subs.sub('',s[4])
-        d['Enabled'] = 'enabled' in subs.sub('',s[5])
+        d['Path'] = unit.get('FragmentPath', '')
+        d['Enabled'] = 'enabled' in unit.get('UnitFileState', '')
         if sc.FilterEnabled and sc.Enabled != d['Enabled']:
             continue
-        rld=GetRunlevels(sc,d['Name'])
+        rld = GetRunlevels(sc, d['Name'])
         if rld != None and 'Runlevels' in rld.keys():
             d['Runlevels'] = rld['Runlevels']
         else:
-            d['Runlevels'] = subs.sub('',s[1])
+            d['Runlevels'] = unit.get('WantedBy', '')
         sc.services_list.append(copy.deepcopy(d))
     return True
 
 def UpstartGetAll(sc):
     d={}
     names={}
-    if os.system('which initctl') != 0:
+    entries=[]
+    if Which('initctl') is None:
         Print("Error: 'Controller' = " + sc.Controller + " is incorrectly specified.", file=sys.stderr)
         LG().Log('ERROR', "Error: 'Controller' = " + sc.Controller + " is incorrectly specified.")
         return False
@@ -1565,13 +1809,19 @@ def UpstartGetAll(sc):
             continue
         if len(s[1]) > 1:
             cmd = 'initctl show-config ' + d['Name'] + ' | grep -E "start |stop " | tr "\n" " " | tr -s " " '
-            code, out = RunGetOutputNoStderr(cmd, False, False) 
-            d['Runlevels'] = out[1:]
+            entries.append((copy.deepcopy(d), cmd))
         else:
             rld=GetRunlevels(sc,d['Name'])
             if rld != None and 'Runlevels' in rld.keys():
                 d['Runlevels'] = rld['Runlevels']
-        sc.services_list.append(copy.deepcopy(d))
+            entries.append((copy.deepcopy(d), None))
+    # show-config of every job at once, merged back in order
+    results = RunProbes([cmd for d, cmd in entries if cmd is not None])
+    for d, cmd in entries:
+        if cmd is not None:
+            code, out = results.pop(0)
+            d['Runlevels'] = out[1:]
+        sc.services_list.append(d)
     return True
 
 def InitdGetAll(sc):
@@ -1605,18 +1855,22 @@ def InitdGetAll(sc):
         cmd = initd_chkconfig + ' --list | grep on | grep -v based'
         code, txt = RunGetOutputNoStderr(cmd, False, False)
         services=txt.splitlines()
+        entries=[]
         for srv in services:
             if len(srv) == 0:
                 continue
             s=srv.split()
-            d['Name'] = s[0]
-            if len(sc.Name) and not fnmatch.fnmatch(d['Name'],sc.Name):
+            if len(sc.Name) and not fnmatch.fnmatch(s[0],sc.Name):
                 continue
+            entries.append((srv, s))
+        # status of every service at once, in the order of chkconfig
+        cmds = [initd_service_status + ' ' + s[0] + status_postfix for srv, s in entries]
+        results = RunProbes(cmds)
+        for (srv, s), (code, txt) in zip(entries, results):
+            d['Name'] = s[0]
             d['Controller'] =  sc.Controller
             d['Description'] = ''
             d['State'] = 'stopped'
-            cmd = initd_service_status + ' ' + s[0] + status_postfix
-            code, txt = RunGetOutputNoStderr(cmd, False, False)
             if 'running' in txt:
                 d['State'] = 'running'
             if len(sc.State) and sc.State != d['State'].lower():
@@ -8,12 +8,12 @@ from contextlib import contextmanager
 
 import os
 import sys
-import pwd
 import re
 import time
 import imp
 protocol = imp.load_source('protocol', '../protocol.py')
 nxDSCLog = imp.load_source('nxDSCLog', '../nxDSCLog.py')
+nxIdentityCache = imp.load_source('nxIdentityCache', '../nxIdentityCache.py')
 LG = nxDSCLog.DSCLog
 
 # [Key] string KeyComment;
@@ -99,7 +99,7 @@ class Params:
             raise Exception('BadParameter')
         pw_st = None
         try:
-            pw_st = pwd.getpwnam(UserName)
+            pw_st = nxIdentityCache.getpwnam(UserName)
         except KeyError:
             Print('ERROR:  UserName:' + UserName +
                   ' does not exist.', file=sys.stderr)
@@ -238,7 +238,7 @@ def AddKey(p):
             os.makedirs(d)
             os.chmod(d, 0o700)
             os.chown(
-                d, pwd.getpwnam(p.UserName).pw_uid, pwd.getpwnam(p.UserName).pw_gid)
+                d, nxIdentityCache.getpwnam(p.UserName).pw_uid, nxIdentityCache.getpwnam(p.UserName).pw_gid)
         except IOError as error:
             Print("Exception creating directory " + d + " Error Code: " +
                   str(error.errno) + " Error: " + error.strerror, file=sys.stderr)
@@ -281,8 +281,8 @@ def AddKey(p):
             F.write(n)
             F.close()
         os.chmod(path, 0o700)
-        os.chown(path, pwd.getpwnam(p.UserName).pw_uid,
-                 pwd.getpwnam(p.UserName).pw_gid)
+        os.chown(path, nxIdentityCache.getpwnam(p.UserName).pw_uid,
+                 nxIdentityCache.getpwnam(p.UserName).pw_gid)
     return error
 
 
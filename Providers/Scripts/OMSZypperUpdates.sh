@@ -1,5 +1,8 @@
 #!/bin/bash
-zypper -qn refresh &> /dev/null
-zypper -q lu 
-
-
+# refresh: refresh the repositories, list: list the updates, neither: both.
+if [ "$1" != "list" ]; then
+    zypper -qn refresh &> /dev/null
+fi
+if [ "$1" != "refresh" ]; then
+    zypper -q lu
+fi
@@ -2,25 +2,73 @@
 # Copyright (c) Microsoft Corporation. All rights reserved. See license.txt for license information.
 #============================================================================
 import os
+import helperlib
 import protocol
 import socket
 import struct
 import sys
+import subprocess
+import threading
+import time
 import traceback
 import ctypes
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+try:
+    import cProfile
+except ImportError:
+    cProfile = None
 
-DO_TRACE = True
-DO_VERBOSE_TRACE  = False
 ScriptsDir = "<DSC_SCRIPT_PATH>"
 VarDir = "<PYTHON_PID_DIR>"
+StartTime = time.time ()
+
+# resource modules imported so far, by class name
+providers = dict ()
+
+# When the host passes a worker count after the socket fd, every request
+# frame starts with a uint32 request id, requests are served by that many
+# threads and each response starts with the id of its request, in whatever
+# order they complete.  Only Test, Get and Inventory requests overlap: a Set
+# runs alone, since providers keep module state that a Set may change (for
+# example nxGroup.SwapGroupModCommand).  Resource classes listed here are
+# limited to that many requests at a time; package managers hold a
+# system-wide lock anyway.
+PROVIDER_CONCURRENCY = {
+    'nxPackage' : 1,
+    'nxAvailableUpdates' : 1,
+    }
 
-def trace (text):
-    if DO_TRACE:
-        sys.stdout.write (text + '\n')
+# Per-request metrics, enabled with PythonClientMetrics=true in dsc.conf.
+# Setting PythonClientProfileThreshold=<seconds> as well profiles every
+# provider call and keeps the cProfile stats of those that took longer.
+MetricsFile = VarDir + '/log/dsc_python_metrics.log'
+MetricsMaxBytes = 1048576
+ProfileDir = VarDir + '/log'
+metrics_log = None
+profile_threshold = None
+child_count = [0]
 
-def verbose_trace (text):
-    if DO_VERBOSE_TRACE:
-        trace (text)
+Operations = ('Test','Set','Get','Inventory')
+
+# Tracing is shared with protocol.py; PythonClientTraceLevel=off|info|verbose
+# in dsc.conf sets the level.  Messages are only formatted when it is on.
+TraceLevels = {
+    'off' : protocol.TRACE_OFF,
+    'info' : protocol.TRACE_INFO,
+    'verbose' : protocol.TRACE_VERBOSE,
+    }
+trace = protocol.trace
+verbose_trace = protocol.verbose_trace
+
+def enable_trace ():
+    level = helperlib.ReadDscConf ().get ('PythonClientTraceLevel', 'off')
+    if level.lower () in TraceLevels:
+        protocol.set_trace_level (TraceLevels[level.lower ()])
+    else:
+        sys.stderr.write ('Invalid PythonClientTraceLevel: ' + level)
 
         
 def read_uchar (fd):
@@ -29,45 +77,75 @@ def read_uchar (fd):
     if len (buf) < 1:
         return None
     val = struct.unpack ('@B',buf)[0]
-    verbose_trace ('  val: '+str(int (val)))
+    verbose_trace ('  val: %d', val)
     verbose_trace ('</read_uchar>')
     return val
 
 
-def read_request (fd):
+def read_request (fd, metrics = None):
     verbose_trace ('<read_request>')
     op_type = read_uchar (fd)
     if op_type == None:
         return None
-    verbose_trace ('  op_type: ' + str(op_type))
+    start = time.time ()
+    verbose_trace ('  op_type: %s', op_type)
     op_name = protocol.read_string (fd)
-    verbose_trace ('  op_name: "'+ op_name +'"')
+    verbose_trace ('  op_name: "%s"', op_name)
     d = protocol.read_values (fd)
+    if metrics is not None:
+        metrics.decode = time.time () - start
     verbose_trace ('</read_request>')
     return (op_type, op_name, d)
 
     
 def write_int (fd, val):
     verbose_trace ('<write_int>')
-    verbose_trace ('  val: '+str(val))
+    verbose_trace ('  val: %s', val)
     buf = struct.pack ('@i', val)
-    fd.send (buf)
+    fd.sendall (buf)
     verbose_trace ('</write_int>')
 
 
-def write_success (fd, args = None):
+def read_tagged_request (fd, metrics = None):
+    verbose_trace ('<read_tagged_request>')
+    buf = protocol.recv_exact (fd, 4)
+    if len (buf) < 4:
+        return None
+    request_id = struct.unpack ('@I', buf)[0]
+    verbose_trace ('  request_id: %s', request_id)
+    req = read_request (fd, metrics)
+    if req == None:
+        return None
+    verbose_trace ('</read_tagged_request>')
+    return (request_id, req)
+
+
+def write_request_id (fd, request_id):
+    if request_id is not None:
+        fd.sendall (struct.pack ('@I', request_id))
+
+
+def write_success (fd, args = None, request_id = None):
     trace ('<write_success>')
-    write_int (fd, 0)
+    buf = protocol.WriteBuffer ()
+    write_request_id (buf, request_id)
+    write_int (buf, 0)
     if args is not None:
-        protocol.write_values (fd, args)
+        protocol.write_values (buf, args)
+    size = buf.flush (fd)
     trace ('</write_success>')
+    return size
 
 
-def write_failed (s, fail_code, text=''):
+def write_failed (s, fail_code, text='', request_id = None):
     trace ('<write_failed>')
-    write_int (s, fail_code)
-    protocol.write_string (s, text)
+    buf = protocol.WriteBuffer ()
+    write_request_id (buf, request_id)
+    write_int (buf, fail_code)
+    protocol.write_string (buf, text)
+    size = buf.flush (s)
     trace ('</write_failed>')
+    return size
 
 
 def translate_input (d):
@@ -95,55 +173,302 @@ def translate_input (d):
     return oldStyleD
 
 
+def load_provider (name):
+    """ Imports the resource module the first time a request for it
+        arrives, so that a configuration only pays for the modules it uses.
+        Only the modules listed in Scripts/__init__.py can be loaded."""
+    if name in providers:
+        return providers[name]
+    import Scripts
+    if name not in Scripts.__all__:
+        return None
+    start = time.time ()
+    __import__ ('Scripts.' + name)
+    providers[name] = sys.modules['Scripts.' + name]
+    trace ('loaded %s in %.3fs', name, time.time () - start)
+    return providers[name]
+
+
 def callMOF (req):
     oldStyleDict = translate_input (req[2])
-    trace ('MOF=' + repr ((req[0], req[1], oldStyleDict)))
-    op = ('Test','Set','Get','Inventory')
-    if req[1] not in globals().keys():
+    verbose_trace ('MOF=%r', (req[0], req[1], oldStyleDict))
+    the_module = load_provider (req[1])
+    if the_module is None:
         sys.stderr.write('Unable to find module: ' + req[1])
         return None
-    the_module = globals ()[req[1]]
-    method_name = op[req[0]] + '_Marshall'
+    method_name = Operations[req[0]] + '_Marshall'
     if not method_name in the_module.__dict__.keys():
         sys.stderr.write ('Unable to find method: ' + method_name)
         return None
-    trace ('calling '+ req[1] + '.' + method_name + ' ' + repr (oldStyleDict))
+    trace ('calling %s.%s', req[1], method_name)
     ret = the_module.__dict__[method_name](**oldStyleDict)
-    sys.stderr.write (repr(ret))
+    verbose_trace ('returned %r', ret)
     return ret
 
     
-def handle_request (fd, req):
+class RequestMetrics:
+    """ What one request cost, in seconds, bytes and child processes. """
+    def __init__ (self):
+        self.decode = 0.0
+        self.provider = 0.0
+        self.encode = 0.0
+        self.size = 0
+        self.children = 0
+        self.status = None
+        self.start = None
+
+
+def count_children (func):
+    def counted (*args, **kwargs):
+        child_count[0] += 1
+        return func (*args, **kwargs)
+    return counted
+
+
+def enable_metrics ():
+    """ Reads the metrics settings from dsc.conf and, when enabled, opens
+        the rotating metrics log and starts counting child processes. The
+        count is process-wide, so with concurrent requests it is shared by
+        the requests that overlap."""
+    global metrics_log, profile_threshold
+    import logging
+    import logging.handlers
+    conf = helperlib.ReadDscConf ()
+    if conf.get ('PythonClientMetrics', '').lower () != 'true':
+        return
+    try:
+        if not os.path.isdir (os.path.dirname (MetricsFile)):
+            os.makedirs (os.path.dirname (MetricsFile))
+        handler = logging.handlers.RotatingFileHandler (MetricsFile,
+            maxBytes = MetricsMaxBytes, backupCount = 2)
+    except (IOError, OSError):
+        sys.stderr.write ('Unable to open ' + MetricsFile)
+        return
+    handler.setFormatter (logging.Formatter ('%(asctime)s %(message)s'))
+    metrics_log = logging.getLogger ('dsc_python_metrics')
+    metrics_log.propagate = False
+    metrics_log.setLevel (logging.INFO)
+    metrics_log.addHandler (handler)
+    if 'PythonClientProfileThreshold' in conf and cProfile is not None:
+        try:
+            profile_threshold = float (conf['PythonClientProfileThreshold'])
+        except ValueError:
+            sys.stderr.write ('Invalid PythonClientProfileThreshold')
+    subprocess.Popen.__init__ = count_children (subprocess.Popen.__init__)
+    os.system = count_children (os.system)
+    if sys.version < '3':
+        os.popen = count_children (os.popen)
+
+
+def record_metrics (req, metrics):
+    metrics_log.info ('%s.%s status=%s decode=%.6f provider=%.6f encode=%.6f '
+                      'bytes=%d children=%d' % (req[1], Operations[req[0]],
+                      metrics.status, metrics.decode, metrics.provider,
+                      metrics.encode, metrics.size, metrics.children))
+
+
+def profile_call (req, metrics):
+    """ Runs callMOF under cProfile and keeps the stats if the call took
+        longer than profile_threshold seconds."""
+    profiler = cProfile.Profile ()
+    r = profiler.runcall (callMOF, req)
+    if profile_threshold < time.time () - metrics.start:
+        path = ProfileDir + '/dsc_python_profile.' + req[1] + '.' + \
+            Operations[req[0]] + '.' + str (int (time.time ())) + '.prof'
+        try:
+            profiler.dump_stats (path)
+        except (IOError, OSError):
+            sys.stderr.write ('Unable to write ' + path)
+    return r
+
+
+def handle_request (fd, req, request_id = None, metrics = None):
     trace ('<handle_request>')
-    r = callMOF (req)
+    if metrics is None:
+        metrics = RequestMetrics ()
+    children = child_count[0]
+    metrics.start = time.time ()
+    if profile_threshold is not None:
+        r = profile_call (req, metrics)
+    else:
+        r = callMOF (req)
+    metrics.provider = time.time () - metrics.start
+    metrics.children = child_count[0] - children
+    if Operations[req[0]] == 'Set':
+        helperlib.StateChanged ()
     if len (r) < 2 :
         ret = None
         rval = r[0]
     else:
         rval = r[0]
         ret = r[1]
+    start = time.time ()
     if rval == 0:
-        write_success (fd, ret)
+        metrics.size = write_success (fd, ret, request_id)
     else:
-        write_failed (fd,1, 'Error occurred processing '+ repr (req))
+        metrics.size = write_failed (fd,1, 'Error occurred processing '+
+                                     repr (req), request_id)
+    metrics.encode = time.time () - start
+    metrics.status = rval
+    # providers buffer their log lines, write them once the response is out
+    log = sys.modules.get ('nxDSCLog')
+    if log is not None:
+        log.Flush ()
+    if metrics_log is not None:
+        record_metrics (req, metrics)
     trace ('</handle_request>')
 
 
+class LockedWriter:
+    """ Lets several threads write whole responses to one socket. """
+    def __init__ (self, fd):
+        self.fd = fd
+        self.lock = threading.Lock ()
+
+    def sendall (self, buf):
+        self.lock.acquire ()
+        try:
+            self.fd.sendall (buf)
+        finally:
+            self.lock.release ()
+
+
+class SharedLock:
+    """ Held by any number of threads in shared mode or by one thread in
+        exclusive mode.  Threads waiting for exclusive mode go first. """
+    def __init__ (self):
+        self.cond = threading.Condition (threading.Lock ())
+        self.shared = 0
+        self.exclusive = False
+        self.waiting = 0
+
+    def acquire (self, exclusive):
+        self.cond.acquire ()
+        try:
+            if exclusive:
+                self.waiting += 1
+                while self.exclusive or 0 < self.shared:
+                    self.cond.wait ()
+                self.waiting -= 1
+                self.exclusive = True
+            else:
+                while self.exclusive or 0 < self.waiting:
+                    self.cond.wait ()
+                self.shared += 1
+        finally:
+            self.cond.release ()
+
+    def release (self, exclusive):
+        self.cond.acquire ()
+        try:
+            if exclusive:
+                self.exclusive = False
+            else:
+                self.shared -= 1
+            self.cond.notifyAll ()
+        finally:
+            self.cond.release ()
+
+
+class RequestPool:
+    """ Serves tagged requests on a fixed set of worker threads. """
+    def __init__ (self, fd, workers):
+        self.fd = LockedWriter (fd)
+        self.requests = queue.Queue ()
+        self.limits = dict ()
+        self.limits_lock = threading.Lock ()
+        self.set_lock = SharedLock ()
+        self.threads = []
+        for i in range (workers):
+            t = threading.Thread (target = self.serve)
+            t.setDaemon (True)
+            t.start ()
+            self.threads.append (t)
+
+    def limit (self, name):
+        self.limits_lock.acquire ()
+        try:
+            if name not in self.limits:
+                count = PROVIDER_CONCURRENCY.get (name, len (self.threads))
+                self.limits[name] = threading.Semaphore (count)
+            return self.limits[name]
+        finally:
+            self.limits_lock.release ()
+
+    def submit (self, request_id, req, metrics):
+        self.requests.put ((request_id, req, metrics))
+
+    def serve (self):
+        while True:
+            item = self.requests.get ()
+            if item is None:
+                return
+            request_id, req, metrics = item
+            limit = self.limit (req[1])
+            exclusive = Operations[req[0]] == 'Set'
+            limit.acquire ()
+            self.set_lock.acquire (exclusive)
+            try:
+                try:
+                    handle_request (self.fd, req, request_id, metrics)
+                except socket.error:
+                    sys.stderr.write ('exception encountered')
+                except:
+                    sys.stderr.write ('\nException: ' +
+                                      repr (sys.exc_info ()) + '\n')
+                    traceback.print_tb (sys.exc_info ()[2])
+                    write_failed (self.fd, 1, 'Error occurred processing ' +
+                                  repr (req), request_id)
+            finally:
+                self.set_lock.release (exclusive)
+                limit.release ()
+
+    def close (self):
+        for t in self.threads:
+            self.requests.put (None)
+        for t in self.threads:
+            t.join ()
+
+
+def serve_concurrent (fd, reader, workers):
+    trace ('serving requests on %d threads', workers)
+    pool = RequestPool (fd, workers)
+    read = 1
+    while 0 < read:
+        try:
+            metrics = RequestMetrics ()
+            tagged = read_tagged_request (reader, metrics)
+            if tagged == None:
+                read = -1
+            else:
+                pool.submit (tagged[0], tagged[1], metrics)
+        except socket.error:
+            read = -1;
+            sys.stderr.write('exception encountered')
+    pool.close ()
+
+
 
 def main (argv):
     default_timeout_sec = 85
     socket.setdefaulttimeout(default_timeout_sec)
     fd = socket.fromfd (int (argv[1]), socket.AF_UNIX, socket.SOCK_STREAM)
+    reader = protocol.RecvBuffer (fd)
+    enable_metrics ()
+    if 2 < len (argv) and 0 < int (argv[2]):
+        serve_concurrent (fd, reader, int (argv[2]))
+        return
     read = 1
     out = ''
     while 0 < read:
         try:
-            req = read_request (fd)
+            metrics = RequestMetrics ()
+            req = read_request (reader, metrics)
             if req == None:
                 read = -1
             else:
-                trace ('Main: request len is '+str(len (req)))
-                handle_request (fd, req)
+                trace ('Main: request len is %d', len (req))
+                handle_request (fd, req, None, metrics)
         except socket.error:
             read = -1;
             sys.stderr.write('exception encountered')
@@ -151,7 +476,8 @@ def main (argv):
 ##############################
 try:
     try:
-        trace ('socket: '+str(sys.argv[1]))
+        enable_trace ()
+        trace ('socket: %s', sys.argv[1])
         
         pid_path=VarDir+'/run/python/'+repr(os.getuid())
         
@@ -165,7 +491,7 @@ try:
             F.close()
         except:
              sys.stderr.write('Unable to create '+pid_file)
-        trace ('using python version '+ sys.version) 
+        trace ('using python version %s', sys.version)
         sys.path.insert(0,'') # put the cwd in the path so we can find our module
         if sys.version < '2.6':
             trace (ScriptsDir + '/2.4x-2.5x')
@@ -176,8 +502,8 @@ try:
         else:
             trace (ScriptsDir + '/3.x')
             os.chdir (ScriptsDir + '/3.x')
-        from Scripts import *
-        
+        trace ('started in %.3fs', time.time () - StartTime)
+
         if __name__ == '__main__':
             main (sys.argv)
     
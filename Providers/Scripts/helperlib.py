@@ -8,3 +8,48 @@ OMI_LIB_SCRIPTS="<OMI_LIB_SCRIPTS>"
 PYTHON_PID_DIR="<PYTHON_PID_DIR>"
 DSC_NAMESPACE="<DSC_NAMESPACE>"
 DSC_SCRIPT_PATH="<DSC_SCRIPT_PATH>"
+
+# helperlib is loaded with imp.load_source by every provider; keep the
+# settings that were already read.
+try:
+    DscConf
+except NameError:
+    DscConf = None
+
+# client.py counts the Set requests it has served.  Providers that keep a
+# snapshot of system state (services, installed packages) take it again
+# once a Set has run, since that may have changed what they saw.
+try:
+    StateGeneration
+except NameError:
+    StateGeneration = 0
+
+def StateChanged():
+    """
+    Marks snapshots of system state taken so far as stale.
+    """
+    global StateGeneration
+    StateGeneration += 1
+
+def ReadDscConf():
+    """
+    Returns the name=value settings of dsc.conf as a dict.  The file is
+    only read once per process.
+    """
+    global DscConf
+    if DscConf is None:
+        DscConf = {}
+        try:
+            F = open(CONFIG_SYSCONFDIR + '/' + CONFIG_SYSCONFDIR_DSC + '/dsc.conf')
+            try:
+                for line in F.readlines():
+                    line = line.strip()
+                    if line.startswith('#') or '=' not in line:
+                        continue
+                    name, value = line.split('=', 1)
+                    DscConf[name.strip()] = value.strip()
+            finally:
+                F.close()
+        except (IOError, OSError):
+            pass
+    return DscConf
@@ -6,13 +6,33 @@
 import os
 import sys
 import time
-import inspect
+import atexit
 import codecs
+import threading
 import imp
 helperlib = imp.load_source('helperlib', '../helperlib.py')
 
 VarDir = "<PYTHON_PID_DIR>"
 
+# Lines are written when this many characters are buffered, when a
+# WARNING or worse is logged, when the oldest buffered line is older than
+# LogFlushInterval seconds, after every request served by client.py and
+# at exit.
+LogBufferSize = 65536
+LogFlushInterval = 1.0
+
+# dsc.conf settings, see base_dsc.conf.
+DefaultLogLevel = 'VERBOSE'
+DefaultLogMaxBytes = 52428800
+
+# Providers are loaded with imp.load_source, which runs this file again;
+# keep the logger that is already open.
+try:
+    Logger
+except NameError:
+    Logger = None
+
+
 def Print(s, file=sys.stderr):
     file.write(s + '\n')
 
@@ -27,57 +47,154 @@ def opened_w_error(filename, mode="r"):
         return None, Exception('IOError')
     return f, None
 
+
+def Flush():
+    """
+    Writes out whatever the process-wide logger has buffered.
+    """
+    if Logger is not None:
+        Logger.Flush()
+
 # YYYY/MM/DD HH:MM:SS: LEVEL: FILE(LINE): \n message \n
 
 
 class DSCLog(object):
+    """
+    Every DSCLog() is the same process-wide logger, so LG().Log() only
+    costs a buffered append.  Messages above the level set by DSCLogLevel
+    in dsc.conf are dropped before anything is formatted.
+    """
+
+    def __new__(cls):
+        global Logger
+        if Logger is None:
+            Logger = object.__new__(cls)
+            Logger.Open()
+        return Logger
 
     def __init__(self):
+        pass
+
+    def Open(self):
         self.levels = ((0, 'FATAL'), (1, 'ERROR'), (2, 'WARNING'), (3, 'INFO'),
                        (4, 'DEBUG'), (5, 'VERBOSE'))
+        self.level_numbers = {}
+        for num, strng in self.levels:
+            self.level_numbers[strng] = num
+        conf = helperlib.ReadDscConf()
         self.current_level = self.GetCurrentLogLevel()
+        self.max_bytes = DefaultLogMaxBytes
+        try:
+            self.max_bytes = int(conf.get('DSCLogMaxBytes', self.max_bytes))
+        except ValueError:
+            Print("Invalid DSCLogMaxBytes " + conf['DSCLogMaxBytes'])
         LogFile = VarDir + "/log/dsc.log"
         if helperlib.CONFIG_SYSCONFDIR_DSC == "omsconfig":
             LogFile = "/var/opt/microsoft/omsconfig/omsconfig.log"
         else:
             os.system('mkdir -p ' + VarDir + '/log')
         self.file_path = LogFile
+        self.F = None
+        self.inode = None
+        self.lines = []
+        self.buffered = 0
+        self.first_time = 0
+        self.lock = threading.Lock()
+        atexit.register(self.Flush)
 
     def Log(self, log_level, message):
-        last_frame = inspect.currentframe().f_back
-        place = last_frame.f_globals['__file__'] + \
-            '('+str(last_frame.f_lineno)+')'
-        if message is None or len(message) is 0:
+        if message is None or len(message) == 0:
             return
         if log_level is None:
             log_level = self.current_level
         if type(log_level) == str:
-            t = log_level
-            log_level = 5
-            for num, strng in self.levels:
-                if t == strng:
-                    log_level = num
-        if log_level < 0 or log_level > 5 or len(message) < 1:
+            log_level = self.level_numbers.get(log_level, 5)
+        if log_level < 0 or log_level > 5:
             return
         if log_level > self.current_level:
             return
-        t = time.localtime()
+        last_frame = sys._getframe(1)
+        place = last_frame.f_globals['__file__'] + \
+            '('+str(last_frame.f_lineno)+')'
+        now = time.time()
+        t = time.localtime(now)
         line = "%04u/%02u/%02u %02u:%02u:%02u: %s: %s:\n%s\n" % (t.tm_year,
             t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec,
             self.levels[log_level][1], place, message)
-        error = None
+        self.lock.acquire()
         try:
-            F, error = opened_w_error(self.file_path, 'a')
-            if error:
-                Print("Exception opening logfile " + self.file_path +
-                      " Error: " + str(error), file=sys.stderr)
-            else:
-                F.write(line)
-                F.close()
+            if not self.lines:
+                self.first_time = now
+            self.lines.append(line)
+            self.buffered += len(line)
+            if log_level <= 2 or self.buffered >= LogBufferSize or \
+                    now - self.first_time >= LogFlushInterval:
+                self.WriteLines()
+        finally:
+            self.lock.release()
+
+    def Flush(self):
+        self.lock.acquire()
+        try:
+            if self.lines:
+                self.WriteLines()
+        finally:
+            self.lock.release()
+
+    def WriteLines(self):
+        """
+        Writes the buffered lines.  Called with the lock held.
+        """
+        lines = self.lines
+        self.lines = []
+        self.buffered = 0
+        try:
+            self.Reopen()
+            self.F.write(''.join(lines))
+            self.F.flush()
         except:
-            F.close()
-            Print("Exception opening logfile " + self.file_path +
-                  " Error: " + str(error), file=sys.stderr)
+            self.Close()
+            Print("Exception writing logfile " + self.file_path +
+                  " Error: " + str(sys.exc_info()[1]), file=sys.stderr)
+
+    def Reopen(self):
+        """
+        Opens the log file unless the open handle still refers to it.  It
+        is moved aside once it reaches DSCLogMaxBytes and logrotate may
+        have moved it as well.
+        """
+        try:
+            st = os.stat(self.file_path)
+        except OSError:
+            st = None
+        if st is not None and 0 < self.max_bytes <= st.st_size:
+            self.Close()
+            os.rename(self.file_path, self.file_path + '.1')
+            st = None
+        if self.F is not None and st is not None and \
+                st.st_ino == self.inode:
+            return
+        self.Close()
+        F, error = opened_w_error(self.file_path, 'a')
+        if error:
+            raise error
+        self.F = F
+        self.inode = os.fstat(F.fileno()).st_ino
+
+    def Close(self):
+        if self.F is not None:
+            try:
+                self.F.close()
+            except:
+                pass
+            self.F = None
 
     def GetCurrentLogLevel(self):
-        return 5
+        level = helperlib.ReadDscConf().get('DSCLogLevel', DefaultLogLevel)
+        if level.upper() in self.level_numbers:
+            return self.level_numbers[level.upper()]
+        try:
+            return min(max(int(level), 0), 5)
+        except ValueError:
+            Print("Invalid DSCLogLevel " + level)
+            return 5
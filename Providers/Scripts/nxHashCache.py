@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# ============================================================================
+#  Copyright (C) Microsoft Corporation, All rights reserved.
+# ============================================================================
+
+# Content hashes of files, kept on disk between runs so that nxFile and
+# nxFileInventory only read files that changed.  An entry is found by the
+# algorithm and the file's device, inode, size, mtime and ctime; any
+# change to the file changes its ctime, so a stale entry is never found.
+#
+# The cache file has one line per entry:
+#   algorithm dev ino size mtime_ns ctime_ns last_used digest
+# and keeps the HashCacheMaxEntries (dsc.conf) most recently used ones.
+
+import os
+import sys
+import threading
+import time
+import imp
+helperlib = imp.load_source('helperlib', '../helperlib.py')
+
+CacheFile = '/var/opt/microsoft/dsc/cache/checksums'
+if helperlib.CONFIG_SYSCONFDIR_DSC == "omsconfig":
+    CacheFile = '/var/opt/microsoft/omsconfig/cache/checksums'
+DefaultMaxEntries = 100000
+
+# A file changed again within the timestamp granularity of its file
+# system would keep its mtime and ctime, so files changed this recently
+# are not cached.
+RacyInterval = 2
+
+# Providers are loaded with imp.load_source, which runs this file again;
+# keep the cache that is already loaded.
+try:
+    Cache
+except NameError:
+    Cache = None
+
+
+def StatKey(algorithm, st):
+    if hasattr(st, 'st_mtime_ns'):
+        return (algorithm, st.st_dev, st.st_ino, st.st_size,
+                st.st_mtime_ns, st.st_ctime_ns)
+    return (algorithm, st.st_dev, st.st_ino, st.st_size,
+            int(st.st_mtime * 1000000000), int(st.st_ctime * 1000000000))
+
+
+class HashCache(object):
+
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self.entries = {}
+        self.clock = 0
+        self.dirty = False
+        self.lock = threading.Lock()
+        self.Load()
+
+    def Load(self):
+        try:
+            F = open(self.path, 'r')
+        except (IOError, OSError):
+            return
+        try:
+            for line in F:
+                fields = line.split()
+                if len(fields) != 8:
+                    continue
+                try:
+                    key = (fields[0], int(fields[1]), int(fields[2]),
+                           int(fields[3]), int(fields[4]), int(fields[5]))
+                    used = int(fields[6])
+                except ValueError:
+                    continue
+                self.entries[key] = [fields[7], used]
+                if used > self.clock:
+                    self.clock = used
+        finally:
+            F.close()
+
+    def Lookup(self, algorithm, st):
+        """
+        Return the cached hex digest of the file st was taken from, or None.
+        """
+        entry = self.entries.get(StatKey(algorithm, st))
+        if entry is None:
+            return None
+        self.clock += 1
+        entry[1] = self.clock
+        return entry[0]
+
+    def Store(self, algorithm, st, digest):
+        if self.max_entries <= 0:
+            return
+        now = time.time()
+        if now - st.st_mtime < RacyInterval or now - st.st_ctime < RacyInterval:
+            return
+        self.clock += 1
+        self.entries[StatKey(algorithm, st)] = [digest, self.clock]
+        self.dirty = True
+
+    def Save(self):
+        """
+        Write the cache if entries were added, dropping the least recently
+        used ones above max_entries.
+        """
+        self.lock.acquire()
+        try:
+            if self.dirty:
+                self.Write()
+        finally:
+            self.lock.release()
+
+    def Write(self):
+        self.dirty = False
+        items = list(self.entries.items())
+        if len(items) > self.max_entries:
+            items = [(entry[1], key, entry) for key, entry in items]
+            items.sort()
+            items = [(key, entry) for used, key, entry in items[-self.max_entries:]]
+            self.entries = dict(items)
+        lines = []
+        for key, entry in items:
+            lines.append('%s %d %d %d %d %d %d %s\n' % (key + (entry[1], entry[0])))
+        tmp_path = self.path + '.tmp'
+        try:
+            if not os.path.isdir(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+            F = open(tmp_path, 'w')
+            try:
+                F.write(''.join(lines))
+            finally:
+                F.close()
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError):
+            sys.stderr.write('Unable to write ' + self.path + ': ' +
+                             str(sys.exc_info()[1]) + '\n')
+
+
+def GetCache():
+    global Cache
+    if Cache is None:
+        max_entries = DefaultMaxEntries
+        conf = helperlib.ReadDscConf()
+        try:
+            max_entries = int(conf.get('HashCacheMaxEntries', max_entries))
+        except ValueError:
+            sys.stderr.write('Invalid HashCacheMaxEntries\n')
+        Cache = HashCache(CacheFile, max_entries)
+    return Cache
+
+
+def Lookup(algorithm, st):
+    return GetCache().Lookup(algorithm, st)
+
+
+def Store(algorithm, st, digest):
+    GetCache().Store(algorithm, st, digest)
+
+
+def Save():
+    if Cache is not None:
+        Cache.Save()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# ============================================================================
+#  Copyright (C) Microsoft Corporation, All rights reserved.
+# ============================================================================
+
+# Users and groups for the providers, looked up once instead of for every
+# file.  getpwuid, getpwnam, getgrgid and getgrnam behave like the pwd and
+# grp functions of the same name.  Their results, including names and ids
+# that were not found, are kept until /etc/passwd or /etc/group is
+# replaced or modified, and for at most LookupSeconds so that users and
+# groups served by NSS (LDAP, SSSD) are picked up as well.
+#
+# ReadEntries parses a passwd style file into {name: [fields]} and keeps
+# the result until the file changes.  The entries are shared, callers
+# must not modify them.
+
+import os
+import sys
+import time
+import codecs
+import pwd
+import grp
+
+LookupSeconds = 60
+
+# Providers are loaded with imp.load_source, which runs this file again;
+# keep what was already looked up.
+try:
+    Lookups
+except NameError:
+    Lookups = {}
+    Files = {}
+
+
+def FileKey(filename):
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime, st.st_ctime)
+
+
+class LookupCache(object):
+    """
+    Results of one lookup function, dropped when filename changes.
+    """
+
+    def __init__(self, func, filename):
+        self.func = func
+        self.filename = filename
+        self.results = {}
+        self.key = FileKey(filename)
+        self.started = time.time()
+
+    def Get(self, arg):
+        # A user added by nxUser must be found by the next nxFile, so the
+        # file is checked on every lookup; a stat is still much cheaper
+        # than the lookup itself.
+        now = time.time()
+        key = FileKey(self.filename)
+        if key != self.key or now - self.started >= LookupSeconds:
+            self.results = {}
+            self.key = key
+            self.started = now
+        if arg not in self.results:
+            try:
+                self.results[arg] = self.func(arg)
+            except KeyError:
+                self.results[arg] = None
+        result = self.results[arg]
+        if result is None:
+            raise KeyError(arg)
+        return result
+
+
+def Lookup(func, filename, arg):
+    cache = Lookups.get(func)
+    if cache is None:
+        cache = Lookups[func] = LookupCache(func, filename)
+    return cache.Get(arg)
+
+
+def getpwuid(uid):
+    return Lookup(pwd.getpwuid, '/etc/passwd', uid)
+
+
+def getpwnam(name):
+    return Lookup(pwd.getpwnam, '/etc/passwd', name)
+
+
+def getgrgid(gid):
+    return Lookup(grp.getgrgid, '/etc/group', gid)
+
+
+def getgrnam(name):
+    return Lookup(grp.getgrnam, '/etc/group', name)
+
+
+def UserName(uid):
+    """
+    The name of user uid, or uid as a string if it has none.
+    """
+    try:
+        return getpwuid(uid).pw_name
+    except KeyError:
+        return str(uid)
+
+
+def GroupName(gid):
+    """
+    The name of group gid, or gid as a string if it has none.
+    """
+    try:
+        return getgrgid(gid).gr_name
+    except KeyError:
+        return str(gid)
+
+
+def ReadEntries(filename):
+    """
+    Return ({name: [fields after the name]}, None) for a file of
+    colon separated lines, or (None, error) if it can't be read.
+    """
+    key = FileKey(filename)
+    if key is not None and filename in Files and Files[filename][0] == key:
+        return Files[filename][1], None
+    try:
+        if sys.version > '2.9':
+            F = codecs.open(filename, 'r', 'utf8')
+        else:
+            F = open(filename, 'r')
+        try:
+            lines = F.read().split('\n')
+        finally:
+            F.close()
+    except IOError:
+        return None, sys.exc_info()[1]
+    entries = {}
+    for line in lines:
+        tokens = line.split(':')
+        if len(tokens) > 1:
+            entries[tokens[0]] = tokens[1:]
+    if key is not None:
+        Files[filename] = (key, entries)
+    return entries, None
+
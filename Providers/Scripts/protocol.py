@@ -1,3 +1,5 @@
+import array
+import codecs
 import ctypes
 import struct
 import sys
@@ -75,30 +77,97 @@ MI_TYPE_NAMES={
 64:'MI_NULL_FLAG',
 }
 
-DO_TRACE = True
-DO_VERBOSE_TRACE = False
-
-
-def trace(text):
-    if DO_TRACE:
-        sys.stdout.write(repr(text) + '\n')
-
-
-def verbose_trace(text):
-    if DO_VERBOSE_TRACE:
-        trace(text)
+TRACE_OFF = 0
+TRACE_INFO = 1
+TRACE_VERBOSE = 2
+
+# The providers load this module again with imp.load_source, which runs
+# it in the module object that already exists; keep the level the client
+# has set in that case.
+try:
+    TRACE_LEVEL
+except NameError:
+    TRACE_LEVEL = TRACE_OFF
+
+RECV_BUFFER_SIZE = 65536
+
+if sys.version > '2.9':
+    EMPTY_BYTES = bytes()
+else:
+    EMPTY_BYTES = ''
+
+# recv_into() a bytearray through a memoryview needs python 2.7
+try:
+    memoryview
+    HAVE_MEMORYVIEW = True
+except NameError:
+    HAVE_MEMORYVIEW = False
+
+
+def set_trace_level(level):
+    global TRACE_LEVEL
+    TRACE_LEVEL = level
+
+
+def write_trace(text, args):
+    if args:
+        text = text % args
+    sys.stdout.write(text + '\n')
+
+
+def trace(text, *args):
+    """
+    Writes text % args to stdout at TRACE_INFO.  Pass the values to format
+    as args so that nothing is formatted while tracing is off.
+    """
+    if TRACE_INFO <= TRACE_LEVEL:
+        write_trace(text, args)
+
+
+def verbose_trace(text, *args):
+    if TRACE_VERBOSE <= TRACE_LEVEL:
+        write_trace(text, args)
+
+
+def recv_exact(fd, n):
+    """
+    Reads n bytes from fd.  A socket may return fewer bytes than asked
+    for, so keep reading until n bytes arrived or the peer closed.
+    """
+    buf = fd.recv(n)
+    if len(buf) == n or 0 == len(buf):
+        return buf
+    chunks = [buf]
+    got = len(buf)
+    while got < n:
+        buf = fd.recv(n - got)
+        if 0 == len(buf):
+            break
+        chunks.append(buf)
+        got += len(buf)
+    return EMPTY_BYTES.join(chunks)
+
+
+def recv_view(fd, n):
+    """
+    Like recv_exact, but lets a RecvBuffer return a view of its buffer
+    rather than a copy.  The view is only valid until the next read.
+    """
+    if hasattr(fd, 'recv_view'):
+        return fd.recv_view(n)
+    return recv_exact(fd, n)
 
 
 def read_string(fd):
     verbose_trace('<read_string>')
-    buf = fd.recv(4)
+    buf = recv_exact(fd, 4)
     strl = struct.unpack('@i', buf)[0]
-    verbose_trace('  len: ' + str(strl))
+    verbose_trace('  len: %s', strl)
     text = ''
     if 0 < strl:
-        buf = fd.recv(strl)
-        text = buf.decode('utf8')
-    verbose_trace('  str: "' + text + '"')
+        buf = recv_view(fd, strl)
+        text = codecs.utf_8_decode(buf, 'strict', True)[0]
+    verbose_trace('  str: "%s"', text)
     verbose_trace('</read_string>')
     return text
 
@@ -110,7 +179,7 @@ def read_arg_name(fd):
         arg_name = name.encode('ascii', 'ignore')
     else:
         arg_name = name
-    verbose_trace('  arg_name: "' + arg_name + '"')
+    verbose_trace('  arg_name: "%s"', arg_name)
     verbose_trace('</read_argname>')
     return arg_name
 
@@ -118,9 +187,9 @@ def read_arg_name(fd):
 def read_values(fd):
     verbose_trace('<read_values>')
     arg_dict = dict()
-    buf = fd.recv(4)
+    buf = recv_exact(fd, 4)
     argc = struct.unpack('@i', buf)[0]
-    verbose_trace('  argc: ' + str(argc))
+    verbose_trace('  argc: %s', argc)
     for _ in range(argc):
         arg_name = read_arg_name(fd)
         arg_val = MI_Value.read(fd)
@@ -131,42 +200,82 @@ def read_values(fd):
 
 def write_string(fd, st):
     verbose_trace('<write_string>')
-    verbose_trace('  st: "' + st + '"')
-    verbose_trace(st)
+    verbose_trace('  st: "%s"', st)
     buf = struct.pack('@i', len(st))
     if not isinstance(buf, str):
         buf += bytes(st, 'utf8')
     else:
         buf += st
-    fd.send(buf)
+    fd.sendall(buf)
     verbose_trace('</write_string>')
 
 
+def to_array(type_code, vals):
+    """
+    Returns vals (plain numbers or ctypes objects) as an array.array of
+    type_code, or as a list of numbers when the interpreter's array module
+    does not support type_code ('q' and 'Q' need python 3.3).
+    """
+    if isinstance(vals, array.array) and vals.typecode == type_code:
+        return vals
+    items = []
+    if vals is not None:
+        for val in vals:
+            if hasattr(val, 'value'):
+                val = val.value
+            items.append(val)
+    try:
+        return array.array(type_code, items)
+    except ValueError:
+        return items
+
+
+def pack_array(type_code, vals):
+    if isinstance(vals, array.array):
+        if hasattr(vals, 'tobytes'):
+            return vals.tobytes()
+        return vals.tostring()
+    return struct.pack('@%d%s' % (len(vals), type_code), *vals)
+
+
+def unpack_array(type_code, buf):
+    try:
+        vals = array.array(type_code)
+    except ValueError:
+        length = len(buf) // struct.calcsize('@' + type_code)
+        return list(struct.unpack('@%d%s' % (length, type_code), buf))
+    if hasattr(vals, 'frombytes'):
+        vals.frombytes(buf)
+    else:
+        vals.fromstring(buf)
+    return vals
+
+
 def write_values(fd, d):
-    trace('<write_values>')
+    verbose_trace('<write_values>')
     buf = struct.pack('@i', len(d))
-    fd.send(buf)
-    verbose_trace('  len: ' + str(len(d)))
+    fd.sendall(buf)
+    verbose_trace('  len: %s', len(d))
     if sys.version > '2.9':
         for key, value in d.items():
-            verbose_trace('  key: ' + key)
+            verbose_trace('  key: %s', key)
             if not hasattr(value, 'value'):
                 sys.stderr.write('\n  key: ' + key + ' is not mi_value\n')
-            verbose_trace('  value: ' + str(value.value))
+            verbose_trace('  value: %s', value.value)
             if value.value is not None:
                 write_string(fd, key)
                 value.write(fd)
     else:
         for key, value in d.iteritems():
-            trace('  key: ' + key)
-            verbose_trace('  value: ' + repr(value.value))
+            verbose_trace('  key: %s', key)
+            verbose_trace('  value: %r', value.value)
             if value is not None:
                 verbose_trace('  writing value')
                 write_string(fd, key)
                 value.write(fd)
             else:
                 verbose_trace('  not writing value')
-    trace('</write_values>')
+    verbose_trace('</write_values>')
 
 
 class file_desc:
@@ -174,11 +283,125 @@ class file_desc:
         pass
 
 
-class MI_Value:
-    value = None
+class WriteBuffer:
+    """
+    Collects everything written to it so that a complete response can be
+    handed to the socket with a single sendall() by flush().
+    """
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def sendall(self, buf):
+        self.chunks.append(buf)
+        self.size += len(buf)
+
+    send = sendall
+
+    def getvalue(self):
+        return EMPTY_BYTES.join(self.chunks)
+
+    def flush(self, fd):
+        size = self.size
+        if 0 < size:
+            fd.sendall(self.getvalue())
+        self.chunks = []
+        self.size = 0
+        return size
+
+
+class StringRecvBuffer:
+    """
+    Reads from the socket in large blocks and hands the data out in the
+    small pieces the decoder asks for.  recv(n) only returns less than n
+    bytes when the peer has closed the connection.  Used where memoryview
+    is not available.
+    """
+    def __init__(self, fd, size=RECV_BUFFER_SIZE):
+        self.fd = fd
+        self.size = size
+        self.buf = EMPTY_BYTES
+        self.pos = 0
+
+    def recv(self, n):
+        while len(self.buf) - self.pos < n:
+            data = self.fd.recv(max(self.size, n - len(self.buf) + self.pos))
+            if not data:
+                break
+            self.buf = self.buf[self.pos:] + data
+            self.pos = 0
+        data = self.buf[self.pos:self.pos + n]
+        self.pos += len(data)
+        return data
+
+    recv_view = recv
+
+
+class RecvBuffer:
+    """
+    Receives into a preallocated bytearray with recv_into() and hands out
+    slices of it.  The buffer grows to fit a value larger than itself, so
+    a big string argument arrives in a few recv_into() calls straight into
+    its final place.  recv(n) and recv_view(n) only return less than n
+    bytes when the peer has closed the connection.
+    """
+    def __init__(self, fd, size=RECV_BUFFER_SIZE):
+        self.fd = fd
+        self.size = size
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.start = 0
+        self.end = 0
+
+    def fill(self, n):
+        avail = self.end - self.start
+        if n <= avail:
+            return
+        if 0 == avail:
+            self.start = 0
+            self.end = 0
+            if self.size < len(self.buf) and n <= self.size:
+                # drop the space a previous large value needed
+                self.buf = bytearray(self.size)
+                self.view = memoryview(self.buf)
+        if len(self.buf) < self.start + n:
+            if len(self.buf) < n:
+                buf = bytearray(max(n, 2 * len(self.buf)))
+            else:
+                buf = self.buf
+            buf[0:avail] = self.buf[self.start:self.end]
+            if buf is not self.buf:
+                self.buf = buf
+                self.view = memoryview(self.buf)
+            self.start = 0
+            self.end = avail
+        while self.end - self.start < n:
+            got = self.fd.recv_into(self.view[self.end:])
+            if 0 == got:
+                break
+            self.end += got
+
+    def recv_view(self, n):
+        self.fill(n)
+        n = min(n, self.end - self.start)
+        view = self.view[self.start:self.start + n]
+        self.start += n
+        return view
+
+    def recv(self, n):
+        return self.recv_view(n).tobytes()
+
+
+if not HAVE_MEMORYVIEW:
+    RecvBuffer = StringRecvBuffer
+
+
+class MI_Value(object):
+    __slots__ = ('type', 'value')
 
     def __init__(self, type):
         self.type = type
+        self.value = None
 
     def __repr__(self):
         return MI_TYPE_NAMES[self.type]+': '+repr(self.value)
@@ -201,7 +424,7 @@ class MI_Value:
             return True
 
     def __ne__(self, other):
-        if self.__eq__(self,other):
+        if self.__eq__(other):
             return False
         return True
 
@@ -210,7 +433,7 @@ class MI_Value:
         val = self.type
         if self.value is None:
             val = val | MI_NULL_FLAG
-        verbose_trace('    type: ' + str(self.type) + ' ' + repr(self.value))
+        verbose_trace('    type: %s %r', self.type, self.value)
         buf = struct.pack('@B', val)
         fd.sendall(buf)
         verbose_trace('  </MI_Value::write>')
@@ -218,78 +441,22 @@ class MI_Value:
     @staticmethod
     def read(fd):
         verbose_trace('<MI_Value::read>')
-        buf = fd.recv(1)
+        buf = recv_exact(fd, 1)
         type = struct.unpack('@B', buf)[0]
         switch = type & ~(MI_NULL_FLAG)
-        verbose_trace('  type: ' + str(switch))
+        verbose_trace('  type: %s', switch)
         val = None
-        if MI_BOOLEAN == switch:
-            val = MI_Boolean.read(fd, type)
-        elif MI_UINT8 == switch:
-            val = MI_Uint8.read(fd, type)
-        elif MI_SINT8 == switch:
-            val = MI_Sint8.read(fd, type)
-        elif MI_UINT16 == switch:
-            val = MI_Uint16.read(fd, type)
-        elif MI_SINT16 == switch:
-            val = MI_Sint16.read(fd, type)
-        elif MI_UINT32 == switch:
-            val = MI_Uint32.read(fd, type)
-        elif MI_SINT32 == switch:
-            val = MI_Sint32.read(fd, type)
-        elif MI_UINT64 == switch:
-            val = MI_Uint64.read(fd, type)
-        elif MI_SINT64 == switch:
-            val = MI_Sint64.read(fd, type)
-        elif MI_REAL32 == switch:
-            val = MI_Real32.read(fd, type)
-        elif MI_REAL64 == switch:
-            val = MI_Real64.read(fd, type)
-        elif MI_CHAR16 == switch:
-            val = MI_Char16.read(fd, type)
-        elif MI_DATETIME == switch:
-            val = MI_Datetime.read(fd, type)
-        elif MI_STRING == switch:
-            val = MI_String.read(fd, type)
-        elif MI_INSTANCE == switch:
-            val = MI_Instance.read(fd, type)
-        elif MI_BOOLEANA == switch:
-            val = MI_BooleanA.read(fd, type)
-        elif MI_UINT8A == switch:
-            val = MI_Uint8A.read(fd, type)
-        elif MI_SINT8A == switch:
-            val = MI_Sint8A.read(fd, type)
-        elif MI_UINT16A == switch:
-            val = MI_Uint16A.read(fd, type)
-        elif MI_SINT16A == switch:
-            val = MI_Sint16A.read(fd, type)
-        elif MI_UINT32A == switch:
-            val = MI_Uint32A.read(fd, type)
-        elif MI_SINT32A == switch:
-            val = MI_Sint32A.read(fd, type)
-        elif MI_UINT64A == switch:
-            val = MI_Uint64A.read(fd, type)
-        elif MI_SINT64A == switch:
-            val = MI_Sint64A.read(fd, type)
-        elif MI_REAL32A == switch:
-            val = MI_Real32A.read(fd, type)
-        elif MI_REAL64A == switch:
-            val = MI_Real64A.read(fd, type)
-        elif MI_CHAR16A == switch:
-            val = MI_Char16A.read(fd, type)
-        elif MI_DATETIMEA == switch:
-            val = MI_DatetimeA.read(fd, type)
-        elif MI_STRINGA == switch:
-            val = MI_StringA.read(fd, type)
-        elif MI_INSTANCEA == switch:
-            val = MI_InstanceA.read(fd, type)
+        if switch in MI_VALUE_CLASSES:
+            val = MI_VALUE_CLASSES[switch].read(fd, type)
         else:
-            trace('Received unexpected type: ' + str(type))
+            trace('Received unexpected type: %s', type)
         verbose_trace('</MI_Value::read>')
         return val
 
 
 class MI_Boolean(MI_Value):
+    __slots__ = ()
+
     def __init__(self, val):
         MI_Value.__init__(self, MI_BOOLEAN)
         if val is not None:
@@ -303,7 +470,7 @@ class MI_Boolean(MI_Value):
         verbose_trace('<MI_Boolean.write>')
         MI_Value.write(self, fd)
         if self.value is not None:
-            verbose_trace('  value: ' + str(self.value.value))
+            verbose_trace('  value: %s', self.value.value)
             if self.value.value:
                 tmp = 1
             else:
@@ -317,20 +484,22 @@ class MI_Boolean(MI_Value):
         verbose_trace('<MI_Boolean.read>')
         val = None
         if 0 == (MI_NULL_FLAG & flags):
-            buf = fd.recv(1)
+            buf = recv_exact(fd, 1)
             val = struct.unpack('@B', buf)[0]
-            verbose_trace('val is ' + str(int(val)) + '\n')
+            verbose_trace('val is %d', val)
             if val:
                 tmp = 'True'
             else:
                 tmp = 'False'
-            verbose_trace('  value: ' + tmp)
+            verbose_trace('  value: %s', tmp)
         rval = MI_Boolean(val)
         verbose_trace('</MI_Boolean.read>')
         return rval
 
 
 class MI_Uint8(MI_Value):
+    __slots__ = ()
+
     def __init__(self, val):
         MI_Value.__init__(self, MI_UINT8)
         if val is not None:
@@ -340,7 +509,7 @@ class MI_Uint8(MI_Value):
         verbose_trace('<MI_Uint8.write>')
         MI_Value.write(self, fd)
         if self.value is not None:
-            verbose_trace('  value: ' + str(self.value.value))
+            verbose_trace('  value: %s', self.value.value)
             buf = struct.pack('@B', self.value.value)
             fd.sendall(buf)
         verbose_trace('</MI_Uint8.write>')
@@ -350,7 +519,7 @@ class MI_Uint8(MI_Value):
         verbose_trace('<MI_Uint8.read>')
         val = None
         if 0 == (MI_NULL_FLAG & flags):
-            buf = fd.recv(1)
+            buf = recv_exact(fd, 1)
             val = struct.unpack('@B', buf)[0]
         rval = MI_Uint8(val)
         verbose_trace('</MI_Uint8.read>')
@@ -358,6 +527,8 @@ class MI_Uint8(MI_Value):
 
 
 class MI_Sint8(MI_Value):
+    __slots__ = ()
+
     def __init__(self, val):
         MI_Value.__init__(self, MI_SINT8)
         if val is not None:
@@ -367,7 +538,7 @@ class MI_Sint8(MI_Value):
         verbose_trace('<MI_Sint8.write>')
         MI_Value.write(self, fd)
         if self.value is not None:
-            verbose_trace('  value: ' + str(self.value.value))
+            verbose_trace('  value: %s', self.value.value)
             buf = struct.pack('@b', self.value.value)
             fd.sendall(buf)
         verbose_trace('</MI_Sint8.write>')
@@ -377,7 +548,7 @@ class MI_Sint8(MI_Value):
         verbose_trace('<MI_Sint8.read>')
         val = None
         if 0 == (MI_NULL_FLAG & flags):
-            buf = fd.recv(1)
+            buf = recv_exact(fd, 1)
             val = struct.unpack('@b', buf)[0]
         rval = MI_Sint8(val)
         verbose_trace('</MI_Sint8.read>')
@@ -385,6 +556,8 @@ class MI_Sint8(MI_Value):
 
 
 class MI_Uint16(MI_Value):
+    __slots__ = ()
+
     def __init__(self, val):
         MI_Value.__init__(self, MI_UINT16)
         if val is not None:
@@ -394,7 +567,7 @@ class MI_Uint16(MI_Value):
         verbose_trace('<MI_Uint16.write>')
         MI_Value.write(self, fd)
         if self.value is not None:
-            verbose_trace('  value: ' + str(self.value.value))
+            verbose_trace('  value: %s', self.value.value)
             buf = struct.pack('@H', self.value.value)
             fd.sendall(buf)
         verbose_trace('</MI_Uint16.write>')
@@ -404,7 +577,7 @@ class MI_Uint16(MI_Value):
         verbose_trace('<MI_Uint16.read>')
         val = None
         if 0 == (MI_NULL_FLAG & flags):
-            buf = fd.recv(2)
+            buf = recv_exact(fd, 2)
             val = struct.unpack('@H', buf)[0]
         rval = MI_Uint16(val)
         verbose_trace('</MI_Uint16.read>')
@@ -412,6 +585,8 @@ class MI_Uint16(MI_Value):
 
 
 class MI_Sint16(MI_Value):
+    __slots__ = ()
+
     def __init__(self, val):
         MI_Value.__init__(self, MI_SINT16)
         if val is not None:
@@ -421,7 +596,7 @@ class MI_Sint16(MI_Value):
         verbose_trace('<MI_Sint16.write>')
         MI_Value.write(self, fd)
         if self.value is not None:
-            verbose_trace('  value: ' + str(self.value.value))
+            verbose_trace('  value: %s', self.value.value)
             buf = struct.pack('@h', self.value.value)
             fd.sendall(buf)
         verbose_trace('</MI_Sint16.write>')
@@ -431,7 +606,7 @@ class MI_Sint16(MI_Value):
         verbose_trace('<MI_Sint16.read>')
         val = None
         if 0 == (MI_NULL_FLAG & flags):
-            buf = fd.recv(2)
+            buf = recv_exact(fd, 2)
             val = struct.unpack('@h', buf)[0]
         rval = MI_Sint16(val)
         verbose_trace('</MI_Sint16.read>')
@@ -439,6 +614,8 @@ class MI_Sint16(MI_Value):
 
 
 class MI_Uint32(MI_Value):
+    __slots__ = ()
+
     def __init__(self, val):
         MI_Value.__init__(self, MI_UINT32)
         if val is not None:
@@ -448,7 +625,7 @@ class MI_Uint32(MI_Value):
         verbose_trace('<MI_Uint32.write>')
         MI_Value.write(self, fd)
         if self.value is not None:
-            verbose_trace('  value: ' + str(self.value.value))
+            verbose_trace('  value: %s', self.value.value)
             buf = struct.pack('@I', self.value.value)
             fd.sendall(buf)
         verbose_trace('</MI_Uint32.write>')
@@ -458,7 +635,7 @@ class MI_Uint32(MI_Value):
         verbose_trace('<MI_Uint32.read>')
         val = None
         if 0 == (MI_NULL_FLAG & flags):
-            buf = fd.recv(4)
+            buf = recv_exact(fd, 4)
             val = struct.unpack('@I', buf)[0]
         rval = MI_Uint32(val)
         verbose_trace('</MI_Uint32.read>')
@@ -466,6 +643,8 @@ class MI_Uint32(MI_Value):
 
 
 class MI_Sint32(MI_Value):
+    __slots__ = ()
+
     def __init__(self, val):
         MI_Value.__init__(self, MI_SINT32)
         if val is not None:
@@ -475,7 +654,7 @@ class MI_Sint32(MI_Value):
         verbose_trace('<MI_Sint32.write>')
         MI_Value.write(self, fd)
         if self.value is not None:
-            verbose_trace('  value: ' + str(self.value.value))
+            verbose_trace('  value: %s', self.value.value)
             buf = struct.pack('@i', self.value.value)
             fd.sendall(buf)
         verbose_trace('</MI_Sint32.write>')
@@ -485,7 +664,7 @@ class MI_Sint32(MI_Value):
         verbose_trace('<MI_Sint32.read>')
         val = None
         if 0 == (MI_NULL_FLAG & flags):
-            buf = fd.recv(4)
+            buf = recv_exact(fd, 4)
             val = struct.unpack('@i', buf)[0]
         rval = MI_Sint32(val)
         verbose_trace('</MI_Sint32.read>')
@@ -493,6 +672,8 @@ class MI_Sint32(MI_Value):
 
 
 class MI_Uint64(MI_Value):
+    __slots__ = ()
+
     def __init__(self, val):
         MI_Value.__init__(self, MI_UINT64)
         if val is not None:
@@ -502,7 +683,7 @@ class MI_Uint64(MI_Value):
         verbose_trace('<MI_Uint64.write>')
         MI_Value.write(self, fd)
         if self.value is not None:
-            verbose_trace('  value: ' + str(self.value.value))
+            verbose_trace('  value: %s', self.value.value)
             buf = struct.pack('@Q', self.value.value)
             fd.sendall(buf)
         verbose_trace('</MI_Uint64.write>')
@@ -512,7 +693,7 @@ class MI_Uint64(MI_Value):
         verbose_trace('<MI_Uint64.read>')
         val = None
         if 0 == (MI_NULL_FLAG & flags):
-            buf = fd.recv(8)
+            buf = recv_exact(fd, 8)
             val = struct.unpack('@Q', buf)[0]
         rval = MI_Uint64(val)
         verbose_trace('</MI_Uint64.read>')
@@ -520,6 +701,8 @@ class MI_Uint64(MI_Value):
 
 
 class MI_Sint64(MI_Value):
+    __slots__ = ()
+
     def __init__(self, val):
         MI_Value.__init__(self, MI_SINT64)
         if val is not None:
@@ -529,7 +712,7 @@ class MI_Sint64(MI_Value):
         verbose_trace('<MI_Sint64.write>')
         MI_Value.write(self, fd)
         if self.value is not None:
-            verbose_trace('  value: ' + str(self.value.value))
+            verbose_trace('  value: %s', self.value.value)
             buf = struct.pack('@q', self.value.value)
             fd.sendall(buf)
         verbose_trace('</MI_Sint64.write>')
@@ -539,7 +722,7 @@ class MI_Sint64(MI_Value):
         verbose_trace('<MI_Sint64.read>')
         val = None
         if 0 == (MI_NULL_FLAG & flags):
-            buf = fd.recv(8)
+            buf = recv_exact(fd, 8)
             val = struct.unpack('@q', buf)[0]
         rval = MI_Sint64(val)
         verbose_trace('</MI_Sint64.read>')
@@ -547,6 +730,8 @@ class MI_Sint64(MI_Value):
 
 
 class MI_Real32(MI_Value):
+    __slots__ = ()
+
     def __init__(self, val):
         MI_Value.__init__(self, MI_REAL32)
         if val is not None:
@@ -556,7 +741,7 @@ class MI_Real32(MI_Value):
         verbose_trace('<MI_Real32.write>')
         MI_Value.write(self, fd)
         if self.value is not None:
-            verbose_trace('  value: ' + str(self.value.value))
+            verbose_trace('  value: %s', self.value.value)
             buf = struct.pack('@f', self.value.value)
             fd.sendall(buf)
         verbose_trace('</MI_Real32.write>')
@@ -566,7 +751,7 @@ class MI_Real32(MI_Value):
         verbose_trace('<MI_Real32.read>')
         val = None
         if 0 == (MI_NULL_FLAG & flags):
-            buf = fd.recv(8)
+            buf = recv_exact(fd, 8)
             val = struct.unpack('@f', buf)[0]
         rval = MI_Real32(val)
         verbose_trace('</MI_Real32.read>')
@@ -574,6 +759,8 @@ class MI_Real32(MI_Value):
 
 
 class MI_Real64(MI_Value):
+    __slots__ = ()
+
     def __init__(self, val):
         MI_Value.__init__(self, MI_REAL64)
         if val is not None:
@@ -583,7 +770,7 @@ class MI_Real64(MI_Value):
         verbose_trace('<MI_Real64.write>')
         MI_Value.write(self, fd)
         if self.value is not None:
-            verbose_trace('  value: ' + str(self.value.value))
+            verbose_trace('  value: %s', self.value.value)
             buf = struct.pack('@d', self.value.value)
             fd.sendall(buf)
         verbose_trace('</MI_Real64.write>')
@@ -593,7 +780,7 @@ class MI_Real64(MI_Value):
         verbose_trace('<MI_Real64.read>')
         val = None
         if 0 == (MI_NULL_FLAG & flags):
-            buf = fd.recv(8)
+            buf = recv_exact(fd, 8)
             val = struct.unpack('@d', buf)[0]
         rval = MI_Real64(val)
         verbose_trace('</MI_Real64.read>')
@@ -601,6 +788,8 @@ class MI_Real64(MI_Value):
 
 
 class MI_Char16(MI_Value):
+    __slots__ = ()
+
     def __init__(self, val):
         MI_Value.__init__(self, MI_CHAR16)
         if val is not None:
@@ -610,7 +799,7 @@ class MI_Char16(MI_Value):
         verbose_trace('<MI_Char16.write>')
         MI_Value.write(self, fd)
         if self.value is not None:
-            verbose_trace('  value: ' + str(self.value.value))
+            verbose_trace('  value: %s', self.value.value)
             buf = struct.pack('@H', self.value.value)
             fd.sendall(buf)
         verbose_trace('</MI_Char16.write>')
@@ -620,7 +809,7 @@ class MI_Char16(MI_Value):
         verbose_trace('<MI_Char16.read>')
         val = None
         if 0 == (MI_NULL_FLAG & flags):
-            buf = fd.recv(2)
+            buf = recv_exact(fd, 2)
             val = struct.unpack('@H', buf)[0]
         rval = MI_Char16(val)
         verbose_trace('</MI_Char16.read>')
@@ -628,6 +817,8 @@ class MI_Char16(MI_Value):
 
 
 class MI_Datetime(MI_Value):
+    __slots__ = ()
+
     def __init__(self, isTimestamp):
         MI_Value.__init__(self, MI_DATETIME)
         try:
@@ -653,7 +844,7 @@ class MI_Datetime(MI_Value):
     def read_data(fd):
         verbose_trace('  <MI_Datetime.read_data>')
         rval = None
-        buf = fd.recv(1)
+        buf = recv_exact(fd, 1)
         isTimestamp = None
         try:
             isTimestamp = ctypes.c_bool(struct.unpack('@B', buf)[0])
@@ -668,6 +859,9 @@ class MI_Datetime(MI_Value):
 
 
 class MI_Timestamp(MI_Datetime):
+    __slots__ = ('year', 'month', 'day', 'hour', 'minute', 'second',
+                 'microseconds', 'utc')
+
     def __init__(self,
                  year=None,
                  month=None,
@@ -738,15 +932,15 @@ class MI_Timestamp(MI_Datetime):
 
     def write_data(self, fd):
         verbose_trace('  <MI_Timestamp.write_data>')
-        verbose_trace('    isTimestamp:' + str(self.value.value))
-        verbose_trace('    year:' + str(self.year.value))
-        verbose_trace('    month:' + str(self.month.value))
-        verbose_trace('    day:' + str(self.day.value))
-        verbose_trace('    hour:' + str(self.hour.value))
-        verbose_trace('    minute:' + str(self.minute.value))
-        verbose_trace('    second:' + str(self.second.value))
-        verbose_trace('    microseconds:' + str(self.microseconds.value))
-        verbose_trace('    utc:' + str(self.utc.value))
+        verbose_trace('    isTimestamp:%s', self.value.value)
+        verbose_trace('    year:%s', self.year.value)
+        verbose_trace('    month:%s', self.month.value)
+        verbose_trace('    day:%s', self.day.value)
+        verbose_trace('    hour:%s', self.hour.value)
+        verbose_trace('    minute:%s', self.minute.value)
+        verbose_trace('    second:%s', self.second.value)
+        verbose_trace('    microseconds:%s', self.microseconds.value)
+        verbose_trace('    utc:%s', self.utc.value)
         buf = struct.pack('@B', self.value.value)
         buf += struct.pack('@I', self.year.value)
         buf += struct.pack('@I', self.month.value)
@@ -762,34 +956,21 @@ class MI_Timestamp(MI_Datetime):
     @staticmethod
     def read_data(fd):
         verbose_trace('    <MI_Timestamp.read_data>')
-        buf = fd.recv(4)
-        year = struct.unpack('@I', buf)[0]
-        buf = fd.recv(4)
-        month = struct.unpack('@I', buf)[0]
-        buf = fd.recv(4)
-        day = struct.unpack('@I', buf)[0]
-        buf = fd.recv(4)
-        hour = struct.unpack('@I', buf)[0]
-        buf = fd.recv(4)
-        minute = struct.unpack('@I', buf)[0]
-        buf = fd.recv(4)
-        second = struct.unpack('@I', buf)[0]
-        buf = fd.recv(4)
-        microseconds = struct.unpack('@I', buf)[0]
-        buf = fd.recv(4)
-        utc = struct.unpack('@i', buf)[0]
-        buf = fd.recv(4)
+        # eight fields followed by four bytes of padding
+        buf = recv_exact(fd, 36)
+        year, month, day, hour, minute, second, microseconds, utc = \
+            struct.unpack('@7Ii', buf[:32])
         rval = MI_Timestamp(year, month, day, hour, minute, second,
                             microseconds, utc)
         verbose_trace('      isTimestamp: True')
-        verbose_trace('      year:' + str(year))
-        verbose_trace('      month:' + str(month))
-        verbose_trace('      day:' + str(day))
-        verbose_trace('      hour:' + str(hour))
-        verbose_trace('      minute:' + str(minute))
-        verbose_trace('      second:' + str(second))
-        verbose_trace('      microseconds:' + str(microseconds))
-        verbose_trace('      utc:' + str(utc))
+        verbose_trace('      year:%s', year)
+        verbose_trace('      month:%s', month)
+        verbose_trace('      day:%s', day)
+        verbose_trace('      hour:%s', hour)
+        verbose_trace('      minute:%s', minute)
+        verbose_trace('      second:%s', second)
+        verbose_trace('      microseconds:%s', microseconds)
+        verbose_trace('      utc:%s', utc)
         verbose_trace('    </MI_Timestamp.read_data>')
         return rval
 
@@ -804,6 +985,8 @@ class MI_Timestamp(MI_Datetime):
 
 
 class MI_Interval(MI_Datetime):
+    __slots__ = ('days', 'hours', 'minutes', 'seconds', 'microseconds')
+
     def __init__(self,
                  days=None,
                  hours=None,
@@ -820,22 +1003,22 @@ class MI_Interval(MI_Datetime):
             MI_Datetime.__init__(self, True)
 
         if days is None:
-            self.day = ctypes.c_uint(0)
+            self.days = ctypes.c_uint(0)
         else:
             self.days = ctypes.c_uint(days)
 
         if hours is None:
-            self.hour = ctypes.c_uint(0)
+            self.hours = ctypes.c_uint(0)
         else:
             self.hours = ctypes.c_uint(hours)
 
         if minutes is None:
-            self.minute = ctypes.c_uint(0)
+            self.minutes = ctypes.c_uint(0)
         else:
             self.minutes = ctypes.c_uint(minutes)
 
         if seconds is None:
-            self.second = ctypes.c_uint(0)
+            self.seconds = ctypes.c_uint(0)
         else:
             self.seconds = ctypes.c_uint(seconds)
 
@@ -853,12 +1036,12 @@ class MI_Interval(MI_Datetime):
 
     def write_data(self, fd):
         verbose_trace('  <MI_Interval.write_data>')
-        verbose_trace('    isTimestamp:' + str(self.value.value))
-        verbose_trace('    days:' + str(self.days.value))
-        verbose_trace('    hours:' + str(self.hours.value))
-        verbose_trace('    minutes:' + str(self.minutes.value))
-        verbose_trace('    seconds:' + str(self.seconds.value))
-        verbose_trace('    microseconds:' + str(self.microseconds.value))
+        verbose_trace('    isTimestamp:%s', self.value.value)
+        verbose_trace('    days:%s', self.days.value)
+        verbose_trace('    hours:%s', self.hours.value)
+        verbose_trace('    minutes:%s', self.minutes.value)
+        verbose_trace('    seconds:%s', self.seconds.value)
+        verbose_trace('    microseconds:%s', self.microseconds.value)
         buf = struct.pack('@B', self.value.value)
         buf += struct.pack('@I', self.days.value)
         buf += struct.pack('@I', self.hours.value)
@@ -871,29 +1054,24 @@ class MI_Interval(MI_Datetime):
     @staticmethod
     def read_data(fd):
         verbose_trace('    <MI_Interval.read_data>')
-        buf = fd.recv(4)
-        days = struct.unpack('@I', buf)[0]
-        buf = fd.recv(4)
-        hours = struct.unpack('@I', buf)[0]
-        buf = fd.recv(4)
-        minutes = struct.unpack('@I', buf)[0]
-        buf = fd.recv(4)
-        seconds = struct.unpack('@I', buf)[0]
-        buf = fd.recv(4)
-        microseconds = struct.unpack('@I', buf)[0]
-        buf = fd.recv(4)
+        # five fields followed by four bytes of padding
+        buf = recv_exact(fd, 24)
+        days, hours, minutes, seconds, microseconds = \
+            struct.unpack('@5I', buf[:20])
         rval = MI_Timestamp(days, hours, minutes, seconds, microseconds)
         verbose_trace('      isTimestamp: False')
-        verbose_trace('      days:' + str(days))
-        verbose_trace('      hours:' + str(hours))
-        verbose_trace('      minutes:' + str(minutes))
-        verbose_trace('      seconds:' + str(seconds))
-        verbose_trace('      microseconds:' + str(microseconds))
+        verbose_trace('      days:%s', days)
+        verbose_trace('      hours:%s', hours)
+        verbose_trace('      minutes:%s', minutes)
+        verbose_trace('      seconds:%s', seconds)
+        verbose_trace('      microseconds:%s', microseconds)
         verbose_trace('    </MI_Interval.read_data>')
         return rval
 
 
 class MI_String(MI_Value):
+    __slots__ = ()
+
     def __init__(self, val):
         MI_Value.__init__(self, MI_STRING)
         if val is not None:
@@ -908,19 +1086,19 @@ class MI_String(MI_Value):
                 if type(self.value) == str:
                     buf = struct.pack('@i', len(bytes(self.value,'utf8')))
                     buf += bytes(self.value, 'utf8')
-                    verbose_trace('  len: ' + str(len(self.value)) + ', value: ' +
+                    verbose_trace('  len: %d, value: %s', len(self.value),
                                   self.value)
                 else:
                     buf += self.value
-                    verbose_trace('  len: ' + str(len(self.value)) + ', value: ' +
-                                  self.value.decode('utf8'))
+                    verbose_trace('  len: %d, value: %r', len(self.value),
+                                  self.value)
             else: # python 2
                 if type(self.value) != str: # unicode
                     buf = struct.pack('@i', len(self.value.encode('utf8')))
                     buf+=self.value.encode('utf8')
                 else:
                     buf += self.value
-                verbose_trace('  len: ' + str(len(self.value)) + ', value: ' +
+                verbose_trace('  len: %d, value: %s', len(self.value),
                                   self.value)
 
             fd.sendall(buf)
@@ -938,6 +1116,8 @@ class MI_String(MI_Value):
 
 
 class MI_Instance(MI_Value):
+    __slots__ = ()
+
     def __init__(self, val):
         MI_Value.__init__(self, MI_INSTANCE)
         if val is not None:
@@ -961,559 +1141,142 @@ class MI_Instance(MI_Value):
         return rval
 
 
-class MI_BooleanA(MI_Value):
-    def __init__(self, vals):
-        MI_Value.__init__(self, MI_BOOLEANA)
-        self.value = []
-        if vals is not None:
-            for val in vals:
-                try:
-                    self.value.append(ctypes.c_bool(val))
-                except:
-                    self.value.append(ctypes.c_int(val))
-
-    def write(self, fd):
-        verbose_trace('<MI_BooleanA.write>')
-        if self.value is not None and 0 < len(self.value):
-            MI_Value.write(self, fd)
-            verbose_trace('  len:' + str(len(self.value)))
-            buf = struct.pack('@i', len(self.value))
-            fd.sendall(buf)
-            verbose_trace('    <values>')
-            for val in self.value:
-                verbose_trace('      value: ' + str(val.value))
-                if val.value:
-                    tmp = 1
-                else:
-                    tmp = 0
-                buf = struct.pack('@B', tmp)
-                fd.sendall(buf)
-            verbose_trace('  </values>')
-        else:
-            verbose_trace('    type: ' + str(self.type))
-            fd.sendall(struct.pack('@B', self.type | MI_NULL_FLAG))
-        verbose_trace('</MI_BooleanA.write>')
+class MI_FixedA(MI_Value):
+    """
+    Base class of the arrays of fixed-width values.  The payload is kept in
+    an array.array of type_code (a list on interpreters whose array module
+    lacks the typecode) so that it is packed and unpacked in one call.
+    """
+    __slots__ = ()
+    item_type = None
+    type_code = None
 
-    @staticmethod
-    def read(fd, flags):
-        verbose_trace('<MI_BooleanA.read>')
-        vals = None
-        if 0 == (MI_NULL_FLAG & flags):
-            vals = []
-            buf = fd.recv(4)
-            length = struct.unpack('@i', buf)[0]
-            verbose_trace('  len:' + str(length))
-            for _ in range(length):
-                buf = fd.recv(1)
-                val = struct.unpack('@B', buf)[0]
-                verbose_trace('  value: ' + str(val))
-                vals.append(val)
-        rval = MI_BooleanA(vals)
-        verbose_trace('</MI_BooleanA.read>')
-        return rval
-
-
-class MI_Uint8A(MI_Value):
     def __init__(self, vals):
-        MI_Value.__init__(self, MI_UINT8A)
-        self.value = []
-        if vals is not None:
-            for val in vals:
-                self.value.append(ctypes.c_ubyte(val))
+        MI_Value.__init__(self, self.item_type)
+        self.value = to_array(self.type_code, vals)
 
     def write(self, fd):
-        verbose_trace('<MI_Uint8A.write>')
+        name = self.__class__.__name__
+        verbose_trace('<%s.write>', name)
         if self.value is not None and 0 < len(self.value):
             MI_Value.write(self, fd)
-            verbose_trace('  len:' + str(len(self.value)))
+            verbose_trace('  len:%s', len(self.value))
             buf = struct.pack('@i', len(self.value))
+            verbose_trace('  <values>')
+            verbose_trace('    values: %s', self.value)
+            buf += pack_array(self.type_code, self.value)
             fd.sendall(buf)
-            verbose_trace('    <values>')
-            for val in self.value:
-                verbose_trace('      value: ' + str(val.value))
-                buf = struct.pack('@B', val.value)
-                fd.sendall(buf)
             verbose_trace('  </values>')
         else:
-            verbose_trace('    type: ' + str(self.type))
+            verbose_trace('    type: %s', self.type)
             fd.sendall(struct.pack('@B', self.type | MI_NULL_FLAG))
-        verbose_trace('</MI_Uint8A.write>')
+        verbose_trace('</%s.write>', name)
 
-    @staticmethod
-    def read(fd, flags):
-        verbose_trace('<MI_UintA.read>')
+    def read(cls, fd, flags):
+        verbose_trace('<%s.read>', cls.__name__)
         vals = None
         if 0 == (MI_NULL_FLAG & flags):
-            vals = []
-            buf = fd.recv(4)
+            buf = recv_exact(fd, 4)
             length = struct.unpack('@i', buf)[0]
-            verbose_trace('  len:' + str(length))
-            for _ in range(length):
-                buf = fd.recv(1)
-                val = struct.unpack('@B', buf)[0]
-                verbose_trace('  value: ' + str(val))
-                vals.append(val)
-        rval = MI_Uint8A(vals)
-        verbose_trace('</MI_Uint8A.read>')
+            verbose_trace('  len:%s', length)
+            size = length * struct.calcsize('@' + cls.type_code)
+            buf = recv_exact(fd, size)
+            vals = unpack_array(cls.type_code, buf)
+            verbose_trace('  values: %s', vals)
+        rval = cls(vals)
+        verbose_trace('</%s.read>', cls.__name__)
         return rval
+    read = classmethod(read)
 
 
-class MI_Sint8A(MI_Value):
-    def __init__(self, vals):
-        MI_Value.__init__(self, MI_SINT8A)
-        self.value = []
-        if vals is not None:
-            for val in vals:
-                self.value.append(ctypes.c_byte(val))
-
-    def write(self, fd):
-        verbose_trace('<MI_Sint8A.write>')
-        if self.value is not None and 0 < len(self.value):
-            MI_Value.write(self, fd)
-            verbose_trace('  len:' + str(len(self.value)))
-            buf = struct.pack('@i', len(self.value))
-            fd.sendall(buf)
-            verbose_trace('    <values>')
-            for val in self.value:
-                verbose_trace('      value: ' + str(val.value))
-                buf = struct.pack('@b', val.value)
-                fd.sendall(buf)
-            verbose_trace('  </values>')
-        else:
-            verbose_trace('    type: ' + str(self.type))
-            fd.sendall(struct.pack('@B', self.type | MI_NULL_FLAG))
-        verbose_trace('</MI_Sint8A.write>')
-
-    @staticmethod
-    def read(fd, flags):
-        verbose_trace('<MI_SintA.read>')
-        vals = None
-        if 0 == (MI_NULL_FLAG & flags):
-            vals = []
-            buf = fd.recv(4)
-            length = struct.unpack('@i', buf)[0]
-            verbose_trace('  len:' + str(length))
-            for _ in range(length):
-                buf = fd.recv(1)
-                val = struct.unpack('@b', buf)[0]
-                verbose_trace('  value: ' + str(val))
-                vals.append(val)
-        rval = MI_Sint8A(vals)
-        verbose_trace('</MI_Sint8A.read>')
-        return rval
-
+class MI_BooleanA(MI_FixedA):
+    __slots__ = ()
+    item_type = MI_BOOLEANA
+    type_code = 'B'
 
-class MI_Uint16A(MI_Value):
     def __init__(self, vals):
-        verbose_trace('<MI_Uint16A>')
-        MI_Value.__init__(self, MI_UINT16A)
-        self.value = []
+        flags = None
         if vals is not None:
+            flags = []
             for val in vals:
-                if isinstance(val, ctypes.c_ushort):
-                    self.value.append(val)
+                if hasattr(val, 'value'):
+                    val = val.value
+                if val:
+                    flags.append(1)
                 else:
-                    self.value.append(ctypes.c_ushort(val))
-        verbose_trace('</MI_Uint16A>')
+                    flags.append(0)
+        MI_FixedA.__init__(self, flags)
 
-    def write(self, fd):
-        verbose_trace('<MI_Uint16A.write>')
-        if self.value is not None and 0 < len(self.value):
-            MI_Value.write(self, fd)
-            verbose_trace('  len:' + str(len(self.value)))
-            buf = struct.pack('@i', len(self.value))
-            fd.sendall(buf)
-            verbose_trace('  <values>')
-            for val in self.value:
-                verbose_trace('    value: ' + str(val.value))
-                buf = struct.pack('@H', val.value)
-                fd.sendall(buf)
-            verbose_trace('  </values>')
-        else:
-            verbose_trace('    type: ' + str(self.type))
-            fd.sendall(struct.pack('@B', self.type | MI_NULL_FLAG))
-        verbose_trace('</MI_Uint16A.write>')
 
-    @staticmethod
-    def read(fd, flags):
-        verbose_trace('<MI_Uint16A.read>')
-        vals = None
-        if 0 == (MI_NULL_FLAG & flags):
-            vals = []
-            buf = fd.recv(4)
-            length = struct.unpack('@i', buf)[0]
-            verbose_trace('  len:' + str(length))
-            for _ in range(length):
-                buf = fd.recv(2)
-                val = struct.unpack('@H', buf)[0]
-                verbose_trace('  value: ' + str(val))
-                vals.append(val)
-        rval = MI_Uint16A(vals)
-        verbose_trace('</MI_Uint16A.read>')
-        return rval
+class MI_Uint8A(MI_FixedA):
+    __slots__ = ()
+    item_type = MI_UINT8A
+    type_code = 'B'
 
 
-class MI_Sint16A(MI_Value):
-    def __init__(self, vals):
-        MI_Value.__init__(self, MI_SINT16A)
-        self.value = []
-        if vals is not None:
-            for val in vals:
-                self.value.append(ctypes.c_short(val))
+class MI_Sint8A(MI_FixedA):
+    __slots__ = ()
+    item_type = MI_SINT8A
+    type_code = 'b'
 
-    def write(self, fd):
-        verbose_trace('<MI_Sint16A.write>')
-        if self.value is not None and 0 < len(self.value):
-            MI_Value.write(self, fd)
-            verbose_trace('  len:' + str(len(self.value)))
-            buf = struct.pack('@i', len(self.value))
-            fd.sendall(buf)
-            verbose_trace('    <values>')
-            for val in self.value:
-                verbose_trace('      value: ' + str(val.value))
-                buf = struct.pack('@h', val.value)
-                fd.sendall(buf)
-            verbose_trace('  </values>')
-        else:
-            verbose_trace('    type: ' + str(self.type))
-            fd.sendall(struct.pack('@B', self.type | MI_NULL_FLAG))
-        verbose_trace('</MI_Sint16A.write>')
 
-    @staticmethod
-    def read(fd, flags):
-        verbose_trace('<MI_Sint16A.read>')
-        vals = None
-        if 0 == (MI_NULL_FLAG & flags):
-            vals = []
-            buf = fd.recv(4)
-            len = struct.unpack('@i', buf)[0]
-            verbose_trace('  len:' + str(len))
-            for _ in range(len):
-                buf = fd.recv(2)
-                val = struct.unpack('@h', buf)[0]
-                verbose_trace('  value: ' + str(val))
-                vals.append(val)
-        rval = MI_Sint16A(vals)
-        verbose_trace('</MI_Sint16A.read>')
-        return rval
+class MI_Uint16A(MI_FixedA):
+    __slots__ = ()
+    item_type = MI_UINT16A
+    type_code = 'H'
 
 
-class MI_Uint32A(MI_Value):
-    def __init__(self, vals):
-        MI_Value.__init__(self, MI_UINT32A)
-        self.value = []
-        if vals is not None:
-            for val in vals:
-                self.value.append(ctypes.c_uint(val))
+class MI_Sint16A(MI_FixedA):
+    __slots__ = ()
+    item_type = MI_SINT16A
+    type_code = 'h'
 
-    def write(self, fd):
-        verbose_trace('<MI_Uint32A.write>')
-        if self.value is not None and 0 < len(self.value):
-            MI_Value.write(self, fd)
-            verbose_trace('  len:' + str(len(self.value)))
-            buf = struct.pack('@i', len(self.value))
-            fd.sendall(buf)
-            verbose_trace('    <values>')
-            for val in self.value:
-                verbose_trace('      value: ' + str(val.value))
-                buf = struct.pack('@I', val.value)
-                fd.sendall(buf)
-            verbose_trace('  </values>')
-        else:
-            verbose_trace('    type: ' + str(self.type))
-            fd.sendall(struct.pack('@B', self.type | MI_NULL_FLAG))
-        verbose_trace('</MI_Uint32A.write>')
 
-    @staticmethod
-    def read(fd, flags):
-        verbose_trace('<MI_Uint32A.read>')
-        vals = None
-        if 0 == (MI_NULL_FLAG & flags):
-            vals = []
-            buf = fd.recv(4)
-            length = struct.unpack('@i', buf)[0]
-            verbose_trace('  len:' + str(length))
-            for _ in range(length):
-                buf = fd.recv(4)
-                val = struct.unpack('@I', buf)[0]
-                verbose_trace('  value: ' + str(val))
-                vals.append(val)
-        rval = MI_Uint32A(vals)
-        verbose_trace('</MI_Uint32A.read>')
-        return rval
+class MI_Uint32A(MI_FixedA):
+    __slots__ = ()
+    item_type = MI_UINT32A
+    type_code = 'I'
 
 
-class MI_Sint32A(MI_Value):
-    def __init__(self, vals):
-        MI_Value.__init__(self, MI_SINT32A)
-        self.value = []
-        if vals is not None:
-            for val in vals:
-                self.value.append(ctypes.c_int(val))
+class MI_Sint32A(MI_FixedA):
+    __slots__ = ()
+    item_type = MI_SINT32A
+    type_code = 'i'
 
-    def write(self, fd):
-        verbose_trace('<MI_Sint32A.write>')
-        if self.value is not None and 0 < len(self.value):
-            MI_Value.write(self, fd)
-            verbose_trace('    len:' + str(len(self.value)))
-            buf = struct.pack('@i', len(self.value))
-            fd.sendall(buf)
-            verbose_trace('    <values>')
-            for val in self.value:
-                verbose_trace('      value: ' + str(val.value))
-                buf = struct.pack('@i', val.value)
-                fd.sendall(buf)
-            verbose_trace('  </values>')
-        else:
-            verbose_trace('    type: ' + str(self.type))
-            fd.sendall(struct.pack('@B', self.type | MI_NULL_FLAG))
-        verbose_trace('</MI_Sint32A.write>')
 
-    @staticmethod
-    def read(fd, flags):
-        verbose_trace('<MI_Sint32A.read>')
-        vals = None
-        if 0 == (MI_NULL_FLAG & flags):
-            vals = []
-            buf = fd.recv(4)
-            length = struct.unpack('@i', buf)[0]
-            verbose_trace('  len:' + str(length))
-            for _ in range(length):
-                buf = fd.recv(4)
-                val = struct.unpack('@i', buf)[0]
-                verbose_trace('  value: ' + str(val))
-                vals.append(val)
-        rval = MI_Sint32A(vals)
-        verbose_trace('</MI_Sint32A.read>')
-        return rval
+class MI_Uint64A(MI_FixedA):
+    __slots__ = ()
+    item_type = MI_UINT64A
+    type_code = 'Q'
 
 
-class MI_Uint64A(MI_Value):
-    def __init__(self, vals):
-        MI_Value.__init__(self, MI_UINT64A)
-        self.value = []
-        if vals is not None:
-            for val in vals:
-                self.value.append(ctypes.c_ulonglong(val))
-
-    def write(self, fd):
-        verbose_trace('<MI_Uint64A.write>')
-        if self.value is not None and 0 < len(self.value):
-            MI_Value.write(self, fd)
-            verbose_trace('  len:' + str(len(self.value)))
-            buf = struct.pack('@i', len(self.value))
-            fd.sendall(buf)
-            verbose_trace('    <values>')
-            for val in self.value:
-                verbose_trace('      value: ' + str(val.value))
-                buf = struct.pack('@Q', val.value)
-                fd.sendall(buf)
-            verbose_trace('  </values>')
-        else:
-            verbose_trace('    type: ' + str(self.type))
-            fd.sendall(struct.pack('@B', self.type | MI_NULL_FLAG))
-        verbose_trace('</MI_Uint64A.write>')
+class MI_Sint64A(MI_FixedA):
+    __slots__ = ()
+    item_type = MI_SINT64A
+    type_code = 'q'
 
-    @staticmethod
-    def read(fd, flags):
-        verbose_trace('<MI_Uint64A.read>')
-        vals = None
-        if 0 == (MI_NULL_FLAG & flags):
-            vals = []
-            buf = fd.recv(4)
-            length = struct.unpack('@i', buf)[0]
-            verbose_trace('  len:' + str(length))
-            for _ in range(length):
-                buf = fd.recv(8)
-                val = struct.unpack('@Q', buf)[0]
-                verbose_trace('  value: ' + str(val))
-                vals.append(val)
-        rval = MI_Uint64A(vals)
-        verbose_trace('</MI_Uint64A.read>')
-        return rval
 
+class MI_Real32A(MI_FixedA):
+    __slots__ = ()
+    item_type = MI_REAL32A
+    type_code = 'f'
 
-class MI_Sint64A(MI_Value):
-    def __init__(self, vals):
-        MI_Value.__init__(self, MI_SINT64A)
-        self.value = []
-        if vals is not None:
-            for val in vals:
-                self.value.append(ctypes.c_longlong(val))
 
-    def write(self, fd):
-        verbose_trace('<MI_Sint64A.write>')
-        if self.value is not None and 0 < len(self.value):
-            MI_Value.write(self, fd)
-            verbose_trace('  len:' + str(len(self.value)))
-            buf = struct.pack('@i', len(self.value))
-            fd.sendall(buf)
-            verbose_trace('    <values>')
-            for val in self.value:
-                verbose_trace('      value: ' + str(val.value))
-                buf = struct.pack('@q', val.value)
-                fd.sendall(buf)
-            verbose_trace('  </values>')
-        else:
-            verbose_trace('    type: ' + str(self.type))
-            fd.sendall(struct.pack('@B', self.type | MI_NULL_FLAG))
-        verbose_trace('</MI_Sint64A.write>')
+class MI_Real64A(MI_FixedA):
+    __slots__ = ()
+    item_type = MI_REAL64A
+    type_code = 'd'
 
-    @staticmethod
-    def read(fd, flags):
-        verbose_trace('<MI_Sint64A.read>')
-        vals = None
-        if 0 == (MI_NULL_FLAG & flags):
-            vals = []
-            buf = fd.recv(4)
-            len = struct.unpack('@i', buf)[0]
-            verbose_trace('  len:' + str(len))
-            for _ in range(len):
-                buf = fd.recv(8)
-                val = struct.unpack('@q', buf)[0]
-                verbose_trace('  value: ' + str(val))
-                vals.append(val)
-        rval = MI_Sint64A(vals)
-        verbose_trace('</MI_Sint64A.read>')
-        return rval
 
-
-class MI_Real32A(MI_Value):
-    def __init__(self, vals):
-        MI_Value.__init__(self, MI_REAL32A)
-        self.value = []
-        if vals is not None:
-            for val in vals:
-                self.value.append(ctypes.c_float(val))
-
-    def write(self, fd):
-        verbose_trace('<MI_Real32A.write>')
-        if self.value is not None and 0 < len(self.value):
-            MI_Value.write(self, fd)
-            verbose_trace('  len:' + str(len(self.value)))
-            buf = struct.pack('@i', len(self.value))
-            fd.sendall(buf)
-            verbose_trace('    <values>')
-            for val in self.value:
-                verbose_trace('      value: ' + str(val.value))
-                buf = struct.pack('@f', val.value)
-                fd.sendall(buf)
-            verbose_trace('  </values>')
-        else:
-            verbose_trace('    type: ' + str(self.type))
-            fd.sendall(struct.pack('@B', self.type | MI_NULL_FLAG))
-        verbose_trace('</MI_Real32A.write>')
-
-    @staticmethod
-    def read(fd, flags):
-        verbose_trace('<MI_Real32A.read>')
-        vals = None
-        if 0 == (MI_NULL_FLAG & flags):
-            vals = []
-            buf = fd.recv(4)
-            length = struct.unpack('@i', buf)[0]
-            verbose_trace('  len:' + str(length))
-            for _ in range(length):
-                buf = fd.recv(4)
-                val = struct.unpack('@f', buf)[0]
-                verbose_trace('  value: ' + str(val))
-                vals.append(val)
-        rval = MI_Real32A(vals)
-        verbose_trace('</MI_Real32A.read>')
-        return rval
-
-
-class MI_Real64A(MI_Value):
-    def __init__(self, vals):
-        MI_Value.__init__(self, MI_REAL64A)
-        self.value = []
-        if vals is not None:
-            for val in vals:
-                self.value.append(ctypes.c_double(val))
-
-    def write(self, fd):
-        verbose_trace('<MI_Real64A.write>')
-        if self.value is not None and 0 < len(self.value):
-            MI_Value.write(self, fd)
-            verbose_trace('  len:' + str(len(self.value)))
-            buf = struct.pack('@i', len(self.value))
-            fd.sendall(buf)
-            verbose_trace('    <values>')
-            for val in self.value:
-                verbose_trace('      value: ' + str(val.value))
-                buf = struct.pack('@d', val.value)
-                fd.sendall(buf)
-            verbose_trace('  </values>')
-        else:
-            verbose_trace('    type: ' + str(self.type))
-            fd.sendall(struct.pack('@B', self.type | MI_NULL_FLAG))
-        verbose_trace('</MI_Real64A.write>')
-
-    @staticmethod
-    def read(fd, flags):
-        verbose_trace('<MI_Real64A.read>')
-        vals = None
-        if 0 == (MI_NULL_FLAG & flags):
-            vals = []
-            buf = fd.recv(4)
-            length = struct.unpack('@i', buf)[0]
-            verbose_trace('  len:' + str(length))
-            for _ in range(length):
-                buf = fd.recv(8)
-                val = struct.unpack('@d', buf)[0]
-                verbose_trace('  value: ' + str(val))
-                vals.append(val)
-        rval = MI_Real64A(vals)
-        verbose_trace('</MI_Real64A.read>')
-        return rval
-
-
-class MI_Char16A(MI_Value):
-    def __init__(self, vals):
-        MI_Value.__init__(self, MI_CHAR16A)
-        self.value = []
-        if vals is not None:
-            for val in vals:
-                self.value.append(ctypes.c_ushort(val))
-
-    def write(self, fd):
-        verbose_trace('<MI_Char16A.write>')
-        if self.value is not None and 0 < len(self.value):
-            MI_Value.write(self, fd)
-            verbose_trace('  len:' + str(len(self.value)))
-            buf = struct.pack('@i', len(self.value))
-            fd.sendall(buf)
-            verbose_trace('  <values>')
-            for val in self.value:
-                verbose_trace('    value: ' + str(val.value))
-                buf = struct.pack('@H', val.value)
-                fd.sendall(buf)
-            verbose_trace('  </values>')
-        else:
-            verbose_trace('    type: ' + str(self.type))
-            fd.sendall(struct.pack('@B', self.type | MI_NULL_FLAG))
-        verbose_trace('</MI_Char16A.write>')
-
-    @staticmethod
-    def read(fd, flags):
-        verbose_trace('<MI_Char16A.read>')
-        vals = None
-        if 0 == (MI_NULL_FLAG & flags):
-            vals = []
-            buf = fd.recv(4)
-            length = struct.unpack('@i', buf)[0]
-            verbose_trace('  len:' + str(length))
-            for i in range(length):
-                buf = fd.recv(2)
-                val = struct.unpack('@H', buf)[0]
-                verbose_trace('  value: ' + str(val))
-                vals.append(val)
-        rval = MI_Char16A(vals)
-        verbose_trace('</MI_Char16A.read>')
-        return rval
+class MI_Char16A(MI_FixedA):
+    __slots__ = ()
+    item_type = MI_CHAR16A
+    type_code = 'H'
 
 
 class MI_DatetimeA(MI_Value):
+    __slots__ = ('values',)
+
     def __init__(self, vals):
         MI_Value.__init__(self, MI_DATETIMEA)
         self.values = []
@@ -1523,7 +1286,7 @@ class MI_DatetimeA(MI_Value):
     def write(self, fd):
         verbose_trace('<MI_DatetimeA.write>')
         MI_Value.write(self, fd)
-        verbose_trace('  len:' + str(len(self.values)))
+        verbose_trace('  len:%s', len(self.values))
         buf = struct.pack('@i', len(self.values))
         fd.sendall(buf)
         for val in self.values:
@@ -1536,9 +1299,9 @@ class MI_DatetimeA(MI_Value):
         vals = None
         if 0 == (MI_NULL_FLAG & flags):
             vals = []
-            buf = fd.recv(4)
+            buf = recv_exact(fd, 4)
             length = struct.unpack('@i', buf)[0]
-            verbose_trace('  len:' + str(length))
+            verbose_trace('  len:%s', length)
             for _ in range(length):
                 val = MI_Datetime.read_data(fd)
                 vals.append(val)
@@ -1548,6 +1311,8 @@ class MI_DatetimeA(MI_Value):
 
 
 class MI_StringA(MI_Value):
+    __slots__ = ()
+
     def __init__(self, vals):
         MI_Value.__init__(self, MI_STRINGA)
         self.value = []
@@ -1559,7 +1324,7 @@ class MI_StringA(MI_Value):
         verbose_trace('<MI_StringA.write>')
         if self.value is not None and 0 < len(self.value):
             MI_Value.write(self, fd)
-            verbose_trace('  len:' + str(len(self.value)))
+            verbose_trace('  len:%s', len(self.value))
             buf = struct.pack('@i', len(self.value))
             fd.sendall(buf)
             verbose_trace('  <values>')
@@ -1567,7 +1332,7 @@ class MI_StringA(MI_Value):
                 write_string(fd, val)
             verbose_trace('  </values>')
         else:
-            verbose_trace('    type: ' + str(self.type))
+            verbose_trace('    type: %s', self.type)
             fd.sendall(struct.pack('@B', self.type | MI_NULL_FLAG))
         verbose_trace('</MI_StringA.write>')
 
@@ -1577,9 +1342,9 @@ class MI_StringA(MI_Value):
         vals = None
         if 0 == (MI_NULL_FLAG & flags):
             vals = []
-            buf = fd.recv(4)
+            buf = recv_exact(fd, 4)
             length = struct.unpack('@i', buf)[0]
-            verbose_trace('  len:' + str(length))
+            verbose_trace('  len:%s', length)
             for i in range(length):
                 strg = read_string(fd)
                 vals.append(strg)
@@ -1589,6 +1354,8 @@ class MI_StringA(MI_Value):
 
 
 class MI_InstanceA(MI_Value):
+    __slots__ = ()
+
     def __init__(self, vals=None):
         MI_Value.__init__(self, MI_INSTANCEA)
         self.value = []
@@ -1600,7 +1367,7 @@ class MI_InstanceA(MI_Value):
         verbose_trace('<MI_InstanceA.write>')
         if 0 < len(self.value):
             MI_Value.write(self, fd)
-            verbose_trace('  len:' + str(len(self.value)))
+            verbose_trace('  len:%s', len(self.value))
             buf = struct.pack('@i', len(self.value))
             fd.sendall(buf)
             verbose_trace('  <values>')
@@ -1609,7 +1376,7 @@ class MI_InstanceA(MI_Value):
             verbose_trace('  </values>')
         else:
             verbose_trace('    len: 0')
-            verbose_trace('    type: ' + str(self.type | MI_NULL_FLAG))
+            verbose_trace('    type: %s', self.type | MI_NULL_FLAG)
             buf = struct.pack('@B', self.type | MI_NULL_FLAG)
             fd.sendall(buf)
         verbose_trace('</MI_InstanceA.write>')
@@ -1620,13 +1387,48 @@ class MI_InstanceA(MI_Value):
         vals = None
         if 0 == (MI_NULL_FLAG & flags):
             vals = []
-            buf = fd.recv(4)
+            buf = recv_exact(fd, 4)
             length = struct.unpack('@i', buf)[0]
-            verbose_trace('  len:' + str(length))
+            verbose_trace('  len:%s', length)
             for _ in range(length):
                 val = read_values(fd)
-                sys.stderr.write('....' + repr(val) + '....\n')
+                verbose_trace('  value: %r', val)
                 vals.append(val)
         rval = MI_InstanceA(vals)
         verbose_trace('</MI_InstanceA.read>')
         return rval
+
+
+# MI type code -> class used by MI_Value.read to decode a value of that type
+MI_VALUE_CLASSES = {
+    MI_BOOLEAN: MI_Boolean,
+    MI_UINT8: MI_Uint8,
+    MI_SINT8: MI_Sint8,
+    MI_UINT16: MI_Uint16,
+    MI_SINT16: MI_Sint16,
+    MI_UINT32: MI_Uint32,
+    MI_SINT32: MI_Sint32,
+    MI_UINT64: MI_Uint64,
+    MI_SINT64: MI_Sint64,
+    MI_REAL32: MI_Real32,
+    MI_REAL64: MI_Real64,
+    MI_CHAR16: MI_Char16,
+    MI_DATETIME: MI_Datetime,
+    MI_STRING: MI_String,
+    MI_INSTANCE: MI_Instance,
+    MI_BOOLEANA: MI_BooleanA,
+    MI_UINT8A: MI_Uint8A,
+    MI_SINT8A: MI_Sint8A,
+    MI_UINT16A: MI_Uint16A,
+    MI_SINT16A: MI_Sint16A,
+    MI_UINT32A: MI_Uint32A,
+    MI_SINT32A: MI_Sint32A,
+    MI_UINT64A: MI_Uint64A,
+    MI_SINT64A: MI_Sint64A,
+    MI_REAL32A: MI_Real32A,
+    MI_REAL64A: MI_Real64A,
+    MI_CHAR16A: MI_Char16A,
+    MI_DATETIMEA: MI_DatetimeA,
+    MI_STRINGA: MI_StringA,
+    MI_INSTANCEA: MI_InstanceA,
+}
@@ -72,6 +72,10 @@ CERTIFICATE_THUMBPRINT = "jrds_cert_thumbprint"
 
 worker_configuration_file_path = DEFAULT_EMPTY
 
+# The configuration deserialized from the env variable. It is parsed once per process by the first get_value and
+# replaced by set_config and clear_config; the env variable remains what sandboxes and runbooks inherit.
+configuration_cache = None
+
 
 def read_and_set_configuration(configuration_file_path):
     """Reads the worker configuration from the file at config_path and sets the read configuration to
@@ -148,28 +152,45 @@ def set_config(configuration):
     Args:
         configuration: dictionary(string), the configuration key value pairs.
     """
-    try:
-        env_config = os.environ[CONFIG_ENV_KEY]
-        config = json.loads(env_config)
-        config.update(configuration)
-        configuration = config
-    except KeyError:
-        pass
+    global configuration_cache
+    config = {}
+    config.update(load_config())
+    config.update(configuration)
 
-    os.environ[CONFIG_ENV_KEY] = json.dumps(configuration)
+    serialized_config = json.dumps(config)
+    os.environ[CONFIG_ENV_KEY] = serialized_config
+    configuration_cache = json.loads(serialized_config)
 
 
 def clear_config():
+    global configuration_cache
+    configuration_cache = None
     try:
         del os.environ[CONFIG_ENV_KEY]
     except Exception:
         pass
 
 
+def load_config():
+    """Returns the configuration dictionary, deserializing the env variable the first time it is needed.
+
+    Returns:
+        The configuration dictionary, empty if the env variable isn't set.
+    """
+    global configuration_cache
+    if configuration_cache is None:
+        try:
+            env_config = os.environ[CONFIG_ENV_KEY]
+        except KeyError:
+            return {}
+        configuration_cache = json.loads(env_config)
+    return configuration_cache
+
+
 def get_value(key):
     """Gets a specific value from the configuration value in the environment variable.
 
-    This method will merge the provided dictionary to any existent value in the environment variable.
+    The environment variable is only deserialized once per process, see load_config.
 
     Args:
         key: string, the configuration key value.
@@ -178,7 +199,7 @@ def get_value(key):
         The configuration value.
     """
     try:
-        return json.loads(os.environ[CONFIG_ENV_KEY])[key]
+        return load_config()[key]
     except KeyError:
         raise KeyError("Configuration environment variable not found. [key=" + key + "].")
 
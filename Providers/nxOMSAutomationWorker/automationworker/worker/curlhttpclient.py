@@ -4,13 +4,9 @@
 
 """Curl CLI wrapper."""
 
-import base64
-import random
 import subprocess
-import time
 import traceback
 
-import iohelper
 import subprocessfactory
 from httpclient import *
 
@@ -28,6 +24,8 @@ OPTION_REQUEST = "--request"
 OPTION_INSECURE = "--insecure"
 OPTION_DATA = "--data"
 OPTION_PROXY = "--proxy"
+OPTION_CONFIG = "--config"
+OPTION_URL = "--url"
 
 OPTION_CONNECT_TIMEOUT = "--connect-timeout"
 OPTION_MAX_TIME = "--max-time"
@@ -57,6 +55,9 @@ STATUS_CODE_DELIMITER = "\n\nstatus_code:"
 # curl success exit code
 EXIT_SUCCESS = 0
 
+# curl reads its config from stdin
+VALUE_STDIN = "-"
+
 
 class CurlHttpClient(HttpClient):
     """Curl CLI wrapper. Inherits from HttpClient.
@@ -103,8 +104,15 @@ class CurlHttpClient(HttpClient):
         status_code = output[start_index:].strip("\n").split(":")[1]
         return RequestResponse(status_code, response_body)
 
-    def get_base_cmd(self):
-        """Creates the base cmd array to invoke the Curl CLI.
+    @staticmethod
+    def quote_config_value(value):
+        """Quotes value for a curl config file, escaping the characters curl unescapes in quoted parameters."""
+        value = value.replace("\\", "\\\\").replace("\"", "\\\"")
+        value = value.replace("\n", "\\n").replace("\r", "\\r").replace("\t", "\\t")
+        return "\"" + value + "\""
+
+    def get_base_config(self):
+        """Creates the base curl config options shared by all requests.
 
         Adds the following arguments for all request:
             --location : Retry the request if the requested page has moved to a different location
@@ -115,105 +123,103 @@ class CurlHttpClient(HttpClient):
             --key      : Private key file name
 
         Returns:
-            An array containing all required arguments to invoke curl, example:
-            ["curl", "--location", "--silent", "--cert", "my_cert_file.crt", "--key", "my_key_file.key"]
+            A list of (option, value) tuples, value being None for options without a parameter, example:
+            [("--location", None), ("--silent", None), ("--cert", "my_cert_file.crt"), ("--key", "my_key_file.key")]
         """
         # basic options
-        cmd = [CURL_ALIAS, OPTION_LOCATION, OPTION_SILENT]
+        config = [(OPTION_LOCATION, None), (OPTION_SILENT, None)]
 
         # retry and timeout options
-        cmd += [OPTION_CONNECT_TIMEOUT, VALUE_CONNECT_TIMEOUT, OPTION_MAX_TIME, VALUE_MAX_TIME, OPTION_RETRY,
-                VALUE_RETRY, OPTION_RETRY_DELAY, VALUE_RETRY_DELAY, OPTION_RETRY_MAX_TIME, VALUE_RETRY_MAX_TIME]
+        config += [(OPTION_CONNECT_TIMEOUT, VALUE_CONNECT_TIMEOUT), (OPTION_MAX_TIME, VALUE_MAX_TIME),
+                   (OPTION_RETRY, VALUE_RETRY), (OPTION_RETRY_DELAY, VALUE_RETRY_DELAY),
+                   (OPTION_RETRY_MAX_TIME, VALUE_RETRY_MAX_TIME)]
 
         if self.cert_path is not None:
-            cmd.extend([OPTION_CERT, self.cert_path, OPTION_KEY, self.key_path])
+            config.extend([(OPTION_CERT, self.cert_path), (OPTION_KEY, self.key_path)])
 
         if self.proxy_configuration is not None:
-            cmd.extend([OPTION_PROXY, self.proxy_configuration])
-        return cmd
+            config.append((OPTION_PROXY, self.proxy_configuration))
+        return config
 
-    def build_request_cmd(self, url, headers, method=None, data_file_path=None):
-        """Formats the final cmd array to invoke Curl. The final cmd is created from the based command and additional
-        optional parameters.
+    def build_request_config(self, url, headers, method=None, data=None):
+        """Formats the curl config for a request. The config is created from the base config and additional optional
+        parameters.
+
+        The config is passed to curl on its stdin so that the headers and the request body neither show up in ps/top
+        nor have to be written to disk.
 
         Args:
-            url             : string    , the URL.
-            headers         : dictionary, contains the required headers.
-            method          : string    , specifies the http method to use.
-            data_file_path  : string    , data file path.
+            url     : string    , the URL.
+            headers : dictionary, contains the required headers.
+            method  : string    , specifies the http method to use.
+            data    : string    , the serialized request body.
 
-        Adds the following arguments to the base cmd when required:
+        Adds the following arguments to the base config when required:
             --write-out : Makes curl display information on stdout after a completed transfer (i.e status_code).
             --header    : Extra headers to include in the request when sending the request.
             --request   : Specifies a custom request method to use for the request.
+            --data      : The request body.
             --insecure  : Explicitly allows curl to perform "insecure" SSL connections and transfers.
 
         Returns:
-            An array containing the base cmd concatenated with any required extra argument, example:
-            ["curl", "--location", "--silent", "--cert", "my_cert_file.crt", "--key", "my_key_file.key", "--insecure",
-                "https://www.microsoft.com"]
+            A string containing the curl config, one option per line, example:
+            --location
+            --silent
+            --cert "my_cert_file.crt"
+            --key "my_key_file.key"
+            --insecure
+            --url "https://www.microsoft.com"
         """
-        cmd = self.get_base_cmd()
-        cmd.append(OPTION_WRITE_OUT)
-        cmd.append(STATUS_CODE_DELIMITER + CURL_HTTP_CODE_SPECIAL_VAR + "\n")
+        config = self.get_base_config()
+        config.append((OPTION_WRITE_OUT, STATUS_CODE_DELIMITER + CURL_HTTP_CODE_SPECIAL_VAR + "\n"))
 
         if headers is not None:
             for key, value in headers.iteritems():
-                cmd.append(OPTION_HEADER)
-                cmd.append(key + ": " + value)
+                config.append((OPTION_HEADER, key + ": " + value))
 
         if method is not None:
-            cmd.append(OPTION_REQUEST)
-            cmd.append(method)
-            if data_file_path is not None:
-                cmd.append(OPTION_DATA)
-                cmd.append("@" + data_file_path)
+            config.append((OPTION_REQUEST, method))
+            if data is not None:
+                config.append((OPTION_DATA, data))
 
         if self.insecure:
-            cmd.append(OPTION_INSECURE)
+            config.append((OPTION_INSECURE, None))
+
+        config.append((OPTION_URL, url))
 
-        cmd.append(url)
-        return cmd
+        lines = []
+        for option, value in config:
+            if value is None:
+                lines.append(option + "\n")
+            else:
+                lines.append(option + " " + self.quote_config_value(value) + "\n")
+        return "".join(lines)
 
     def issue_request(self, url, headers, method, data):
-        data_file_path = None
+        serialized_data = None
         headers = self.merge_headers(self.default_headers, headers)
 
-        # if a body is included, write it to a temporary file (prevent body from leaking in ps/top)
         if method != self.GET and data is not None:
             serialized_data = self.json.dumps(data)
 
-            # write data to disk
-            data_file_name = base64.standard_b64encode(str(time.time()) +
-                                                       str(random.randint(0, sys.maxint)) +
-                                                       str(random.randint(0, sys.maxint)) +
-                                                       str(random.randint(0, sys.maxint)) +
-                                                       str(random.randint(0, sys.maxint)))
-            data_file_path = os.path.join(configuration.get_temporary_request_directory_path(), data_file_name)
-            iohelper.write_to_file(data_file_path, serialized_data)
-
             # insert Content-Type header
             headers.update({self.CONTENT_TYPE_HEADER_KEY: self.APP_JSON_HEADER_VALUE})
 
-        # ** nesting of try statement is required since try/except/finally isn't supported prior to 2.5 **
         try:
-            try:
-                cmd = self.build_request_cmd(url, headers, method=method, data_file_path=data_file_path)
-                env = os.environ.copy()
-                p = subprocessfactory.create_subprocess(cmd, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                out, err = p.communicate()
-
-                if p.returncode != EXIT_SUCCESS:
-                    raise Exception("Http request failed due to curl error. [returncode=" + str(p.returncode) + "]" +
-                                    "[stderr=" + str(err) + "]")
-
-                return self.parse_raw_output(out)
-            except Exception, e:
-                raise Exception("Unknown exception while issuing request. [exception=" + str(e) + "]" +
-                                "[stacktrace=" + str(traceback.format_exc()) + "]")
-        finally:
-            if data_file_path is not None:
-                os.remove(data_file_path)
+            config = self.build_request_config(url, headers, method=method, data=serialized_data)
+            cmd = [CURL_ALIAS, OPTION_CONFIG, VALUE_STDIN]
+            p = subprocessfactory.create_subprocess(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                                    stdin=subprocess.PIPE)
+            out, err = p.communicate(config)
+
+            if p.returncode != EXIT_SUCCESS:
+                raise Exception("Http request failed due to curl error. [returncode=" + str(p.returncode) + "]" +
+                                "[stderr=" + str(err) + "]")
+
+            return self.parse_raw_output(out)
+        except Exception, e:
+            raise Exception("Unknown exception while issuing request. [exception=" + str(e) + "]" +
+                            "[stacktrace=" + str(traceback.format_exc()) + "]")
 
     def get(self, url, headers=None, data=None):
         """Issues a GET request to the provided url using the provided headers.
@@ -232,12 +232,15 @@ class Worker:
 
     @background_thread
     def monitor_sandbox_process_outputs(self, sandbox_id, process):
-        while process.poll() is None:
-            output = process.stdout.readline().replace("\n", "")
+        # readline blocks until the sandbox writes, it returns '' once the sandbox closed its stdout
+        while True:
+            output = process.stdout.readline()
             if output == '':
-                continue
+                break
+            output = output.replace("\n", "")
             if output != '':
                 tracer.log_sandbox_stdout(output)
+        process.wait()
 
         if process.poll() != 0:
             full_error_output = ""
@@ -4,7 +4,6 @@
 
 """Job module. Contains a class representation of an "automation" job."""
 
-import Queue
 import sys
 import time
 import traceback
@@ -17,7 +16,7 @@ import runtime
 import runtimefactory
 import tracer
 from automationconstants import pendingactions, jobstatus, jobtriggersource
-from streamhandler import StreamHandler
+from streamhandler import StreamHandler, STREAM_PROCESSING_COMPLETE
 from workerexception import *
 
 EXIT_SUCCESS = 0
@@ -117,23 +116,24 @@ class Job(Thread):
         self.runtime.start_runbook_subprocess()
 
         # monitor runbook output for streams
-        stream_handler = StreamHandler(self.job_data, self.runtime.runbook_subprocess, self.jrds_client)
+        stream_handler = StreamHandler(self.job_data, self.runtime.runbook_subprocess, self.jrds_client,
+                                       self.msg_queue)
         stream_handler.daemon = True
         stream_handler.start()
 
-        # wait for runbook execution to complete
+        # wait for runbook execution to complete, the stream handler queues STREAM_PROCESSING_COMPLETE once the
+        # runbook has exited and its output is uploaded; pending actions are handled as soon as they are queued
         pending_action = None
-        while stream_handler.isAlive() or self.runtime.runbook_subprocess.poll() is None:
-            try:
-                pending_action = self.msg_queue.get(block=False)
-                tracer.log_sandbox_job_pending_action_detected(self.job_id, pending_action)
-                if pending_action == pendingactions.STOP_ENUM_INDEX:
-                    self.jrds_client.set_job_status(self.sandbox_id, self.job_id, jobstatus.STOPPING, False)
-                    self.runtime.kill_runbook_subprocess()
-                    break
-            except Queue.Empty:
-                pass
-            time.sleep(0.2)
+        while True:
+            message = self.msg_queue.get()
+            if message == STREAM_PROCESSING_COMPLETE:
+                break
+            pending_action = message
+            tracer.log_sandbox_job_pending_action_detected(self.job_id, pending_action)
+            if pending_action == pendingactions.STOP_ENUM_INDEX:
+                self.jrds_client.set_job_status(self.sandbox_id, self.job_id, jobstatus.STOPPING, False)
+                self.runtime.kill_runbook_subprocess()
+                break
 
         # handle terminal state changes
         if pending_action == pendingactions.STOP_ENUM_INDEX:
@@ -4,6 +4,7 @@
 
 """Stream handler module. Is used to process output from stdout and stderr"""
 
+import Queue
 import codecs
 import traceback
 from threading import Thread
@@ -22,21 +23,32 @@ STREAM_TYPE_OUTPUT = "Output"
 STREAM_TYPE_VERBOSE = "Verbose"
 STREAM_TYPE_WARNING = "Warning"
 
+# Lines are uploaded by STREAM_UPLOAD_THREADS threads, one stream record per line, each numbered in the order it was
+# read. The threads share the keep-alive connections of the jrds client. The reader only waits for the uploaders when
+# STREAM_QUEUE_SIZE lines are waiting to be uploaded.
+STREAM_QUEUE_SIZE = 10000
+STREAM_UPLOAD_THREADS = 4
+
+# Queued on the job's message queue once the runbook has exited and its streams are uploaded.
+STREAM_PROCESSING_COMPLETE = "stream_processing_complete"
+
 
 class StreamHandler(Thread):
     """Stream handler class."""
 
-    def __init__(self, job_data, runtime_process, jrds_client):
+    def __init__(self, job_data, runtime_process, jrds_client, msg_queue=None):
         """
         :type job_data: jrdsclient.JobData
         :type runtime_process :
         :type jrds_client : jrdsclient.JRDSClient
+        :type msg_queue : Queue.Queue, receives STREAM_PROCESSING_COMPLETE when the handler is done
         """
         Thread.__init__(self)
         self.daemon = True
         self.job_data = job_data
         self.runtime_process = runtime_process
         self.jrds_client = jrds_client
+        self.msg_queue = msg_queue
 
     def run(self):
         """Monitor the job's subprocess for output (which will be uploaded as streams).
@@ -46,32 +58,45 @@ class StreamHandler(Thread):
 
         IMPORTANT: Do not log streams to cloud.
         """
-        stream_count = 0
+        self.uploader = StreamUploader(self.job_data, self.jrds_client)
+        self.uploader.start()
+        try:
+            self.read_streams()
+        finally:
+            # the job is done once the streams read so far are uploaded
+            self.uploader.close()
+            self.uploader.join()
+            if self.msg_queue is not None:
+                self.msg_queue.put(STREAM_PROCESSING_COMPLETE)
+        tracer.log_sandbox_job_streamhandler_processing_complete(self.job_data.job_id)
+
+    def read_streams(self):
         while True:
             try:
                 output = codecs.getwriter('utf8')(self.runtime_process.stdout).readline()
-                if output == '' and self.runtime_process.poll() is not None:
+                if output == '':
+                    # end of output, block until the runbook exits rather than polling for it
+                    self.runtime_process.wait()
                     break
                 elif output:
                     if output.startswith(PREFIX_DEBUG.lower()) or \
                             output.startswith(PREFIX_DEBUG.upper()) or \
                             output.startswith(PREFIX_DEBUG.capitalize()):
-                        self.process_debug_stream(stream_count, output)
+                        self.process_debug_stream(output)
                     elif output.startswith(PREFIX_ERROR.lower()) or \
                             output.startswith(PREFIX_ERROR.upper()) or \
                             output.startswith(PREFIX_ERROR.capitalize()):
-                        self.process_error_stream(stream_count, output)
+                        self.process_error_stream(output)
                     elif output.startswith(PREFIX_VERBOSE.lower()) or \
                             output.startswith(PREFIX_VERBOSE.upper()) or \
                             output.startswith(PREFIX_VERBOSE.capitalize()):
-                        self.process_verbose_stream(stream_count, output)
+                        self.process_verbose_stream(output)
                     elif output.startswith(PREFIX_WARNING.lower()) or \
                             output.startswith(PREFIX_WARNING.upper()) or \
                             output.startswith(PREFIX_WARNING.capitalize()):
-                        self.process_warning_stream(stream_count, output)
+                        self.process_warning_stream(output)
                     else:
-                        self.process_output_stream(stream_count, output)
-                    stream_count += 1
+                        self.process_output_stream(output)
 
                     # leave trace at the end to prevent encoding issue from pushing streams to cloud
                     # leave this as debug trace to prevent logging customer streams to automation logs
@@ -79,28 +104,77 @@ class StreamHandler(Thread):
             except:
                 tracer.log_sandbox_job_streamhandler_unhandled_exception(self.job_data.job_id, traceback.format_exc())
                 continue
-        tracer.log_sandbox_job_streamhandler_processing_complete(self.job_data.job_id)
 
-    def process_debug_stream(self, stream_count, output):
-        self.set_stream(stream_count, STREAM_TYPE_DEBUG, output)
+    def process_debug_stream(self, output):
+        self.set_stream(STREAM_TYPE_DEBUG, output)
         pass
 
-    def process_error_stream(self, stream_count, output):
-        self.set_stream(stream_count, STREAM_TYPE_ERROR, output)
+    def process_error_stream(self, output):
+        self.set_stream(STREAM_TYPE_ERROR, output)
         pass
 
-    def process_output_stream(self, stream_count, output):
-        self.set_stream(stream_count, STREAM_TYPE_OUTPUT, output)
+    def process_output_stream(self, output):
+        self.set_stream(STREAM_TYPE_OUTPUT, output)
         pass
 
-    def process_verbose_stream(self, stream_count, output):
-        self.set_stream(stream_count, STREAM_TYPE_VERBOSE, output)
+    def process_verbose_stream(self, output):
+        self.set_stream(STREAM_TYPE_VERBOSE, output)
         pass
 
-    def process_warning_stream(self, stream_count, output):
-        self.set_stream(stream_count, STREAM_TYPE_WARNING, output)
+    def process_warning_stream(self, output):
+        self.set_stream(STREAM_TYPE_WARNING, output)
         pass
 
-    def set_stream(self, stream_count, stream_type, output):
-        self.jrds_client.set_stream(self.job_data.job_id, self.job_data.runbook_version_id, output.strip(),
-                                    stream_type, stream_count)
+    def set_stream(self, stream_type, output):
+        self.uploader.add(stream_type, output.strip())
+
+
+class StreamUploader:
+    """Uploads the lines read by a StreamHandler on STREAM_UPLOAD_THREADS threads, one stream record per line. Each
+    record's sequence number is the order its line was read in.
+    """
+
+    def __init__(self, job_data, jrds_client):
+        """
+        :type job_data: jrdsclient.JobData
+        :type jrds_client : jrdsclient.JRDSClient
+        """
+        self.job_data = job_data
+        self.jrds_client = jrds_client
+        self.lines = Queue.Queue(STREAM_QUEUE_SIZE)
+        self.stream_count = 0
+        self.threads = []
+        for i in range(STREAM_UPLOAD_THREADS):
+            thread = Thread(target=self.upload_streams)
+            thread.daemon = True
+            self.threads.append(thread)
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def add(self, stream_type, text):
+        """Queues a line for upload, waiting only if the uploaders are STREAM_QUEUE_SIZE lines behind."""
+        self.lines.put((stream_type, text, self.stream_count))
+        self.stream_count += 1
+
+    def close(self):
+        """Uploads the remaining lines and stops the uploaders."""
+        for thread in self.threads:
+            self.lines.put(None)
+
+    def join(self):
+        for thread in self.threads:
+            thread.join()
+
+    def upload_streams(self):
+        while True:
+            line = self.lines.get()
+            if line is None:
+                break
+            stream_type, text, sequence_number = line
+            try:
+                self.jrds_client.set_stream(self.job_data.job_id, self.job_data.runbook_version_id, text,
+                                            stream_type, sequence_number)
+            except:
+                tracer.log_sandbox_job_streamhandler_unhandled_exception(self.job_data.job_id, traceback.format_exc())
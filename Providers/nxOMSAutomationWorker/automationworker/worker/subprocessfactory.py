@@ -29,7 +29,7 @@ import sys
 CTYPES_MODULE_NAME = "ctypes"
 
 
-def create_subprocess(cmd, env=None, stdout=None, stderr=None, cwd=None):
+def create_subprocess(cmd, env=None, stdout=None, stderr=None, cwd=None, stdin=None):
     """Creates a process forcing and sets the SIGTERM signal handler using Ctypes (when available). Else creates a
     process based on the pipe_output argument.
 
@@ -40,12 +40,13 @@ def create_subprocess(cmd, env=None, stdout=None, stderr=None, cwd=None):
         env         : dictonary(string) , the process level environment variable.
         stdout      : boolean           , sets the stdout to subprocess.PIPE when True, else stdout is left untouched.
         stderr      : boolean           , sets the stderr to subprocess.PIPE when True, else stdout is left untouched.
+        stdin       : boolean           , sets the stdin to subprocess.PIPE when True, else stdin is left untouched.
 
     Returns:
         The process object.
     """
     if CTYPES_MODULE_NAME not in sys.modules or os.name.lower() == "nt":
-        return subprocess.Popen(cmd, env=env, stdout=stdout, stderr=stderr, cwd=cwd)
+        return subprocess.Popen(cmd, env=env, stdout=stdout, stderr=stderr, cwd=cwd, stdin=stdin)
     else:
-        return subprocess.Popen(cmd, env=env, stdout=stdout, stderr=stderr, cwd=cwd,
+        return subprocess.Popen(cmd, env=env, stdout=stdout, stderr=stderr, cwd=cwd, stdin=stdin,
                                 preexec_fn=set_process_death_signal(signal.SIGTERM))
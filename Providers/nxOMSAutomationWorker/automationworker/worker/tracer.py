@@ -4,6 +4,8 @@
 
 """Tracer module."""
 
+import Queue
+import atexit
 import inspect
 import logging
 import logging.handlers
@@ -32,6 +34,18 @@ sandbox_id = None
 default_logger = None
 sandbox_stdout = None
 
+# Traces are written to the log file / STDOUT by the thread tracing them. Their cloud traces are sent by a single
+# sender thread taking them from a queue of at most TRACE_QUEUE_SIZE traces, instead of by a new thread per trace, so
+# they are sent in the order they were queued. Cloud traces that don't fit in the queue are dropped and counted. At
+# exit, the queued traces are given TRACE_FLUSH_TIMEOUT seconds to be sent.
+TRACE_QUEUE_SIZE = 10000
+TRACE_FLUSH_TIMEOUT = 10
+
+trace_queue = None
+trace_queue_lock = threading.Lock()
+trace_stats = {"queued": 0, "sent": 0, "dropped": 0, "pending": 0}
+reported_dropped_traces = 0
+
 
 def safe_trace(func):
     def decorated_func(*args, **kwargs):
@@ -49,13 +63,89 @@ def safe_trace(func):
 
 def background_thread(func):
     def decorated_func(*args, **kwargs):
-        t = threading.Thread(target=func, args=args, kwargs=kwargs)
-        t.daemon = True
-        t.start()
+        queue_trace(func, args, kwargs)
 
     return decorated_func
 
 
+def get_trace_queue():
+    """Returns the trace queue, starting the sender thread the first time."""
+    global trace_queue
+    trace_queue_lock.acquire()
+    try:
+        if trace_queue is None:
+            trace_queue = Queue.Queue(TRACE_QUEUE_SIZE)
+            t = threading.Thread(target=send_traces, args=(trace_queue,))
+            t.daemon = True
+            t.start()
+            atexit.register(flush_traces)
+        return trace_queue
+    finally:
+        trace_queue_lock.release()
+
+
+def queue_trace(func, args, kwargs):
+    """Queues func(*args, **kwargs) for the sender thread, dropping it if the queue is full."""
+    queue = get_trace_queue()
+    trace_queue_lock.acquire()
+    try:
+        trace_stats["pending"] += 1
+    finally:
+        trace_queue_lock.release()
+    try:
+        queue.put_nowait((func, args, kwargs))
+        queued = "queued"
+    except Queue.Full:
+        queued = "dropped"
+    trace_queue_lock.acquire()
+    try:
+        trace_stats[queued] += 1
+        if queued == "dropped":
+            trace_stats["pending"] -= 1
+    finally:
+        trace_queue_lock.release()
+
+
+def send_traces(queue):
+    """Sender thread, runs the queued traces in order. Traces dropped while the queue was full are reported once it
+    has drained.
+    """
+    global reported_dropped_traces
+    while True:
+        func, args, kwargs = queue.get()
+        try:
+            func(*args, **kwargs)
+        finally:
+            dropped = 0
+            trace_queue_lock.acquire()
+            try:
+                trace_stats["sent"] += 1
+                trace_stats["pending"] -= 1
+                if trace_stats["pending"] == 0:
+                    dropped = trace_stats["dropped"] - reported_dropped_traces
+                    reported_dropped_traces = trace_stats["dropped"]
+            finally:
+                trace_queue_lock.release()
+        if dropped > 0 and default_logger is not None:
+            default_logger.warning("Trace queue full, dropped " + str(dropped) + " traces.")
+
+
+def get_trace_stats():
+    """Returns the number of traces queued, sent, dropped and still pending."""
+    trace_queue_lock.acquire()
+    try:
+        return trace_stats.copy()
+    finally:
+        trace_queue_lock.release()
+
+
+def flush_traces(timeout=TRACE_FLUSH_TIMEOUT):
+    """Waits at most timeout seconds for the queued traces to be sent."""
+    deadline = time.time() + timeout
+    while get_trace_stats()["pending"] > 0 and time.time() < deadline:
+        time.sleep(0.05)
+
+
 def init():
     """Initializes all required variable for the tracer."""
     global jrds_client, jrds_cert_path, jrds_key_path, jrds_base_uri, subscription_id, \
@@ -129,13 +219,12 @@ def init_logger():
     sandbox_stdout.addHandler(sandbox_log_stream)
 
 
-@background_thread
 @safe_trace
 def trace_generic_hybrid_worker_event_async(event_id, task_name, message, t_id, keyword, activity_id=None, debug=False):
-    """Invokes trace_generic_hybrid_worker_event in an asynchronously.
+    """Write the trace to STDOUT / log file (on disk) and queue it for MDS (in the cloud).
 
     Note:
-        This method run in a background thread.
+        The cloud trace is sent by the trace sender thread, the local trace doesn't wait for it.
 
     Args:
         event_id    : int   , the event id. This event id doesn't have to map to an ETW event id in the cloud.
@@ -146,7 +235,10 @@ def trace_generic_hybrid_worker_event_async(event_id, task_name, message, t_id,
         activity_id : string, the activity id.
         debug       : boolean, the debug flag
     """
-    trace_generic_hybrid_worker_event(event_id, task_name, message, t_id, keyword, activity_id=activity_id, debug=debug)
+    cloud_trace = trace_generic_hybrid_worker_event_locally(event_id, task_name, message, t_id, keyword,
+                                                            activity_id=activity_id, debug=debug)
+    if cloud_trace is not None:
+        format_and_issue_generic_hybrid_worker_trace_async(*cloud_trace)
 
 
 def trace_generic_hybrid_worker_event(event_id, task_name, message, t_id, keyword, activity_id=None, debug=False):
@@ -161,17 +253,39 @@ def trace_generic_hybrid_worker_event(event_id, task_name, message, t_id, keywor
         activity_id : string, the activity id.
         debug       : boolean, the debug flag
     """
+    cloud_trace = trace_generic_hybrid_worker_event_locally(event_id, task_name, message, t_id, keyword,
+                                                            activity_id=activity_id, debug=debug)
+    if cloud_trace is not None:
+        format_and_issue_generic_hybrid_worker_trace(*cloud_trace)
+
+
+def trace_generic_hybrid_worker_event_locally(event_id, task_name, message, t_id, keyword, activity_id=None,
+                                              debug=False):
+    """Write the trace to STDOUT / log file (on disk).
+
+    Args:
+        event_id    : int   , the event id. This event id doesn't have to map to an ETW event id in the cloud.
+        task_name   : string, the task name.
+        message     : string, the message.
+        t_id        : int   , the thread id.
+        keyword     : string, the keyword.
+        activity_id : string, the activity id.
+        debug       : boolean, the debug flag
+
+    Returns:
+        The format_and_issue_generic_hybrid_worker_trace arguments of its MDS trace, None if it has none.
+    """
     # # # # # # # # # # # # # # # # # # # #
     # for tests, disregard tracer
     if os.getenv('test_mode', None) is not None:
-        return
+        return None
     # # # # # # # # # # # # # # # # # # # #
 
     if jrds_client is None or default_logger is None:
         init()
 
     if debug and not configuration.get_debug_traces():
-        return
+        return None
 
     if task_name.startswith("log"):
         task_name = "_".join(task_name.split("_")[1:])
@@ -193,8 +307,9 @@ def trace_generic_hybrid_worker_event(event_id, task_name, message, t_id, keywor
         pass
 
     # MDS
-    if not debug:
-        format_and_issue_generic_hybrid_worker_trace(event_id, task_name, message, t_id, keyword, activity_id)
+    if debug:
+        return None
+    return event_id, task_name, message, t_id, keyword, activity_id
 
 
 @background_thread
@@ -203,7 +318,7 @@ def trace_etw_event(event_id, activity_id, log_type, arg_array):
     """Write the trace to STDOUT / log file (on disk) / to MDS (in the cloud).
 
     Note:
-        This method run in a background thread.
+        This method is run by the trace sender thread.
 
     Args:
         event_id    : int   , the event id. This event id doesn't have to map to an ETW event id in the cloud.
@@ -224,6 +339,17 @@ def trace_etw_event(event_id, activity_id, log_type, arg_array):
     issue_jrds_trace(event_id, activity_id, log_type, arg_array)
 
 
+@background_thread
+@safe_trace
+def format_and_issue_generic_hybrid_worker_trace_async(event_id, task_name, message, t_id, keyword, activity_id):
+    """Invokes format_and_issue_generic_hybrid_worker_trace asynchronously.
+
+    Note:
+        This method is run by the trace sender thread.
+    """
+    format_and_issue_generic_hybrid_worker_trace(event_id, task_name, message, t_id, keyword, activity_id)
+
+
 def format_and_issue_generic_hybrid_worker_trace(event_id, task_name, message, t_id, keyword, activity_id):
     """Send the trace to MDS (in the cloud) using the JRDS api.
 
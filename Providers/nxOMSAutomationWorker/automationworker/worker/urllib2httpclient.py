@@ -4,11 +4,16 @@
 
 """Urllib2 HttpClient."""
 
+import errno
 import httplib
 import socket
+import threading
 import time
 import traceback
+import urllib
 import urllib2
+import urlparse
+from StringIO import StringIO
 
 from httpclient import *
 from workerexception import *
@@ -19,6 +24,13 @@ PY_MICRO_VERSION = 2
 
 SSL_MODULE_NAME = "ssl"
 
+# Timeout in seconds of a request, pooled or not. urllib2 opens its connections with the timeout given to
+# OpenerDirector.open, not with the get_https_connection default.
+REQUEST_TIMEOUT = 30
+
+# Idle connections kept open for each host by a connection pool.
+MAX_IDLE_CONNECTIONS_PER_HOST = 4
+
 # On some system the ssl module might be missing
 try:
     import ssl
@@ -47,7 +59,7 @@ class HttpsClientHandler(urllib2.HTTPSHandler):
     def https_open(self, req):
         return self.do_open(self.get_https_connection, req, context=self._context)
 
-    def get_https_connection(self, host, context=None, timeout=180):
+    def get_https_connection(self, host, context=None, timeout=REQUEST_TIMEOUT):
         """urllib2's AbstractHttpHandler will invoke this method with the host/timeout parameter. See urllib2's
         AbstractHttpHandler for more details.
 
@@ -67,6 +79,97 @@ class HttpsClientHandler(urllib2.HTTPSHandler):
                                            context=context)
 
 
+class HttpsConnectionPool:
+    """Keeps the HTTPS connections to each host open between requests so that they only pay the TCP and TLS
+    handshakes once. All connections share one ssl context holding the client certificate.
+
+    A connection is taken out of the pool for the duration of a request, so threads never share a connection.
+    """
+
+    def __init__(self, cert_path, key_path, insecure=False):
+        self.ssl_context = ssl.create_default_context()
+        if insecure:
+            self.ssl_context.check_hostname = False
+            self.ssl_context.verify_mode = ssl.CERT_NONE
+        if cert_path is not None and key_path is not None:
+            self.ssl_context.load_cert_chain(cert_path, key_path)
+        self.idle_connections = {}
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "connections_created": 0, "connections_reused": 0, "stale_connections": 0}
+
+    def get_connection(self, host, port):
+        """Returns (connection, reused), an idle connection to host:port if there is one or else a new one."""
+        self.lock.acquire()
+        try:
+            self.stats["requests"] += 1
+            idle = self.idle_connections.get((host, port))
+            if idle:
+                self.stats["connections_reused"] += 1
+                return idle.pop(), True
+            self.stats["connections_created"] += 1
+        finally:
+            self.lock.release()
+        return httplib.HTTPSConnection(host, port, timeout=REQUEST_TIMEOUT, context=self.ssl_context), False
+
+    def release_connection(self, connection):
+        """Returns connection to the pool once its response has been read."""
+        self.lock.acquire()
+        try:
+            idle = self.idle_connections.setdefault((connection.host, connection.port), [])
+            if len(idle) < MAX_IDLE_CONNECTIONS_PER_HOST:
+                idle.append(connection)
+                return
+        finally:
+            self.lock.release()
+        connection.close()
+
+    def discard_connection(self, connection, stale=False):
+        """Closes connection. When it went stale, the server most likely closed the idle connections to its host as
+        well, so they are closed too.
+        """
+        closed = [connection]
+        self.lock.acquire()
+        try:
+            if stale:
+                self.stats["stale_connections"] += 1
+                closed.extend(self.idle_connections.pop((connection.host, connection.port), []))
+        finally:
+            self.lock.release()
+        for closed_connection in closed:
+            closed_connection.close()
+
+    def get_stats(self):
+        """Returns the pool statistics.
+
+        Returns:
+            A dictionary with the number of requests, connections created, connections reused, stale connections
+            and connections currently idle.
+        """
+        self.lock.acquire()
+        try:
+            stats = self.stats.copy()
+            stats["idle_connections"] = sum([len(idle) for idle in self.idle_connections.values()])
+        finally:
+            self.lock.release()
+        return stats
+
+
+connection_pools = {}
+connection_pools_lock = threading.Lock()
+
+
+def get_connection_pool(cert_path, key_path, insecure):
+    """Returns the process wide connection pool for the given certificate."""
+    key = (cert_path, key_path, insecure)
+    connection_pools_lock.acquire()
+    try:
+        if key not in connection_pools:
+            connection_pools[key] = HttpsConnectionPool(cert_path, key_path, insecure)
+        return connection_pools[key]
+    finally:
+        connection_pools_lock.release()
+
+
 def request_retry_handler(func):
     def decorated_func(*args, **kwargs):
         max_retry_count = 3
@@ -81,6 +184,8 @@ def request_retry_handler(func):
                     if type(exception).__name__ == 'SSLError':
                         time.sleep(5 + iteration)
                         continue
+                if isinstance(exception, StaleConnectionException):
+                    continue
                 raise exception
     return decorated_func
 
@@ -98,6 +203,9 @@ class Urllib2HttpClient(HttpClient):
 
     def __init__(self, cert_path, key_path, insecure=False, proxy_configuration=None):
         HttpClient.__init__(self, cert_path, key_path, insecure, proxy_configuration)
+        self.connection_pool = None
+        if ssl is not None and proxy_configuration is None:
+            self.connection_pool = get_connection_pool(cert_path, key_path, insecure)
 
     @request_retry_handler
     def issue_request(self, url, headers, method=None, data=None):
@@ -112,6 +220,9 @@ class Urllib2HttpClient(HttpClient):
             A RequestResponse
             :param method:
         """
+        if self.connection_pool is not None:
+            return self.issue_pooled_request(url, headers, method, data)
+
         https_handler = HttpsClientHandler(self.cert_path, self.key_path, self.insecure)
         opener = urllib2.build_opener(https_handler)
         if self.proxy_configuration is not None:
@@ -120,12 +231,82 @@ class Urllib2HttpClient(HttpClient):
             opener.add_handler(proxy_handler)
         req = urllib2.Request(url, data=data, headers=headers)
         req.get_method = lambda: method
-        response = opener.open(req, timeout=30)
+        response = opener.open(req, timeout=REQUEST_TIMEOUT)
         opener.close()
         https_handler.close()
 
         return response
 
+    def issue_pooled_request(self, url, headers, method, data):
+        """Issues the request on a connection of the connection pool.
+
+        Returns:
+            A response with the same interface as the one returned by urllib2.
+
+        Raises:
+            urllib2.HTTPError for the status codes urllib2 raises it for. StaleConnectionException when a pooled
+            connection turns out to have been closed by the server before it could answer the request (see
+            is_stale_connection_error), request_retry_handler then retries the request. Other errors, including
+            timeouts, are raised as they are.
+        """
+        parsed_url = urlparse.urlparse(url)
+        path = parsed_url.path
+        if parsed_url.query:
+            path += "?" + parsed_url.query
+        port = parsed_url.port or httplib.HTTPS_PORT
+
+        connection, reused = self.connection_pool.get_connection(parsed_url.hostname, port)
+        sending = True
+        try:
+            connection.request(method, path, data, headers)
+            sending = False
+            response = connection.getresponse()
+            body = response.read()
+        except Exception:
+            stale = reused and self.is_stale_connection_error(sys.exc_info()[1], sending)
+            self.connection_pool.discard_connection(connection, stale)
+            if stale:
+                raise StaleConnectionException()
+            raise
+
+        if response.will_close:
+            self.connection_pool.discard_connection(connection)
+        else:
+            self.connection_pool.release_connection(connection)
+
+        if not 200 <= response.status < 300:
+            raise urllib2.HTTPError(url, response.status, response.reason, response.msg, StringIO(body))
+        return urllib.addinfourl(StringIO(body), response.msg, url, response.status)
+
+    @staticmethod
+    def is_stale_connection_error(exception, sending):
+        """Tells whether exception shows that an idle connection had been closed by the server.
+
+        That is the case for errors while sending the request, and for an empty status line or a reset connection
+        when reading the response. Only then is it safe to send a request that isn't idempotent again. Timeouts are
+        never treated as a stale connection.
+
+        Args:
+            exception   : Exception , the exception raised by the request.
+            sending     : boolean   , True if it was raised while sending the request.
+        """
+        # ssl reports timeouts as SSLError("The read operation timed out")
+        if isinstance(exception, socket.timeout) or "timed out" in str(exception):
+            return False
+        if sending:
+            return isinstance(exception, (httplib.HTTPException, socket.error))
+        if isinstance(exception, httplib.BadStatusLine):
+            return exception.line in ("", "''")
+        if isinstance(exception, socket.error):
+            return len(exception.args) > 0 and exception.args[0] in (errno.ECONNRESET, errno.EPIPE)
+        return False
+
+    def get_pool_stats(self):
+        """Returns the connection pool statistics, or None if requests don't go through the connection pool."""
+        if self.connection_pool is None:
+            return None
+        return self.connection_pool.get_stats()
+
     def get(self, url, headers=None):
         """Issues a GET request to the provided url and using the provided headers.
 
@@ -97,4 +97,11 @@ class FileNotFoundException(Exception):
 
 class RetryAttemptExceededException(Exception):
     def __init__(self, exception):
-        Exception.__init__(self, "Retry attempt exceeded. [exception=" + str(exception) + "]")
\ No newline at end of file
+        Exception.__init__(self, "Retry attempt exceeded. [exception=" + str(exception) + "]")
+
+class StaleConnectionException(Exception):
+    def __init__(self, msg=None):
+        if msg is None:
+            self.message = "Pooled connection was closed by the server."
+        else:
+            self.message = msg